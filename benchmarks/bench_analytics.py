@@ -0,0 +1,92 @@
+"""
+价格分析基准测试：对比 ORM 聚合查询和内存列式快照 + NumPy（books/analytics.py）
+
+用法：python -m benchmarks.bench_analytics [图书数量] [修改价格的图书数量]
+💡 顺便校验两边的分组数量一致
+"""
+import random
+import sys
+import time
+
+from benchmarks.common import bench_database, print_table, seed_catalog, timeit
+
+
+def main(book_count=50000, changed=100):
+    from django.db.models import Avg, Count, F, Max, Min
+    from django.db.models.functions import ExtractYear, Floor
+
+    from books import analytics
+    from books.models import Book
+
+    percentiles = [25, 50, 75, 90, 99]
+    width = 10
+
+    with bench_database():
+        seed_catalog(books=book_count)
+        price_analytics = analytics.PriceAnalytics()
+        start = time.perf_counter()
+        snapshot = price_analytics.get_snapshot()
+        load_seconds = time.perf_counter() - start
+        everything = snapshot.mask()
+
+        def orm_percentiles():
+            # SQLite 没有分位数函数：先数总数，每个分位数 ORDER BY price 再 OFFSET 取一行
+            count = Book.objects.count()
+            return [
+                Book.objects.order_by('price').values_list('price', flat=True)[int((count - 1) * p / 100)]
+                for p in percentiles
+            ]
+
+        def orm_histogram():
+            return list(
+                Book.objects.annotate(band=Floor(F('price') / width)).values('band')
+                .annotate(count=Count('id')).order_by('band')
+            )
+
+        def orm_group(field):
+            return list(
+                Book.objects.values(field).annotate(
+                    count=Count('id'), average=Avg('price'), low=Min('price'), high=Max('price')
+                ).order_by(field)
+            )
+
+        def orm_trend():
+            return list(
+                Book.objects.annotate(year=ExtractYear('published_date')).values('year')
+                .annotate(count=Count('id'), average=Avg('price')).order_by('year')
+            )
+
+        for by, field in (('author', 'author_id'), ('tag', 'tags'), ('year', None)):
+            expected = len(orm_trend()) if by == 'year' else len([row for row in orm_group(field) if row[field]])
+            assert len(snapshot.group_by(everything, by)) == expected, f'按 {by} 分组的数量不一致'
+
+        rows = [
+            ['分位数（5 个）', f'{timeit(orm_percentiles):.1f}',
+             f'{timeit(lambda: snapshot.summary(snapshot.mask(), percentiles)):.1f}'],
+            ['价格直方图', f'{timeit(orm_histogram):.1f}', f'{timeit(lambda: snapshot.histogram(snapshot.mask(), width)):.1f}'],
+            ['按作者分组', f'{timeit(lambda: orm_group("author_id")):.1f}',
+             f'{timeit(lambda: snapshot.group_by(snapshot.mask(), "author")):.1f}'],
+            ['按标签分组', f'{timeit(lambda: orm_group("tags")):.1f}',
+             f'{timeit(lambda: snapshot.group_by(snapshot.mask(), "tag")):.1f}'],
+            ['逐年趋势', f'{timeit(orm_trend):.1f}', f'{timeit(lambda: snapshot.trend(snapshot.mask())):.1f}'],
+        ]
+        print_table(f'{book_count} 本书', ['查询', 'ORM 聚合(ms)', 'NumPy(ms)'], rows)
+
+        # 修改一部分图书的价格（save() 会写变更日志），再增量刷新
+        rng = random.Random(3)
+        for book in Book.objects.filter(pk__in=rng.sample(list(snapshot.ids.tolist()), changed)):
+            book.price = rng.randint(100, 20000) / 100
+            book.save()
+        start = time.perf_counter()
+        price_analytics.get_snapshot()
+        refresh_seconds = time.perf_counter() - start
+        assert price_analytics.full_loads == 1, '应该增量刷新'
+        print_table(
+            '快照',
+            ['操作', '耗时(ms)'],
+            [['整体加载', f'{load_seconds * 1000:.0f}'], [f'修改 {changed} 本价格后增量刷新', f'{refresh_seconds * 1000:.1f}']],
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""
+作者带最新图书基准测试：一页作者各带最新的 N 本书（`GET /api/authors/?include_books=N`）
+
+用法：python -m benchmarks.bench_author_books [图书数量] [作者数量] [N]
+对比三种做法：
+- prefetch：`prefetch_related('book_set')` 把每个作者的全部图书读进内存再截取
+- 逐个作者查询：N+1
+- 窗口函数：`ROW_NUMBER() OVER (PARTITION BY author_id ...)`，一条查询（AuthorViewSet.get_latest_books）
+"""
+import sys
+
+from benchmarks.common import bench_database, print_table, seed_catalog, timeit
+
+
+def main(book_count=50000, author_count=100, limit=5):
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+
+    from books.models import Author, Book
+    from books.views import AuthorViewSet
+
+    with bench_database():
+        seed_catalog(books=book_count, authors=author_count)
+        authors = list(Author.objects.order_by('id')[:20])
+        author_ids = [author.pk for author in authors]
+        view = AuthorViewSet()
+        view.request = RequestFactory().get('/api/authors/')
+        view.request.user = User(is_staff=True)
+
+        def prefetch():
+            return {
+                author.pk: sorted(author.book_set.all(), key=lambda book: (book.published_date, book.pk), reverse=True)[:limit]
+                for author in Author.objects.filter(pk__in=author_ids).prefetch_related(
+                    'book_set__author', 'book_set__owner', 'book_set__tags'
+                )
+            }
+
+        def per_author():
+            return {
+                author_id: list(
+                    Book.objects.filter(author_id=author_id).select_related('author', 'owner').prefetch_related('tags')
+                    .order_by('-published_date', '-id')[:limit]
+                )
+                for author_id in author_ids
+            }
+
+        def window():
+            return view.get_latest_books(author_ids, limit)
+
+        expected = {author_id: [book.pk for book in books] for author_id, books in per_author().items()}
+        assert {author_id: [book.pk for book in books] for author_id, books in window().items()} == expected
+        rows = [
+            ['prefetch 全部图书（含作者、标签）', f'{timeit(prefetch):.1f}'],
+            ['逐个作者查询（N+1，含作者、标签）', f'{timeit(per_author):.1f}'],
+            ['窗口函数（含作者、标签）', f'{timeit(window):.1f}'],
+        ]
+        print_table(
+            f'{book_count} 本书、{author_count} 个作者，一页 20 个作者各取最新 {limit} 本', ['做法', '耗时(ms)'], rows
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""
+作者 / 标签图书数量基准测试：对比“每次请求 annotate(Count(...))”和读冗余字段 `book_count`（books/bookcounts.py）
+
+用法：python -m benchmarks.bench_book_counts [图书数量] [作者数量]
+💡 测试数据用 bulk_create 生成（不发送信号），先执行一次 reconcile 填上计数
+"""
+import sys
+import time
+
+from benchmarks.common import bench_database, print_table, seed_catalog, timeit
+
+
+def main(book_count=50000, author_count=5000):
+    from django.db.models import Count
+
+    from books import bookcounts
+    from books.models import Author, Tag
+
+    with bench_database():
+        seed_catalog(books=book_count, authors=author_count, tags=500)
+        start = time.perf_counter()
+        bookcounts.reconcile()
+        reconcile_seconds = time.perf_counter() - start
+
+        def annotated(model, relation):
+            return list(model.objects.annotate(count=Count(relation)).order_by('-count', 'id')[:20])
+
+        def denormalized(model):
+            return list(model.objects.order_by('-book_count', 'id')[:20])
+
+        assert [a.count for a in annotated(Author, 'book')] == [a.book_count for a in denormalized(Author)]
+        rows = [
+            ['作者：图书最多的前 20 个', f'{timeit(lambda: annotated(Author, "book")):.1f}',
+             f'{timeit(lambda: denormalized(Author)):.1f}'],
+            ['标签：图书最多的前 20 个', f'{timeit(lambda: annotated(Tag, "book")):.1f}',
+             f'{timeit(lambda: denormalized(Tag)):.1f}'],
+            ['作者：图书数量 ≥ 15',
+             f'{timeit(lambda: list(Author.objects.annotate(count=Count("book")).filter(count__gte=15))):.1f}',
+             f'{timeit(lambda: list(Author.objects.filter(book_count__gte=15))):.1f}'],
+        ]
+        print_table(
+            f'{book_count} 本书、{author_count} 个作者、500 个标签', ['查询', 'annotate(Count)(ms)', 'book_count(ms)'], rows
+        )
+        print(f'reconcile 全量修正耗时 {reconcile_seconds * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
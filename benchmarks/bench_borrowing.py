@@ -0,0 +1,91 @@
+"""
+借阅并发压测：很多用户同时抢借同一批图书，检查有没有超借（借出数量超过库存），并对比吞吐量（books/inventory.py）
+
+用法：python -m benchmarks.bench_borrowing [线程数] [图书数] [每本库存]
+每个线程是一个不同的用户，把每本书都借一次（顺序打乱），所以每本书会被 线程数 个请求同时争抢
+💡 使用临时的 SQLite 文件数据库，和 bench_writes 一样
+"""
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from benchmarks.bench_writes import run_clients
+from benchmarks.common import bench_database, print_table
+
+
+def naive_borrow(book, user):
+    """
+    对照组：先读库存、判断、再写回（读和写之间让出 CPU，模拟请求处理中的其它工作）
+    """
+    from books.exceptions import BookOutOfStockError
+    from books.models import Book, Borrowing
+
+    stock = Book.objects.values_list('stock', flat=True).get(pk=book.pk)
+    if stock <= 0:
+        raise BookOutOfStockError()
+    time.sleep(0.001)
+    Book.objects.filter(pk=book.pk).update(stock=stock - 1)
+    return Borrowing.objects.create(book_id=book.pk, user_id=user.pk)
+
+
+def main(threads=16, books=20, stock=3):
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    from books import inventory
+    from books.exceptions import BookBusinessException
+    from books.models import Author, Book, Borrowing
+    from books.writer import Writer
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'bench_borrowing.sqlite3')
+        with bench_database():
+            owner = User.objects.create_user(username='bench')
+            author = Author.objects.create(name='基准作者')
+            catalog = [
+                Book.objects.create(title=f'图书{i}', author=author, price=10, published_date='2000-01-01', owner=owner)
+                for i in range(books)
+            ]
+            users = [User.objects.create_user(username=f'reader{i}') for i in range(threads)]
+            orders = [random.Random(index).sample(catalog, len(catalog)) for index in range(threads)]
+
+            def measure(name, borrow):
+                Borrowing.objects.all().delete()
+                Book.objects.update(stock=stock)
+                refused = []
+
+                def borrow_one(index, number):
+                    try:
+                        borrow(orders[index][number], users[index])
+                    except BookBusinessException:
+                        refused.append(1)
+
+                elapsed, errors = run_clients(threads, books, borrow_one)
+                lent = Counter(Borrowing.objects.values_list('book_id', flat=True))
+                oversold = sum(max(0, lent[book.pk] - stock) for book in catalog)
+                lowest = min(Book.objects.values_list('stock', flat=True))
+                attempts = threads * books
+                return [
+                    name, sum(lent.values()), len(refused), errors, oversold, lowest,
+                    f'{elapsed:.2f}', f'{attempts / elapsed:.0f}',
+                ]
+
+            writer = Writer()
+            rows = [
+                measure('先读后写（对照）', naive_borrow),
+                measure('带条件的 UPDATE', inventory.borrow),
+                measure('带条件的 UPDATE + 写线程', lambda book, user: writer.submit(inventory.borrow, book, user)),
+            ]
+            writer.stop()
+            print_table(
+                f'{threads} 个用户同时借阅 {books} 本书（每本库存 {stock}，最多借出 {books * stock} 本）',
+                ['方式', '借出', '库存不足', '失败', '超借', '最低库存', '耗时(s)', '每秒请求'],
+                rows,
+            )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""
+批量修改标签基准测试：对比逐本 `book.tags.add(...)` 和按批执行集合操作（books/bulktags.py）
+
+用法：python -m benchmarks.bench_bulk_tags [图书数量] [逐本修改的图书数量]
+💡 逐本修改太慢，只修改一部分图书，再换算成每千本的耗时
+💡 顺便校验：批量修改后的统计汇总表、标签的图书数量和从头重新统计的结果一致
+"""
+import sys
+import time
+
+from benchmarks.common import bench_database, print_table, seed_catalog
+
+
+def main(book_count=20000, one_by_one=1000):
+    from books import bookcounts, bulktags, rollups
+    from books.models import Book, CatalogRollup, Tag
+
+    with bench_database():
+        seed_catalog(books=book_count)
+        rollups.rebuild()
+        bookcounts.reconcile()
+        sale = Tag.objects.create(name='促销')
+        clearance = Tag.objects.create(name='清仓')
+
+        start = time.perf_counter()
+        for book in Book.objects.order_by('id')[:one_by_one]:
+            book.tags.add(clearance)
+        per_book_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        added = bulktags.update_tags(Book.objects.all(), add=[sale.pk])
+        add_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        removed = bulktags.update_tags(Book.objects.all(), remove=[sale.pk, clearance.pk])
+        remove_seconds = time.perf_counter() - start
+
+        def snapshot():
+            # 增量维护时数量减到 0 的行还在，重建时不会生成
+            return set(
+                CatalogRollup.objects.filter(book_count__gt=0).values_list('dimension', 'key', 'book_count', 'price_total')
+            )
+
+        incremental = snapshot()
+        rollups.rebuild()
+        assert incremental == snapshot(), '统计汇总表和重新统计的结果不一致'
+        assert bookcounts.reconcile() == {'authors': 0, 'tags': 0}
+
+        print_table(
+            f'{book_count} 本书',
+            ['做法', '修改的关系数', '耗时(s)', '每千本(ms)'],
+            [
+                ['逐本 book.tags.add()', one_by_one, f'{per_book_seconds:.2f}', f'{per_book_seconds / one_by_one * 1e6:.0f}'],
+                ['批量添加', added['added'], f'{add_seconds:.2f}', f'{add_seconds / added["added"] * 1e6:.0f}'],
+                ['批量移除（两个标签）', removed['removed'], f'{remove_seconds:.2f}',
+                 f'{remove_seconds / removed["removed"] * 1e6:.0f}'],
+            ],
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
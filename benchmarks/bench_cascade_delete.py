@@ -0,0 +1,67 @@
+"""
+级联删除基准测试：对比直接 `author.delete()`（一个事务）和分批删除（books/cascade.py）
+
+用法：python -m benchmarks.bench_cascade_delete [作者的图书数量] [每批数量]
+💡 SQLite 写事务期间整个数据库被锁住，其它写请求只能等；这里比较“最长持锁时间”（单个事务的最长耗时）
+"""
+import sys
+import time
+
+from benchmarks.common import bench_database, print_table, seed_catalog
+
+
+def create_author_books(book_count, name, tag_ids):
+    from books.models import Author, Book
+
+    author = Author.objects.create(name=name)
+    books = Book.objects.bulk_create(
+        [Book(title=f'{name}{i}', author=author, price=20, published_date='2000-01-01') for i in range(book_count)],
+        batch_size=1000,
+    )
+    Book.tags.through.objects.bulk_create(
+        [Book.tags.through(book_id=book.pk, tag_id=tag_ids[i % len(tag_ids)]) for i, book in enumerate(books)],
+        batch_size=5000,
+    )
+    return author
+
+
+def main(book_count=10000, batch_size=500):
+    from django.db import transaction
+
+    from books import cascade
+
+    with bench_database():
+        _, tag_ids = seed_catalog(books=1000)
+
+        author = create_author_books(book_count, '单个事务', tag_ids)
+        start = time.perf_counter()
+        with transaction.atomic():
+            author.delete()
+        single_seconds = time.perf_counter() - start
+
+        author = create_author_books(book_count, '分批删除', tag_ids)
+        batches = []
+        last = time.perf_counter()
+
+        def progress(done, total):
+            nonlocal last
+            now = time.perf_counter()
+            batches.append(now - last)
+            last = now
+
+        start = time.perf_counter()
+        cascade.run_delete('author', author.pk, batch_size=batch_size, progress=progress)
+        batched_seconds = time.perf_counter() - start
+
+        print_table(
+            f'删除有 {book_count} 本书的作者',
+            ['做法', '事务数', '总耗时(s)', '最长持锁(ms)'],
+            [
+                ['author.delete()', 1, f'{single_seconds:.2f}', f'{single_seconds * 1000:.0f}'],
+                [f'分批（每批 {batch_size} 本）', len(batches) + 1, f'{batched_seconds:.2f}', f'{max(batches) * 1000:.0f}'],
+            ],
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
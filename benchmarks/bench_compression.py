@@ -0,0 +1,74 @@
+"""
+响应压缩基准测试：图书列表 JSON 在不同编码、不同压缩级别下的压缩率（省多少带宽）和耗时（花多少 CPU）
+
+用法：python -m benchmarks.bench_compression [每页图书数量]
+💡 没有安装 brotli / zstandard 时只测试 gzip
+"""
+import sys
+
+from benchmarks.common import bench_database, print_table, seed_catalog, timeit
+
+LEVELS = {
+    'gzip': (1, 6, 9),
+    'br': (1, 4, 6, 11),
+    'zstd': (1, 3, 9, 19),
+}
+
+
+def render_book_page(page_size):
+    from django.test import RequestFactory
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+
+    from books.models import Book
+    from books.serializers import BookSerializer
+
+    request = Request(RequestFactory().get('/api/books/'))
+    books = Book.objects.select_related('author', 'owner').prefetch_related('tags').order_by('id')[:page_size]
+    data = BookSerializer(books, many=True, context={'request': request}).data
+    return JSONRenderer().render({'count': page_size, 'next': None, 'previous': None, 'results': data})
+
+
+def main(page_size=100):
+    from bookapi.middleware import CODECS, compress, compress_sequence
+
+    with bench_database():
+        seed_catalog(books=page_size * 2)
+        payload = render_book_page(page_size)
+
+        rows = []
+        for encoding in ('gzip', 'br', 'zstd'):
+            if encoding not in CODECS:
+                rows.append([encoding, '-', '未安装', '-', '-'])
+                continue
+            for level in LEVELS[encoding]:
+                size = len(compress(encoding, payload, level))
+                elapsed = timeit(lambda: compress(encoding, payload, level), repeat=20)
+                rows.append([
+                    encoding, level, size, f'{size / len(payload):.1%}',
+                    f'{elapsed:.3f}',
+                ])
+        print_table(
+            f'{page_size} 本书的列表 JSON，原始大小 {len(payload)} 字节',
+            ['编码', '级别', '压缩后(字节)', '压缩率', '耗时(ms)'],
+            rows,
+        )
+
+        # 流式导出：每个数据块单独 flush，压缩率比一次性压缩略差，换来数据能边生成边发送
+        chunks = [payload[i:i + 8192] for i in range(0, len(payload), 8192)]
+        rows = []
+        for encoding, level in (('gzip', 6), ('br', 4), ('zstd', 3)):
+            if encoding not in CODECS:
+                continue
+            whole = len(compress(encoding, payload, level))
+            streamed = sum(len(part) for part in compress_sequence(iter(chunks), CODECS[encoding](level)))
+            rows.append([encoding, level, whole, streamed, f'{streamed / whole - 1:+.1%}'])
+        print_table(
+            f'流式压缩（{len(chunks)} 个 8KB 数据块）',
+            ['编码', '级别', '一次性压缩(字节)', '逐块压缩(字节)', '额外开销'],
+            rows,
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
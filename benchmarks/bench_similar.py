@@ -0,0 +1,70 @@
+"""
+相似图书基准测试：对比“每次请求用 ORM 现算共同标签”和“读预先算好的前 K 本”（books/similarity.py），
+以及全量计算、增量刷新的耗时
+
+用法：python -m benchmarks.bench_similar [图书数量] [修改标签的图书数量]
+💡 顺便校验增量刷新：被修改的图书刷新后的列表和全量重算的结果一致
+"""
+import random
+import sys
+import time
+
+from benchmarks.common import bench_database, print_table, seed_catalog, timeit
+
+
+def main(book_count=20000, changed=20):
+    from django.db.models import Count, Q
+
+    from books import similarity
+    from books.models import Book, SimilarBookList
+
+    with bench_database():
+        _, tag_ids = seed_catalog(books=book_count)
+        k = similarity.get_top_k()
+        book_ids = list(Book.objects.values_list('id', flat=True))
+        sample = random.Random(1).sample(book_ids, 50)
+
+        def orm_similar(book_id):
+            book = Book.objects.get(pk=book_id)
+            tags = list(book.tags.values_list('id', flat=True))
+            return list(
+                Book.objects.exclude(pk=book_id)
+                .filter(Q(tags__in=tags) | Q(author_id=book.author_id))
+                .annotate(shared=Count('tags', filter=Q(tags__in=tags), distinct=True))
+                .order_by('-shared', 'id')[:k]
+            )
+
+        start = time.perf_counter()
+        similarity.rebuild()
+        rebuild_seconds = time.perf_counter() - start
+
+        # 修改一部分图书的标签（信号会标记过期），再增量刷新
+        rng = random.Random(2)
+        changed_ids = rng.sample(book_ids, changed)
+        for book in Book.objects.filter(pk__in=changed_ids):
+            book.tags.set(rng.sample(tag_ids, 3))
+        start = time.perf_counter()
+        refreshed = similarity.refresh()
+        refresh_seconds = time.perf_counter() - start
+        lists = dict(SimilarBookList.objects.filter(book_id__in=changed_ids).values_list('book_id', 'similar_ids'))
+        similarity.rebuild()
+        expected = dict(SimilarBookList.objects.filter(book_id__in=changed_ids).values_list('book_id', 'similar_ids'))
+        assert lists == expected, '增量刷新的结果和全量重算不一致'
+
+        rows = [
+            ['每次请求 ORM 现算', f'{timeit(lambda: [orm_similar(book_id) for book_id in sample], repeat=3) / 50:.2f}'],
+            ['读预先算好的列表', f'{timeit(lambda: [similarity.get_similar(book_id, k) for book_id in sample]) / 50:.2f}'],
+        ]
+        print_table(f'{book_count} 本书，每本取前 {k} 本相似图书（平均每次请求）', ['方式', '耗时(ms)'], rows)
+        print_table(
+            '预先计算',
+            ['操作', '图书数量', '耗时(s)'],
+            [
+                ['全量计算', book_count, f'{rebuild_seconds:.2f}'],
+                [f'修改 {changed} 本的标签后增量刷新', refreshed, f'{refresh_seconds:.2f}'],
+            ],
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
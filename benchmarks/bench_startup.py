@@ -0,0 +1,84 @@
+"""
+启动耗时和 OpenAPI 文档接口基准测试
+
+1. 在子进程里计时 `django.setup()` + 加载全部路由（相当于 worker 启动）：
+   - 立即导入：模拟以前 settings.py / urls.py 在启动时导入 drf_spectacular 的做法
+   - 按需导入：现在的做法
+2. 对比每次请求重新生成文档（以前的 SpectacularAPIView）和返回预先生成的文件
+
+用法：python -m benchmarks.bench_startup
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import print_table, timeit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+STARTUP_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = 'bookapi.settings'
+if {eager}:
+    import drf_spectacular.settings
+import django
+django.setup()
+if {eager}:
+    import drf_spectacular.views
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({{
+    'ms': (time.perf_counter() - start) * 1000,
+    'spectacular_loaded': 'drf_spectacular.openapi' in sys.modules or 'drf_spectacular.views' in sys.modules,
+}}))
+"""
+
+
+def measure_startup(eager, repeat=7):
+    timings, loaded = [], None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT.format(eager=eager)],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result['ms'])
+        loaded = result['spectacular_loaded']
+    return statistics.median(timings), loaded
+
+
+def main():
+    rows = []
+    for eager, label in ((True, '启动时导入 drf_spectacular（旧）'), (False, '按需导入（新）')):
+        ms, loaded = measure_startup(eager)
+        rows.append([label, f'{ms:.1f}', '是' if loaded else '否'])
+    print_table('worker 启动（django.setup + 加载路由）', ['方式', '耗时中位数(ms)', '是否加载了 drf_spectacular 生成器'], rows)
+
+    from django.test import RequestFactory, override_settings
+
+    from bookapi import schema
+
+    with tempfile.TemporaryDirectory() as schema_dir, override_settings(OPENAPI_SCHEMA_DIR=Path(schema_dir)):
+        schema.build_schema()
+        schema.schema_artifact.reset()
+        factory = RequestFactory()
+        request = factory.get('/api/schema/', HTTP_ACCEPT_ENCODING='gzip')
+        schema.schema_view(request)  # 加载到内存
+        etag = schema.schema_view(request)['ETag']
+        conditional = factory.get('/api/schema/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        document = schema.schema_artifact.get('yaml')
+        rows = [
+            ['每次重新生成（旧）', f'{timeit(schema.generate_schema, repeat=3):.1f}', len(document['content'])],
+            ['预生成文件 + gzip（新）', f'{timeit(lambda: schema.schema_view(request), repeat=50):.3f}', len(document['gzip'])],
+            ['预生成文件 + ETag 304（新）', f'{timeit(lambda: schema.schema_view(conditional), repeat=50):.3f}', 0],
+        ]
+        schema.schema_artifact.reset()
+    print_table('/api/schema/ 单次请求', ['方式', '耗时(ms)', '响应体字节'], rows)
+
+
+if __name__ == '__main__':
+    main()
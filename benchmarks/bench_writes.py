@@ -0,0 +1,87 @@
+"""
+写入吞吐量基准测试：多个线程同时新增图书，对比“每个请求各自一个事务”和“写线程组提交”（books/writer.py）
+
+用法：python -m benchmarks.bench_writes [线程数] [每个线程写入多少本]
+💡 使用临时的 SQLite 文件数据库：内存数据库没有磁盘同步，体现不出组提交省下的提交次数
+"""
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+from benchmarks.common import bench_database, print_table
+
+
+def run_clients(threads, writes, write_one):
+    """
+    threads 个线程同时开始，每个线程依次写入 writes 本
+    :return: (耗时秒数, 失败次数)
+    """
+    from django.db import OperationalError, connections
+
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def client(index):
+        try:
+            barrier.wait()
+            for number in range(writes):
+                try:
+                    write_one(index, number)
+                except OperationalError as exc:  # database is locked
+                    errors.append(exc)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=client, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def main(threads=8, writes=50):
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    from books.models import Author, Book
+    from books.writer import Writer
+    from books.writes import create_book
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'bench_writes.sqlite3')
+        with bench_database():
+            owner = User.objects.create_user(username='bench')
+            author = Author.objects.create(name='基准作者')
+
+            def create(index, number):
+                return create_book({
+                    'title': f'图书{index}-{number}', 'author': author, 'price': 10,
+                    'published_date': date(2000, 1, 1), 'owner': owner,
+                })
+
+            rows = []
+            total = threads * writes
+            elapsed, errors = run_clients(threads, writes, create)
+            rows.append(['每个请求一个事务', total - errors, f'{elapsed:.2f}', f'{(total - errors) / elapsed:.0f}', total, errors])
+
+            writer = Writer()
+            elapsed, errors = run_clients(threads, writes, lambda index, number: writer.submit(create, index, number))
+            writer.stop()
+            rows.append([
+                '写线程组提交', writer.writes - errors, f'{elapsed:.2f}', f'{(writer.writes - errors) / elapsed:.0f}',
+                writer.batches, errors,
+            ])
+            print_table(
+                f'{threads} 个线程并发新增图书，每个线程 {writes} 本（共写入 {Book.objects.count()} 本）',
+                ['方式', '成功', '耗时(s)', '每秒写入', '事务数', '失败'],
+                rows,
+            )
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
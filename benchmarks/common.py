@@ -0,0 +1,87 @@
+"""
+基准测试的公共工具
+
+每个基准测试脚本都在一个临时的测试数据库里运行（和 `python manage.py test` 一样），不会碰到 db.sqlite3
+用法：python -m benchmarks.bench_tag_filters
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookapi.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+
+@contextmanager
+def bench_database():
+    """
+    创建临时测试数据库并执行迁移，结束后销毁
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def timeit(func, repeat=5):
+    """
+    执行 repeat 次，返回耗时的中位数（毫秒）
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def seed_catalog(books=20000, authors=200, tags=50, tags_per_book=3, seed=42):
+    """
+    批量生成测试数据：作者、标签、图书和图书-标签关系
+    """
+    from books.models import Author, Book, Tag
+
+    rng = random.Random(seed)
+    Author.objects.bulk_create([Author(name=f'作者{i}') for i in range(authors)], batch_size=1000)
+    Tag.objects.bulk_create([Tag(name=f'标签{i}') for i in range(tags)], batch_size=1000)
+    author_ids = list(Author.objects.values_list('id', flat=True))
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    start = date(1950, 1, 1)
+    Book.objects.bulk_create(
+        [
+            Book(
+                title=f'图书{i}',
+                author_id=rng.choice(author_ids),
+                price=rng.randint(100, 20000) / 100,
+                published_date=start + timedelta(days=rng.randint(0, 365 * 70)),
+            )
+            for i in range(books)
+        ],
+        batch_size=1000,
+    )
+    links = []
+    for book_id in Book.objects.values_list('id', flat=True):
+        for tag_id in rng.sample(tag_ids, rng.randint(0, tags_per_book * 2)):
+            links.append(Book.tags.through(book_id=book_id, tag_id=tag_id))
+    Book.tags.through.objects.bulk_create(links, batch_size=5000)
+    return author_ids, tag_ids
+
+
+def print_table(title, header, rows):
+    print(f'\n== {title} ==')
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)))
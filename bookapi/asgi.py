@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookapi.settings')
 
+# 实时推送（`/api/events/books/`）的长连接需要 ASGI 服务器，比如：
+# uvicorn bookapi.asgi:application --workers 4
+# 💡 每个 worker 进程各自读取变更日志再分发给自己的连接，多个 worker 之间不需要额外的消息服务
 application = get_asgi_application()
+
+# 进程启动时把“最近添加”和“高亮”图书加载到内存，第一个请求也不用查数据库
+from books.hotset import warm_up_on_startup  # noqa: E402
+
+warm_up_on_startup()
@@ -0,0 +1,217 @@
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# brotli 和 zstd 都是可选依赖：没有安装时只支持 gzip（标准库自带）
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    from compression import zstd  # Python 3.14+ 标准库
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 响应压缩中间件：根据请求头 `Accept-Encoding` 协商使用 zstd / br（brotli）/ gzip 压缩响应
+# | 规则               | 说明                                                                |
+# | ------------------ | ------------------------------------------------------------------- |
+# | 协商               | 按客户端给的 q 值选；q 值相同时优先 zstd，其次 br，最后 gzip        |
+# | 最小长度           | 小于 `BOOKS_COMPRESSION_MIN_SIZE` 字节的响应不压缩（压缩收益太小）   |
+# | 按内容类型         | `BOOKS_COMPRESSION_RULES` 指定每种内容类型用哪些编码、压缩级别，    |
+# |                    | 值为 None 表示不压缩（比如图片本身已经压缩过）                      |
+# | 流式响应           | 每个数据块单独压缩后立刻发送（flush），大文件导出不会在内存里攒完再发 |
+# | 已压缩 / 部分内容  | 已经有 `Content-Encoding`（比如预压缩的 OpenAPI 文档）、206 分段响应都不处理 |
+# | 支持断点续传的文件 | 带 `Accept-Ranges: bytes` 的响应（比如导出文件下载）不压缩，续传时的字节位置才对得上 |
+# 💡 放在 MIDDLEWARE 靠前的位置（SecurityMiddleware 后面），这样其它中间件看到的都是未压缩的内容
+DEFAULT_COMPRESSION_MIN_SIZE = 500
+
+# 内容类型前缀 → {编码: 压缩级别}，按最长前缀匹配；级别来自 benchmarks/bench_compression.py 的测试结果
+DEFAULT_COMPRESSION_RULES = {
+    'application/json': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'application/vnd.oai.openapi': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'application/javascript': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'text/event-stream': None,  # 实时推送的事件流不压缩，避免被代理缓冲
+    'text/': {'zstd': 3, 'br': 4, 'gzip': 6},
+}
+
+# q 值相同时的优先顺序
+ENCODING_PREFERENCE = ('zstd', 'br', 'gzip')
+
+
+class GzipStream:
+    def __init__(self, level):
+        # wbits=31：输出带 gzip 头的格式（而不是裸 deflate）
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        if zstd is not None:
+            self._compressor = zstd.ZstdCompressor(level=level)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        if zstd is not None:
+            return self._compressor.compress(data, mode=zstd.ZstdCompressor.FLUSH_BLOCK)
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def get_codecs():
+    """
+    当前环境可用的编码（没装的可选依赖不会出现在这里）
+    """
+    codecs = {'gzip': GzipStream}
+    if brotli is not None:
+        codecs['br'] = BrotliStream
+    if zstd is not None or zstandard is not None:
+        codecs['zstd'] = ZstdStream
+    return codecs
+
+
+CODECS = get_codecs()
+
+
+def compress(encoding, data, level):
+    stream = CODECS[encoding](level)
+    return stream.compress(data) + stream.finish()
+
+
+def parse_accept_encoding(header):
+    """
+    解析 `Accept-Encoding: gzip, br;q=0.8, *;q=0`，返回 {编码: q 值}
+    """
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def choose_encoding(header, levels):
+    """
+    :param levels: 当前内容类型允许的 {编码: 压缩级别}
+    :return: 选中的编码；客户端不接受任何可用编码时返回 None
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for name in ENCODING_PREFERENCE:
+        if name not in levels or name not in CODECS:
+            continue
+        quality = accepted.get(name, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def get_levels(content_type):
+    """
+    按内容类型找压缩规则（最长前缀匹配）
+    """
+    rules = getattr(settings, 'BOOKS_COMPRESSION_RULES', DEFAULT_COMPRESSION_RULES)
+    content_type = content_type.split(';')[0].strip().lower()
+    matches = [prefix for prefix in rules if content_type.startswith(prefix)]
+    if not matches:
+        return None
+    return rules[max(matches, key=len)]
+
+
+def compress_sequence(chunks, stream):
+    for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+async def compress_async_sequence(chunks, stream):
+    async for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return response
+        if response.get('Accept-Ranges') == 'bytes':
+            return response
+        levels = get_levels(response.get('Content-Type', ''))
+        if not levels:
+            return response
+        min_size = getattr(settings, 'BOOKS_COMPRESSION_MIN_SIZE', DEFAULT_COMPRESSION_MIN_SIZE)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        # 同一个 URL 的响应内容随 Accept-Encoding 不同而不同，告诉缓存服务器区分
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), levels)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            stream = CODECS[encoding](levels[encoding])
+            if response.is_async:
+                response.streaming_content = compress_async_sequence(response.streaming_content, stream)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content, stream)
+            # 压缩后的总长度事先不知道
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(encoding, response.content, levels[encoding])
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # 压缩后字节不同，强 ETag 改成弱 ETag（和 Django 自带的 GZipMiddleware 一样）
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
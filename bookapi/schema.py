@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET
+
+logger = logging.getLogger(__name__)
+
+# 预先生成的 OpenAPI 文档
+# 以前每次访问 `/api/schema/`，drf-spectacular 都要遍历所有视图和序列化器重新生成一遍文档；
+# 现在文档在部署时生成成静态文件（`python manage.py build_openapi_schema`），接口直接返回文件内容：
+# | 文件               | 说明                         |
+# | ------------------ | ---------------------------- |
+# | `schema.yaml`      | 默认格式（和以前一样）       |
+# | `schema.json`      | `?format=json` 或 Accept 为 JSON 时返回 |
+# | `*.gz`             | 预压缩版本，客户端支持 gzip 时直接返回   |
+# 💡 只有文件不存在、或者代码比文件新（过期）时，才会在第一次请求时调用 drf-spectacular 重新生成
+# 💡 drf-spectacular 的生成器只在真正需要生成时才导入，不再拖慢进程启动
+FORMATS = {
+    'yaml': 'application/vnd.oai.openapi; charset=utf-8',
+    'json': 'application/vnd.oai.openapi+json; charset=utf-8',
+}
+
+
+def get_schema_dir():
+    return Path(getattr(settings, 'OPENAPI_SCHEMA_DIR', Path(settings.BASE_DIR) / 'openapi'))
+
+
+def get_source_files():
+    """
+    影响文档内容的源代码（视图、序列化器、路由、配置）
+    """
+    base_dir = Path(settings.BASE_DIR)
+    for package in ('bookapi', 'books'):
+        yield from (base_dir / package).rglob('*.py')
+
+
+def is_stale(schema_dir):
+    paths = [schema_dir / f'schema.{fmt}' for fmt in FORMATS]
+    if not all(path.exists() for path in paths):
+        return True
+    built_at = min(path.stat().st_mtime for path in paths)
+    return any(source.stat().st_mtime > built_at for source in get_source_files())
+
+
+def generate_schema():
+    """
+    调用 drf-spectacular 生成文档，返回 {格式: 字节内容}
+    """
+    from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    return {
+        'yaml': OpenApiYamlRenderer().render(schema, renderer_context={}),
+        'json': OpenApiJsonRenderer().render(schema, renderer_context={}),
+    }
+
+
+def build_schema(schema_dir=None):
+    """
+    生成文档并写入静态文件（包括 gzip 预压缩版本）
+    :return: {格式: 字节内容}
+    """
+    schema_dir = schema_dir or get_schema_dir()
+    contents = generate_schema()
+    schema_dir.mkdir(parents=True, exist_ok=True)
+    for fmt, content in contents.items():
+        (schema_dir / f'schema.{fmt}.gz').write_bytes(gzip.compress(content, compresslevel=9, mtime=0))
+        # 最后写未压缩文件：它的修改时间用来判断是否过期
+        (schema_dir / f'schema.{fmt}').write_bytes(content)
+    return contents
+
+
+class SchemaArtifact:
+    """
+    进程内缓存的文档内容：第一次请求时从文件加载（必要时重新生成），之后直接用内存里的字节
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = None
+
+    def load(self):
+        schema_dir = get_schema_dir()
+        if is_stale(schema_dir):
+            try:
+                build_schema(schema_dir)
+            except OSError:
+                # 目录不可写（比如只读文件系统）时只放在内存里
+                logger.warning('OpenAPI 文档写入 %s 失败，仅缓存在内存中', schema_dir, exc_info=True)
+                return self.make_documents(generate_schema())
+        contents = {fmt: (schema_dir / f'schema.{fmt}').read_bytes() for fmt in FORMATS}
+        gzipped = {
+            fmt: (schema_dir / f'schema.{fmt}.gz').read_bytes()
+            for fmt in FORMATS
+            if (schema_dir / f'schema.{fmt}.gz').exists()
+        }
+        return self.make_documents(contents, gzipped)
+
+    def make_documents(self, contents, gzipped=None):
+        gzipped = gzipped or {}
+        return {
+            fmt: {
+                'content': content,
+                'gzip': gzipped.get(fmt) or gzip.compress(content, compresslevel=9, mtime=0),
+                # 弱 ETag：gzip 压缩版和原始版内容等价，共用同一个 ETag
+                'etag': 'W/"%s"' % hashlib.sha256(content).hexdigest()[:32],
+            }
+            for fmt, content in contents.items()
+        }
+
+    def get(self, fmt):
+        if self._documents is None:
+            with self._lock:
+                if self._documents is None:
+                    self._documents = self.load()
+        return self._documents[fmt]
+
+    def reset(self):
+        self._documents = None
+
+
+schema_artifact = SchemaArtifact()
+
+
+def get_requested_format(request):
+    fmt = request.GET.get('format')
+    if fmt in FORMATS:
+        return fmt
+    if 'json' in request.headers.get('Accept', ''):
+        return 'json'
+    return 'yaml'
+
+
+@require_GET
+def schema_view(request):
+    """
+    返回预先生成的 OpenAPI 文档，支持 ETag（304）和 gzip
+    """
+    fmt = get_requested_format(request)
+    document = schema_artifact.get(fmt)
+    etag = document['etag']
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(document['gzip'], content_type=FORMATS[fmt])
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(document['content'], content_type=FORMATS[fmt])
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # 可以缓存，但每次用 ETag 向服务器确认
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
+
+_swagger_view = None
+
+
+def swagger_ui_view(request, *args, **kwargs):
+    """
+    Swagger UI 页面：第一次访问时才导入 drf-spectacular 的视图
+    """
+    global _swagger_view
+    if _swagger_view is None:
+        from drf_spectacular.views import SpectacularSwaggerView
+        _swagger_view = SpectacularSwaggerView.as_view(url_name='schema')
+    return _swagger_view(request, *args, **kwargs)
@@ -13,8 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
-
-from drf_spectacular.settings import SPECTACULAR_DEFAULTS, spectacular_settings
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # 响应压缩（gzip / br / zstd），放在靠前的位置，其它中间件处理的都是未压缩的内容
+    'bookapi.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,12 +84,34 @@ WSGI_APPLICATION = 'bookapi.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite 多进程写入（见 books/writer.py）：
+# - `timeout`：拿不到写锁时最多等待多少秒，而不是马上报 “database is locked”
+# - `transaction_mode: IMMEDIATE`：事务一开始就拿写锁；默认的 DEFERRED 事务先读后写，两个事务同时升级成写锁时
+#   其中一个会直接失败（不会等待 timeout）
+SQLITE_OPTIONS = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+}
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': SQLITE_OPTIONS,
+    },
 }
+# 图书分片（见 books/sharding.py）：开启分片时每个分片一个 SQLite 文件（`db.<别名>.sqlite3`），
+# 没有开启时不配置这些数据库（否则 `migrate`、测试都会多处理一个用不到的数据库）
+# ⚠️ 运行测试时总是配置 shard1：分片测试（ShardingTest）在测试里开启分片，但数据库别名必须在启动前就配置好
+BOOKS_SHARDS = [alias for alias in os.environ.get('BOOKS_SHARDS', '').split(',') if alias]
+TESTING = sys.argv[1:2] == ['test']
+for alias in BOOKS_SHARDS or (['shard1'] if TESTING else []):
+    DATABASES.setdefault(alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db.{alias}.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+    })
+# 按拥有者把图书路由到分片
+DATABASE_ROUTERS = ['books.sharding.ShardRouter']
 
 
 # Password validation
@@ -226,6 +249,78 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,  # 是否在文档页面显示schema
     'COMPONENT_SPLIT_REQUEST': True,  # 将请求和响应参数分开定义（更清晰）
 }
+# 预先生成的 OpenAPI 文档存放目录（部署时执行 `python manage.py build_openapi_schema` 生成）
+OPENAPI_SCHEMA_DIR = BASE_DIR / 'openapi'
+
+# === books 应用的自定义配置 ===
+# 统计接口价格区间的宽度（单位：元），修改后需要执行 `python manage.py rebuild_rollups`
+BOOKS_PRICE_BAND_WIDTH = 10
+# 内存热点图书（books/hotset.py）：“最近添加”保留几本、高亮图书最多缓存多少本、进程启动时是否预热、
+# 每隔几秒检查一次变更日志（没有共享缓存时，其他进程的修改最多延迟这么久）
+BOOKS_HOTSET_RECENT_SIZE = 5
+BOOKS_HOTSET_HIGHLIGHTED_SIZE = 200
+BOOKS_HOTSET_WARMUP_ON_STARTUP = True
+BOOKS_HOTSET_RECHECK_INTERVAL = 5
+# 批量请求接口（`/api/batch/`）一次最多包含的子请求数量，以及并发执行读请求的线程数（1 表示逐个执行）
+BOOKS_BATCH_MAX_REQUESTS = 10
+BOOKS_BATCH_MAX_WORKERS = 4
+# 批量创建图书（POST /api/books/ 传数组）一次最多多少本
+BOOKS_BULK_CREATE_MAX_ITEMS = 500
+# 幂等键（Idempotency-Key 请求头，见 books/idempotency.py）：每个进程在内存里最多保存多少个、保存多久（秒）、
+# 重复请求最多等待多久（秒）、执行中的请求在共享表里的租约（秒，进程异常退出后过了租约才能重新执行）
+BOOKS_IDEMPOTENCY_MAX_KEYS = 10000
+BOOKS_IDEMPOTENCY_TTL = 24 * 3600
+BOOKS_IDEMPOTENCY_WAIT_TIMEOUT = 10
+BOOKS_IDEMPOTENCY_LOCK_TIMEOUT = 60
+# 响应压缩（bookapi/middleware.py）：小于这个字节数的响应不压缩
+# 按内容类型调整编码和压缩级别时，参考 DEFAULT_COMPRESSION_RULES 设置 BOOKS_COMPRESSION_RULES
+BOOKS_COMPRESSION_MIN_SIZE = 500
+# 实时推送（`/api/events/books/`，见 books/events.py）：每个进程读取变更日志的间隔（秒）、心跳间隔（秒）、
+# 浏览器断线后的重连间隔（毫秒）、每个连接最多积压多少条事件、每个进程最多多少个连接、重连时最多补发多少条
+BOOKS_EVENTS_POLL_INTERVAL = 1.0
+BOOKS_EVENTS_HEARTBEAT = 15
+BOOKS_EVENTS_RETRY_MS = 3000
+BOOKS_EVENTS_QUEUE_SIZE = 100
+BOOKS_EVENTS_MAX_CONNECTIONS = 10000
+BOOKS_EVENTS_REPLAY_LIMIT = 1000
+# 后台任务队列（books/jobs.py，`python manage.py run_jobs`）：每个 worker 进程的并发数、队列为空时的查询间隔（秒）、
+# 失败重试的基础等待时间和最长等待时间（秒）、任务执行多久没结束视为 worker 已经异常退出（秒）
+BOOKS_JOBS_CONCURRENCY = 2
+BOOKS_JOBS_POLL_INTERVAL = 1.0
+BOOKS_JOBS_RETRY_BACKOFF = 10
+BOOKS_JOBS_RETRY_BACKOFF_MAX = 3600
+BOOKS_JOBS_LOCK_TIMEOUT = 3600
+# 图书导出（books/exports.py）：导出文件存放目录（不要放在 MEDIA_ROOT 下，下载需要检查权限）、每批读取多少本、
+# 导出文件保留多久（秒，过期的文件在下一次导出完成时或 `python manage.py prune_exports` 清理）
+BOOKS_EXPORT_DIR = BASE_DIR / 'exports'
+BOOKS_EXPORT_CHUNK_SIZE = 2000
+BOOKS_EXPORT_RETENTION = 24 * 3600
+# 归档（books/archive.py，`python manage.py archive_books`）：超过多少天没有修改的图书移到归档表、每批移动多少本
+BOOKS_ARCHIVE_AFTER_DAYS = 365
+BOOKS_ARCHIVE_BATCH_SIZE = 500
+# 按拥有者水平分片（books/sharding.py）：图书分布到哪些数据库（DATABASES 里的别名），为空表示不分片
+# 用环境变量开启（数据库配置见上面的 DATABASES），例如 `BOOKS_SHARDS=default,shard1`，
+# 开启后先执行 `python manage.py migrate --database shard1`
+# 和 `python manage.py rebalance_shards`（同步作者 / 标签 / 用户，把已有的图书搬到对应的分片）
+# 写线程组提交（books/writer.py）：是否开启、一个事务最多合并多少个写操作、攒批时最多额外等待多少秒（0 表示不等待）、
+# 请求最多等待写线程多少秒（超时返回 503）
+BOOKS_WRITER_ENABLED = True
+BOOKS_WRITER_MAX_BATCH = 100
+BOOKS_WRITER_MAX_DELAY = 0
+BOOKS_WRITER_TIMEOUT = 30
+# 浏览次数（books/viewcounts.py）：每个进程多久把内存里攒的浏览次数写回一次（秒）、攒到多少本时立即写回；
+# 热门图书接口（`/api/books/popular/`）最多返回多少本、排名缓存多久（秒）
+BOOKS_VIEWS_FLUSH_INTERVAL = 5
+BOOKS_VIEWS_MAX_PENDING = 1000
+BOOKS_POPULAR_SIZE = 20
+BOOKS_POPULAR_TTL = 60
+# 相似图书（books/similarity.py）：每本书保存前几本相似图书、同一个作者在相似度里的权重（相当于一个标签的几倍）、
+# 标签变化后多久执行增量刷新任务（秒，期间的修改合并成一次刷新）
+BOOKS_SIMILAR_TOP_K = 20
+BOOKS_SIMILAR_AUTHOR_WEIGHT = 1.0
+BOOKS_SIMILAR_REFRESH_DELAY = 30
+# 分批级联删除（books/cascade.py）：删除作者 / 用户时每批删除多少本图书（一批一个事务）
+BOOKS_DELETE_BATCH_SIZE = 500
 
 # 生产环境部署
 # 1. 设置 DEBUG = False （生产环境必须关闭）
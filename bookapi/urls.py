@@ -22,7 +22,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 from books.views import BookViewSet, AuthorViewSet, TagViewSet
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from .schema import schema_view, swagger_ui_view # 预先生成的 OpenAPI 文档（drf_spectacular 按需导入）
 
 
 # 创建路由器实例
@@ -50,9 +50,12 @@ urlpatterns = [
     # 登出页面
     path('logout/', views.user_logout, name='logout'),
 
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'), # openapi json接口，提供 `/api/schema/` 接口，返回 JSON 格式的 OpenAPI 规范。
+    # path('api/schema/', SpectacularAPIView.as_view(), name='schema'), # openapi json接口，提供 `/api/schema/` 接口，返回 JSON 格式的 OpenAPI 规范。
+    # 改为返回预先生成的静态文档（见 bookapi/schema.py），不再每次请求都重新生成
+    path('api/schema/', schema_view, name='schema'),
 
-    path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'), #swagger ui页面，提供一个图形化的 Swagger UI 页面，用户可以在线测试接口。`url_name='schema'`：指向前面定义的 `schema` 路由名，确保两个视图能正确关联。
+    # path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('api/schema/swagger-ui/', swagger_ui_view, name='swagger-ui'), #swagger ui页面，提供一个图形化的 Swagger UI 页面，用户可以在线测试接口。`url_name='schema'`：指向前面定义的 `schema` 路由名，确保两个视图能正确关联。
     path('', include(router.urls)),   # ← 包含所有视图集路由
 
 ]
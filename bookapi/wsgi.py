@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookapi.settings')
 
 application = get_wsgi_application()
+
+# 进程启动时把“最近添加”和“高亮”图书加载到内存，第一个请求也不用查数据库
+from books.hotset import warm_up_on_startup  # noqa: E402
+
+warm_up_on_startup()
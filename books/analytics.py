@@ -0,0 +1,268 @@
+import threading
+
+import numpy as np
+
+from . import changes, sharding
+from .models import Book, ChangeLogEntry
+
+# 价格分析：分位数、价格直方图、按作者 / 标签 / 年份分组、逐年趋势（`/api/analytics/`，只对管理员开放）
+# 这些查询都要扫描整个图书表，而且 SQLite 没有分位数函数（只能 ORDER BY price 再 OFFSET，每个分位数一次查询），
+# 这里在每个进程的内存里保存一份“按列存储”的快照，查询全部用 NumPy 向量化计算：
+# | 列                         | 类型     | 说明                                       |
+# | -------------------------- | -------- | ------------------------------------------ |
+# | `ids`                      | int64    | 图书 id（升序，按 id 二分查找）            |
+# | `prices`                   | float64  | 价格                                       |
+# | `years`                    | int64    | 出版年份                                   |
+# | `author_ids`               | int64    | 作者 id                                    |
+# | `link_rows` / `link_tags`  | int64    | 标签关系：第几行（哪本书）、标签 id        |
+# 🔄 增量刷新：每次查询前读一次变更日志的最大序号（见 books/changes.py），和快照的游标比较
+# - 没有变化：直接用内存里的快照
+# - 有变化：只重新读取变化过的图书，替换掉快照里对应的行；被删除的标签从标签关系里去掉
+# - 变化太多（超过 1/5 且超过 100 本，或者超过 5000 本）、或者游标之前的日志已经被 prune_changelog 清理：整体重新加载
+# ⚠️ 和变更日志一样，`QuerySet.update()` 修改的价格不会被察觉（借阅、浏览次数不影响这里用到的列）
+FULL_RELOAD_RATIO = 0.2
+MIN_INCREMENTAL_BOOKS = 100  # 变化不超过这么多本时总是增量刷新（图书很少时按比例算出来的阈值太小）
+MAX_INCREMENTAL_BOOKS = 5000  # 一次增量刷新最多重新读取多少本（`IN (...)` 的参数个数有上限）
+GROUP_DIMENSIONS = ('author', 'tag', 'year')
+
+
+def to_columns(books, links):
+    """
+    :param books: [(id, price, published_date, author_id)]
+    :param links: [(book_id, tag_id)]
+    """
+    ids = np.array([row[0] for row in books], dtype=np.int64)
+    order = np.argsort(ids)
+    columns = {
+        'ids': ids[order],
+        'prices': np.array([float(row[1]) for row in books], dtype=np.float64)[order],
+        'years': np.array([row[2].year for row in books], dtype=np.int64)[order],
+        'author_ids': np.array([row[3] for row in books], dtype=np.int64)[order],
+    }
+    links = np.array(links, dtype=np.int64).reshape(-1, 2)
+    columns['link_ids'], columns['link_tags'] = links[:, 0], links[:, 1]
+    return columns
+
+
+def load_columns(book_ids=None):
+    """
+    从数据库读取图书（开启分片时读每个分片）
+    :param book_ids: 只读取这些图书；None 表示全部
+    """
+    books_queryset = Book.objects.order_by()
+    links_queryset = Book.tags.through.objects.order_by()
+    if book_ids is not None:
+        books_queryset = books_queryset.filter(pk__in=book_ids)
+        links_queryset = links_queryset.filter(book_id__in=book_ids)
+    books = [
+        row for queryset in sharding.gather(books_queryset)
+        for row in queryset.values_list('id', 'price', 'published_date', 'author_id')
+    ]
+    links = [
+        row for queryset in sharding.gather(links_queryset)
+        for row in queryset.values_list('book_id', 'tag_id')
+    ]
+    return to_columns(books, links)
+
+
+class Snapshot:
+    """
+    某一时刻的列数据（只读，刷新时整体替换）
+    """
+    def __init__(self, ids, prices, years, author_ids, link_ids, link_tags):
+        self.ids = ids
+        self.prices = prices
+        self.years = years
+        self.author_ids = author_ids
+        # 标签关系只保留还在快照里的图书
+        rows = np.minimum(np.searchsorted(ids, link_ids), max(len(ids) - 1, 0))
+        valid = (ids[rows] == link_ids) if len(ids) else np.zeros(len(link_ids), dtype=bool)
+        self.link_ids, self.link_tags, self.link_rows = link_ids[valid], link_tags[valid], rows[valid]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def replace(self, book_ids, columns, deleted_tags=()):
+        """
+        :return: 新的快照：去掉 book_ids 对应的行，加上重新读取的 columns
+        """
+        keep = ~np.isin(self.ids, book_ids)
+        keep_links = ~np.isin(self.link_ids, book_ids)
+        if len(deleted_tags):
+            keep_links &= ~np.isin(self.link_tags, deleted_tags)
+        merged = {
+            name: np.concatenate([getattr(self, name)[keep], columns[name]])
+            for name in ('ids', 'prices', 'years', 'author_ids')
+        }
+        order = np.argsort(merged['ids'], kind='stable')
+        return Snapshot(
+            **{name: values[order] for name, values in merged.items()},
+            link_ids=np.concatenate([self.link_ids[keep_links], columns['link_ids']]),
+            link_tags=np.concatenate([self.link_tags[keep_links], columns['link_tags']]),
+        )
+
+    def mask(self, author_id=None, tag_id=None, year_from=None, year_to=None):
+        """
+        过滤条件 → 布尔数组（每本书一个）
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if author_id is not None:
+            mask &= self.author_ids == author_id
+        if tag_id is not None:
+            tagged = np.zeros(len(self.ids), dtype=bool)
+            tagged[self.link_rows[self.link_tags == tag_id]] = True
+            mask &= tagged
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= self.years <= year_to
+        return mask
+
+    # === 查询 ===
+    def summary(self, mask, percentiles):
+        """
+        :return: {'count', 'average', 'min', 'max', 'percentiles': {"50": ...}}（线性插值，和 numpy / pandas 默认一致）
+        """
+        prices = self.prices[mask]
+        if not len(prices):
+            return {'count': 0, 'average': None, 'min': None, 'max': None,
+                    'percentiles': {format_percentile(p): None for p in percentiles}}
+        values = np.percentile(prices, percentiles) if percentiles else []
+        return {
+            'count': int(len(prices)),
+            'average': round_price(prices.mean()),
+            'min': round_price(prices.min()),
+            'max': round_price(prices.max()),
+            'percentiles': {format_percentile(p): round_price(value) for p, value in zip(percentiles, values)},
+        }
+
+    def histogram(self, mask, width):
+        """
+        :return: [{'min_price', 'max_price', 'count'}]，区间是 [min_price, max_price)，中间没有图书的区间数量为 0
+        """
+        prices = self.prices[mask]
+        if not len(prices):
+            return []
+        bands = np.floor(prices / width).astype(np.int64)
+        low = bands.min()
+        counts = np.bincount(bands - low)
+        return [
+            {'min_price': round_price((low + index) * width), 'max_price': round_price((low + index + 1) * width),
+             'count': int(count)}
+            for index, count in enumerate(counts)
+        ]
+
+    def group_keys(self, mask, by):
+        """
+        :return: (分组键, 价格) 两个等长数组；按标签分组时一本书有几个标签就出现几次
+        """
+        if by == 'author':
+            return self.author_ids[mask], self.prices[mask]
+        if by == 'year':
+            return self.years[mask], self.prices[mask]
+        links = mask[self.link_rows]
+        return self.link_tags[links], self.prices[self.link_rows[links]]
+
+    def group_by(self, mask, by):
+        """
+        :return: [{'key', 'count', 'average', 'min', 'max', 'median'}]，按分组键升序
+        """
+        keys, prices = self.group_keys(mask, by)
+        if not len(keys):
+            return []
+        # 先按 (键, 价格) 排序，每组是连续的一段：第一个是最小值、最后一个是最大值、中间的是中位数
+        order = np.lexsort((prices, keys))
+        keys, prices = keys[order], prices[order]
+        unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        sums = np.add.reduceat(prices, starts)
+        ends = starts + counts - 1
+        medians = (prices[starts + (counts - 1) // 2] + prices[starts + counts // 2]) / 2
+        return [
+            {'key': int(key), 'count': int(count), 'average': round_price(total / count),
+             'min': round_price(prices[start]), 'max': round_price(prices[end]), 'median': round_price(median)}
+            for key, count, total, start, end, median in zip(unique, counts, sums, starts, ends, medians)
+        ]
+
+    def trend(self, mask):
+        """
+        逐年趋势：每年的数量、平均价、中位数，以及平均价和上一个有数据的年份相比的变化（百分比）
+        """
+        rows = self.group_by(mask, 'year')
+        previous = None
+        for row in rows:
+            row['year'] = row.pop('key')
+            row['average_change'] = None
+            if previous is not None and previous['average']:
+                row['average_change'] = round((row['average'] - previous['average']) / previous['average'] * 100, 2)
+            previous = row
+        return rows
+
+
+def round_price(value):
+    return round(float(value), 2)
+
+
+def format_percentile(p):
+    return f'{p:g}'
+
+
+class PriceAnalytics:
+    """
+    每个进程一个，保存快照并负责增量刷新
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._cursor = None
+        self.full_loads = 0  # 整体重新加载的次数（统计用）
+
+    def invalidate(self):
+        """
+        下次查询时整体重新加载
+        """
+        with self._lock:
+            self._snapshot = None
+
+    def get_snapshot(self):
+        """
+        :return: 最新的快照（有变化时先增量刷新）
+        """
+        with self._lock:
+            latest = changes.get_latest_seq()
+            if self._snapshot is None:
+                self.reload(latest)
+            elif latest != self._cursor:
+                self.apply_changes(latest)
+            return self._snapshot
+
+    def reload(self, latest):
+        # 先拿游标再读数据：读取期间的变化下次刷新时再应用一次，结果一样
+        self._snapshot = Snapshot(**load_columns())
+        self._cursor = latest
+        self.full_loads += 1
+
+    def apply_changes(self, latest):
+        try:
+            changes.check_cursor(self._cursor)
+        except changes.CursorExpired:
+            return self.reload(latest)
+        entries = ChangeLogEntry.objects.filter(seq__gt=self._cursor, seq__lte=latest).values_list(
+            'kind', 'object_id', 'action'
+        )
+        book_ids, deleted_tags = set(), set()
+        for kind, object_id, action in entries:
+            if kind == ChangeLogEntry.KIND_BOOK:
+                book_ids.add(object_id)
+            elif kind == ChangeLogEntry.KIND_TAG and action == ChangeLogEntry.ACTION_DELETED:
+                # 标签被删除时，图书的标签关系由数据库级联删除，没有图书的变更记录
+                deleted_tags.add(object_id)
+        threshold = min(max(len(self._snapshot) * FULL_RELOAD_RATIO, MIN_INCREMENTAL_BOOKS), MAX_INCREMENTAL_BOOKS)
+        if len(book_ids) > threshold:
+            return self.reload(latest)
+        book_ids = np.array(sorted(book_ids), dtype=np.int64)
+        columns = load_columns(book_ids.tolist()) if len(book_ids) else to_columns([], [])
+        self._snapshot = self._snapshot.replace(book_ids, columns, np.array(sorted(deleted_tags), dtype=np.int64))
+        self._cursor = latest
+
+
+price_analytics = PriceAnalytics()
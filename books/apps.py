@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        # 注册信号处理函数（只需导入模块，@receiver 会自动连接）
+        from . import signals  # noqa: F401
+        # 注册后台任务（@task 在导入时登记到任务队列）
+        from . import tasks  # noqa: F401
@@ -0,0 +1,179 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.utils import timezone
+
+from . import sharding
+from .models import Book, ArchivedBook, ArchivedBookTag, ArchivedBorrowing, Borrowing
+from .writes import add_tags_to_new_book
+
+# 归档分区：`books_book` 只保留“热”数据，长时间没有修改的图书移到归档表 `books_archivedbook`
+# | 操作                              | 查询哪些表                                  |
+# | --------------------------------- | ------------------------------------------- |
+# | 图书列表 / 搜索 / 过滤 / 详情      | 只查图书表（表小、索引小）                  |
+# | 同上，带 `?include_archived=1`    | 两张表分别过滤，再合并排序、分页（见 MergedBookList） |
+# | 修改 / 删除 / 高亮                | 只查图书表，归档的图书返回 404              |
+# 归档：`python manage.py archive_books --days 365`（每批一个事务，按批移动，不会长时间锁表）
+# 💡 移出图书表时走正常的删除流程（发送删除信号）：分页计数、统计汇总表、热点图书、变更日志都会相应更新，
+#    也就是说统计接口和增量同步只覆盖未归档的图书；恢复时走正常的新增流程
+# 💡 开启分片时（见 books/sharding.py）归档表和图书表在同一个分片，归档 / 恢复在每个分片里分别进行
+# 💡 借阅记录（都是已归还的）跟着图书一起移到 `books_archivedborrowing`，恢复时再移回来（记录的 id 会重新分配）
+ARCHIVE_FIELDS = ('title', 'author_id', 'price', 'published_date', 'is_highlighted', 'owner_id', 'cover_image', 'updated_at', 'stock', 'views')
+BORROWING_FIELDS = ('book_id', 'user_id', 'borrowed_at', 'returned_at')
+
+
+def get_batch_size():
+    return getattr(settings, 'BOOKS_ARCHIVE_BATCH_SIZE', 500)
+
+
+def get_archive_candidates(days=None, published_before=None):
+    """
+    需要归档的图书：超过 days 天没有修改（以及出版日期早于 published_before）；高亮图书、还有人借着没还的图书不归档
+    """
+    if days is None:
+        days = getattr(settings, 'BOOKS_ARCHIVE_AFTER_DAYS', 365)
+    queryset = Book.objects.filter(is_highlighted=False, updated_at__lt=timezone.now() - timedelta(days=days)).exclude(
+        Exists(Borrowing.objects.filter(book=OuterRef('pk'), returned_at__isnull=True)),
+    )
+    if published_before is not None:
+        queryset = queryset.filter(published_date__lt=published_before)
+    return queryset.order_by('id')
+
+
+def archive_batch(book_ids, using=None):
+    """
+    把一批图书（和标签关系、借阅记录）复制到归档表，再从图书表删除，同一个事务里完成
+    :param using: 图书所在的数据库（分片）
+    :return: 归档的数量
+    """
+    using = using or router.db_for_write(Book)
+    with transaction.atomic(using=using):
+        books = list(Book.objects.using(using).filter(pk__in=book_ids))
+        ArchivedBook.objects.using(using).bulk_create([
+            ArchivedBook(id=book.pk, **{field: getattr(book, field) for field in ARCHIVE_FIELDS}) for book in books
+        ])
+        links = Book.tags.through.objects.using(using).filter(book_id__in=[book.pk for book in books])
+        ArchivedBookTag.objects.using(using).bulk_create([
+            ArchivedBookTag(book_id=book_id, tag_id=tag_id) for book_id, tag_id in links.values_list('book_id', 'tag_id')
+        ])
+        # 删除图书时借阅记录会被级联删除，先复制到归档表
+        borrowings = Borrowing.objects.using(using).filter(book_id__in=[book.pk for book in books]).order_by('id')
+        ArchivedBorrowing.objects.using(using).bulk_create([
+            ArchivedBorrowing(**values) for values in borrowings.values(*BORROWING_FIELDS)
+        ])
+        Book.objects.using(using).filter(pk__in=[book.pk for book in books]).delete()
+    return len(books)
+
+
+def archive_books(queryset, batch_size=None, progress=None):
+    """
+    分批归档 queryset 里的图书（每批重新查询：上一批已经不在图书表里了）
+    :param progress: 每批完成后调用 progress(已归档数量)
+    :return: 归档的总数
+    """
+    batch_size = batch_size or get_batch_size()
+    total = 0
+    for shard_queryset in sharding.gather(queryset):
+        while True:
+            book_ids = list(shard_queryset.values_list('id', flat=True)[:batch_size])
+            if not book_ids:
+                break
+            total += archive_batch(book_ids, shard_queryset.db)
+            if progress is not None:
+                progress(total)
+    return total
+
+
+def restore_books(book_ids):
+    """
+    把归档的图书恢复到图书表（id 不变），走正常的新增流程；借阅记录一起恢复
+    :return: 恢复的数量
+    """
+    restored = 0
+    for using in sharding.get_aliases():
+        with transaction.atomic(using=using):
+            for archived in ArchivedBook.objects.using(using).filter(pk__in=book_ids).prefetch_related('tags'):
+                book = Book(id=archived.pk, **{field: getattr(archived, field) for field in ARCHIVE_FIELDS})
+                book.save(using=using, force_insert=True)
+                add_tags_to_new_book(book, archived.tags.all(), using)
+                borrowings = archived.borrowings.order_by('id').values(*BORROWING_FIELDS)
+                Borrowing.objects.using(using).bulk_create([Borrowing(**values) for values in borrowings])
+                archived.delete()
+                restored += 1
+    return restored
+
+
+def get_ordering(queryset):
+    """
+    合并排序用的字段：沿用图书表查询上的排序（OrderingFilter / 默认排序），最后按 id 保证顺序稳定
+    """
+    ordering = list(queryset.query.order_by) or ['id']
+    if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+        ordering.append('id')
+    return [{'pk': 'id', '-pk': '-id'}.get(field, field) for field in ordering]
+
+
+class MergedBookList:
+    """
+    图书表和归档表的查询合并成一个列表，给分页器使用（支持 count() 和切片）
+    切片时用 `UNION ALL` 只取这一页的 id，再分别按 id 加载对象
+    """
+    ordered = True  # 告诉 Django 的分页器：结果已经排好序
+
+    def __init__(self, hot, archived):
+        self.hot = hot
+        self.archived = archived
+        self.ordering = get_ordering(hot)
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        columns = list(dict.fromkeys(['id'] + [field.lstrip('-') for field in self.ordering]))
+        # UNION 里的每个子查询不能带 ORDER BY，排序放在合并之后
+        hot = self.hot.order_by().values_list(*columns).annotate(is_archived=Value(False, output_field=BooleanField()))
+        archived = self.archived.order_by().values_list(*columns).annotate(
+            is_archived=Value(True, output_field=BooleanField())
+        )
+        rows = list(hot.union(archived, all=True).order_by(*self.ordering)[key])
+        hot_ids = [row[0] for row in rows if not row[-1]]
+        archived_ids = [row[0] for row in rows if row[-1]]
+        objects = {(False, obj.pk): obj for obj in self.hot.filter(pk__in=hot_ids)} if hot_ids else {}
+        if archived_ids:
+            objects.update({(True, obj.pk): obj for obj in self.archived.filter(pk__in=archived_ids)})
+        return [objects[(bool(row[-1]), row[0])] for row in rows if (bool(row[-1]), row[0]) in objects]
+
+
+def merge_facets(facet_results, limit):
+    """
+    把两张表各自的分面统计结果按取值相加
+    ⚠️ 作者 / 标签分面每张表只取了前 limit 个，合并后的排名在边界附近可能略有出入
+    """
+    merged = {}
+    for result in facet_results:
+        for name, items in result.items():
+            counts = merged.setdefault(name, {})
+            for item in items:
+                if item['value'] in counts:
+                    counts[item['value']]['count'] += item['count']
+                else:
+                    counts[item['value']] = dict(item)
+    facets = {}
+    for name, counts in merged.items():
+        items = list(counts.values())
+        if name in ('author', 'tag'):
+            items = sorted(items, key=lambda item: (-item['count'], item['value']))[:limit]
+        else:
+            items = sorted(items, key=lambda item: item['value'])
+        facets[name] = items
+    return facets
@@ -0,0 +1,170 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from .error_codes import NOT_FOUND, INTERNAL_SERVER_ERROR
+
+logger = logging.getLogger(__name__)
+
+# 批量请求：一次 HTTP 请求里执行多个子请求，减少移动端的网络往返
+# 请求示例：POST /api/batch/
+# {"requests": [
+#     {"id": "detail", "method": "GET", "path": "/api/books/1/"},
+#     {"id": "tags",   "method": "GET", "path": "/api/tags/?p=2"},
+#     {"method": "POST", "path": "/api/tags/", "body": {"name": "小说"}}
+# ]}
+# 返回示例（顺序和请求一致）：
+# "data": [{"id": "detail", "status": 200, "body": {...}}, ...]
+# | 规则         | 说明                                                              |
+# | ------------ | ----------------------------------------------------------------- |
+# | 可访问的接口 | 只能是图书、作者、标签三个 ViewSet 的路由，其它路径返回 404      |
+# | 身份         | 子请求直接使用外层请求已认证的用户，不再重复认证（也不用 CSRF）   |
+# | 执行顺序     | 相邻的读请求（GET）放到线程池里并发执行；写请求按顺序逐个执行，  |
+# |              | 写请求之后的读请求一定能看到写入的结果                            |
+# | 限流         | 整个批量请求按子请求数量扣减次数（见 books/throttling.py），子请求本身不再限流 |
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# 子请求不需要从外层请求复制的请求头（请求体相关的会按子请求重新设置）
+# 外层的 Idempotency-Key 属于整个批量请求，不能原样用到每个子请求上
+SKIPPED_META = (
+    'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH', 'wsgi.input',
+    'HTTP_IDEMPOTENCY_KEY',
+)
+
+
+def get_max_requests():
+    return getattr(settings, 'BOOKS_BATCH_MAX_REQUESTS', 10)
+
+
+def get_max_workers():
+    return getattr(settings, 'BOOKS_BATCH_MAX_WORKERS', 4)
+
+
+def get_allowed_viewsets():
+    # 在函数里导入，避免 views.py 和本模块循环导入
+    from .views import BookViewSet, AuthorViewSet, TagViewSet
+    return (BookViewSet, AuthorViewSet, TagViewSet)
+
+
+def resolve_view(path):
+    """
+    :return: (视图函数, 路由参数)；不是允许的接口时返回 (None, None)
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None, None
+    # ViewSet.as_view() 生成的视图函数上有 `cls` 属性，指向 ViewSet 类
+    if getattr(match.func, 'cls', None) not in get_allowed_viewsets():
+        return None, None
+    return match.func, match.kwargs
+
+
+def build_subrequest(request, item):
+    """
+    根据外层请求构造子请求（Django 的 HttpRequest），身份直接沿用外层请求
+    """
+    url = urlsplit(item['path'])
+    body = b''
+    if item.get('body') is not None:
+        body = json.dumps(item['body']).encode('utf-8')
+    environ = {key: value for key, value in request.META.items() if key not in SKIPPED_META}
+    environ.update({
+        'REQUEST_METHOD': item['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    })
+    subrequest = WSGIRequest(environ)
+    # DRF 的 Request 发现这两个属性时会跳过认证，直接使用这里的用户（和 APIClient.force_authenticate 同一个机制）
+    subrequest._force_auth_user = request.user
+    subrequest._force_auth_token = request.auth
+    # 子请求不再单独限流，外层批量请求已经按数量扣过了
+    subrequest.is_batch_subrequest = True
+    return subrequest
+
+
+def get_response_body(response):
+    # DRF 的 Response 直接取 data，避免先渲染成 JSON 再解析回来
+    if hasattr(response, 'data'):
+        return response.data
+    content = response.content.decode(response.charset or 'utf-8')
+    if 'json' in response.get('Content-Type', ''):
+        return json.loads(content or 'null')
+    return content
+
+
+def execute_one(request, item):
+    """
+    执行一个子请求，返回 {"id", "status", "body"}
+    """
+    result = {'id': item['id']}
+    view, kwargs = resolve_view(urlsplit(item['path']).path)
+    if view is None:
+        result.update(status=404, body={
+            'success': False,
+            'error_code': NOT_FOUND,
+            'message': '批量请求不支持该路径',
+            'details': {'path': item['path']},
+        })
+        return result
+    try:
+        response = view(build_subrequest(request, item), **kwargs)
+    except Exception:
+        # 一个子请求出错不影响其它子请求
+        logger.exception('批量子请求执行失败：%s %s', item['method'], item['path'])
+        result.update(status=500, body={
+            'success': False,
+            'error_code': INTERNAL_SERVER_ERROR,
+            'message': '服务器内部错误，请稍后重试',
+            'details': {},
+        })
+        return result
+    result.update(status=response.status_code, body=get_response_body(response))
+    return result
+
+
+def execute_in_thread(request, item):
+    try:
+        return execute_one(request, item)
+    finally:
+        # 线程池里的线程会使用自己的数据库连接，用完关闭，避免连接泄露
+        connections.close_all()
+
+
+def execute_batch(request, items, max_workers=None):
+    """
+    :param items: 已经校验过的子请求列表（每个都有 id / method / path / body）
+    :return: 子请求结果列表，顺序和 items 一致
+    """
+    max_workers = get_max_workers() if max_workers is None else max_workers
+    results = []
+    reads = []
+
+    def flush_reads(executor):
+        if len(reads) > 1:
+            results.extend(executor.map(lambda item: execute_in_thread(request, item), reads))
+        else:
+            results.extend(execute_one(request, item) for item in reads)
+        reads.clear()
+
+    if max_workers <= 1:
+        return [execute_one(request, item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items) or 1)) as executor:
+        for item in items:
+            if item['method'] in SAFE_METHODS:
+                reads.append(item)
+                continue
+            # 写请求：先把前面积累的读请求执行完，再执行写请求
+            flush_reads(executor)
+            results.append(execute_one(request, item))
+        flush_reads(executor)
+    return results
@@ -0,0 +1,113 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db.models import Count, F
+
+from . import sharding
+from .models import Author, Book, Tag
+
+# 作者、标签的图书数量 `book_count`：列表接口按图书数量排序、过滤时直接走索引，不用每次 `annotate(Count(...))` JOIN 图书表
+# | 操作                             | 变化                                          | 触发           |
+# | -------------------------------- | --------------------------------------------- | -------------- |
+# | 新增图书（含批量创建、恢复归档） | 作者 +1，每个标签 +1                          | 信号           |
+# | 修改图书的作者                   | 原作者 -1，新作者 +1                          | post_save      |
+# | 删除图书（含归档）               | 作者 -1，每个标签 -1                          | post_delete    |
+# | 添加 / 移除 / 清空标签           | 对应的标签 +1 / -1                            | m2m_changed    |
+# 💡 都是 `UPDATE ... SET book_count = book_count + n`（F() 表达式），并发写入不会相互覆盖
+# 💡 作者、标签的主副本在默认数据库（见 books/sharding.py），计数只维护默认数据库里的那一份
+# ⚠️ 不发送信号的写入（`QuerySet.update()`、`bulk_create`、直接执行 SQL）不会更新计数，
+#    批量导入数据后或者怀疑有偏差时执行 `python manage.py reconcile_book_counts`
+UPDATE_BATCH_SIZE = 500  # 一条 UPDATE 最多带多少个 id（SQLite 的参数个数有上限）
+_local = threading.local()  # batched() 期间攒下的增量（每个线程各自一份）
+
+
+def update_in_batches(manager, pks, **values):
+    for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+        manager.filter(pk__in=pks[start:start + UPDATE_BATCH_SIZE]).update(**values)
+
+
+@contextmanager
+def batched():
+    """
+    期间的增量先攒在内存里，结束时合并写入（和 rollups.batched() 一样，放在事务里面使用）
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = defaultdict(Counter)
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    for (model, using), deltas in pending.items():
+        apply_deltas(model, deltas, using)
+
+
+def apply_deltas(model, deltas, using):
+    """
+    :param deltas: {作者 / 标签 id: 增量}；增量相同的合并成一条 UPDATE（在 batched() 里时先攒起来）
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending[(model, sharding.home_alias(using))].update(deltas)
+        return
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            groups[delta].append(pk)
+    manager = model._base_manager.using(sharding.home_alias(using))
+    for delta, pks in groups.items():
+        update_in_batches(manager, pks, book_count=F('book_count') + delta)
+
+
+def authors_changed(deltas, using='default'):
+    """
+    :param deltas: {作者 id: 增量}
+    """
+    apply_deltas(Author, deltas, using)
+
+
+def tag_links_changed(pairs, sign, using='default'):
+    """
+    :param pairs: 新增 / 删除的 (book_id, tag_id) 列表，每一对让标签的计数变化 sign
+    """
+    counts = Counter(tag_id for _, tag_id in pairs)
+    apply_deltas(Tag, {tag_id: count * sign for tag_id, count in counts.items()}, using)
+
+
+def count_books():
+    """
+    从图书表重新统计（开启分片时每个分片分别统计再相加）
+    :return: ({作者 id: 图书数量}, {标签 id: 图书数量})
+    """
+    authors, tags = Counter(), Counter()
+    for using in sharding.get_aliases():
+        for author_id, count in Book.objects.using(using).order_by().values('author_id').annotate(
+            count=Count('id')
+        ).values_list('author_id', 'count'):
+            authors[author_id] += count
+        for tag_id, count in Book.tags.through.objects.using(using).order_by().values('tag_id').annotate(
+            count=Count('book_id')
+        ).values_list('tag_id', 'count'):
+            tags[tag_id] += count
+    return authors, tags
+
+
+def reconcile():
+    """
+    把计数修正成图书表里的实际数量
+    :return: {'authors': 修正的作者数, 'tags': 修正的标签数}
+    """
+    fixed = {}
+    for name, model, counts in zip(('authors', 'tags'), (Author, Tag), count_books()):
+        manager = model._base_manager.using(sharding.HOME_ALIAS)
+        wrong = defaultdict(list)
+        for pk, book_count in manager.values_list('id', 'book_count').iterator():
+            if book_count != counts[pk]:
+                wrong[counts[pk]].append(pk)
+        for book_count, pks in wrong.items():
+            update_in_batches(manager, pks, book_count=book_count)
+        fixed[name] = sum(len(pks) for pks in wrong.values())
+    return fixed
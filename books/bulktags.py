@@ -0,0 +1,93 @@
+from functools import partial
+
+from django.db import connections, transaction
+
+from . import bookcounts, changes, rollups, similarity
+from .counting import invalidate_counts
+from .filters import get_tag_link_fields
+from .hotset import hot_books
+from .models import Book, Tag
+
+# 批量修改标签（`POST /api/books/bulk-tags/`）：比如给 2 万本书加上“促销”
+# 逐本调用 `book.tags.add(...)` 每本书要好几条 SQL；这里先取出符合条件的图书 id，再按批执行集合操作：
+# | 操作 | SQL（每批一条）                                                                                  |
+# | ---- | ------------------------------------------------------------------------------------------------ |
+# | 添加 | `INSERT INTO books_book_tags (book_id, tag_id) SELECT book.id, tag.id FROM books_book book CROSS JOIN books_tag tag WHERE book.id IN (...) AND tag.id IN (...) ON CONFLICT DO NOTHING RETURNING book_id, tag_id` |
+# | 移除 | `DELETE FROM books_book_tags WHERE book_id IN (...) AND tag_id IN (...) RETURNING book_id, tag_id` |
+# 💡 `RETURNING` 返回真正新增 / 删除的关系（已经有的标签不会重复计算），据此维护统计汇总表、图书数量、变更日志
+#    （和 m2m_changed 信号做的事情一样，只是整批一起做）；需要 SQLite 3.35+ 或 PostgreSQL
+# 💡 先取出图书 id 再修改：过滤条件里有标签时，加完标签不会改变“要移除标签的图书”
+# 💡 同一个分片的所有批次在一个事务里，要么全部成功、要么全部不生效
+BATCH_SIZE = 5000  # 每条语句最多带多少个图书 id（SQLite 的参数个数有上限）
+
+
+def get_link_sql(connection, tag_ids, book_count):
+    through, book_column, tag_column = get_tag_link_fields(Book)
+    qn = connection.ops.quote_name
+    table = qn(through._meta.db_table)
+    books = ', '.join(['%s'] * book_count)
+    tags = ', '.join(['%s'] * len(tag_ids))
+    returning = f'RETURNING {qn(book_column)}, {qn(tag_column)}'
+    insert = (
+        f'INSERT INTO {table} ({qn(book_column)}, {qn(tag_column)}) '
+        f'SELECT book.{qn("id")}, tag.{qn("id")} FROM {qn(Book._meta.db_table)} book '
+        f'CROSS JOIN {qn(Tag._meta.db_table)} tag WHERE book.{qn("id")} IN ({books}) AND tag.{qn("id")} IN ({tags}) '
+        f'ON CONFLICT DO NOTHING {returning}'
+    )
+    delete = f'DELETE FROM {table} WHERE {qn(book_column)} IN ({books}) AND {qn(tag_column)} IN ({tags}) {returning}'
+    return insert, delete
+
+
+def execute_returning(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def links_changed(pairs, sign, using, books):
+    """
+    维护标签关系相关的数据（对应 signals.book_tags_changed）
+    :param books: {book_id: (owner_id, price)}
+    """
+    if not pairs:
+        return
+    rollups.tag_links_changed(pairs, sign, using, {book_id: price for book_id, (_, price) in books.items()})
+    bookcounts.tag_links_changed(pairs, sign, using)
+
+
+def update_tags(queryset, add=(), remove=()):
+    """
+    给 queryset 里的所有图书添加 / 移除标签（queryset 只在一个数据库上）
+    :return: {'matched': 符合条件的图书数, 'added': 新增的关系数, 'removed': 删除的关系数}
+    """
+    using = queryset.db
+    connection = connections[using]
+    add, remove = sorted(set(add)), sorted(set(remove))
+    result = {'matched': 0, 'added': 0, 'removed': 0}
+    with transaction.atomic(using=using):
+        books = {
+            book_id: (owner_id, price)
+            for book_id, owner_id, price in queryset.order_by('pk').values_list('id', 'owner_id', 'price')
+        }
+        result['matched'] = len(books)
+        book_ids = list(books)
+        changed = set()
+        for start in range(0, len(book_ids), BATCH_SIZE):
+            batch = book_ids[start:start + BATCH_SIZE]
+            for tag_ids, key, sign in ((add, 'added', 1), (remove, 'removed', -1)):
+                if not tag_ids:
+                    continue
+                insert, delete = get_link_sql(connection, tag_ids, len(batch))
+                pairs = execute_returning(connection, insert if sign > 0 else delete, [*batch, *tag_ids])
+                links_changed(pairs, sign, using, books)
+                result[key] += len(pairs)
+                changed.update(book_id for book_id, _ in pairs)
+        if changed:
+            # 对同步的客户端来说这些图书的数据变了；相似图书要重新计算；热点图书整体失效（一次改很多本，不逐本重新加载）；
+            # 按标签过滤的分页计数缓存失效
+            owners = changes.record_books_updated(changed, using, {book_id: books[book_id][0] for book_id in changed})
+            similarity.mark_dirty(sorted(changed), using)
+            transaction.on_commit(hot_books.invalidate, using=using)
+            for owner_id in set(owners.values()):
+                transaction.on_commit(partial(invalidate_counts, owner_id=owner_id), using=using)
+    return result
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import bookcounts, inventory, jobs, rollups, sharding
+from .models import Author, ArchivedBook, ArchivedBorrowing, Book, Borrowing, Job
+
+# 分批级联删除：删除作者（`DELETE /api/authors/<id>/`）或用户（`python manage.py delete_user`）
+# `Book.author`、`Book.owner` 都是 `on_delete=CASCADE`，直接 `author.delete()` 时 Django 会把所有相关的图书、标签关系
+# 读进内存，在一个很长的事务里删除，期间 SQLite 整个数据库都被锁住；这里改成后台任务按批删除：
+# | 步骤 | 作者                               | 用户                                           |
+# | ---- | ---------------------------------- | ---------------------------------------------- |
+# | 1    | 作者的图书（每个分片）             | 用户的图书（每个分片）                         |
+# | 2    | 作者的归档图书                     | 用户的归档图书                                 |
+# | 3    | -                                  | 用户的借阅记录（包括归档图书的）               |
+# | 4    | 最后删除作者本身（这时已经没有多少关联数据了，照常同步到其它分片） | 最后删除用户本身          |
+# 💡 每批 BOOKS_DELETE_BATCH_SIZE 条、一个事务；图书走正常的删除流程（信号照常维护汇总表、图书数量、变更日志等），
+#    其中汇总表、图书数量的变化整批合并后只写一次；删除还没归还的借阅记录时把库存加回图书
+# 💡 接口马上返回任务（202），进度见 `GET /api/jobs/<id>/`；同一个对象已经有没执行完的删除任务时直接返回那个任务
+# ⚠️ 删除过程中作者 / 用户还在，图书数量逐渐减少；期间新增的图书在最后一步随作者 / 用户一起删除
+DELETE_TASK = 'cascade_delete'
+MODELS = {'author': Author, 'user': User}
+
+
+def get_batch_size():
+    return getattr(settings, 'BOOKS_DELETE_BATCH_SIZE', 500)
+
+
+def get_steps(kind, pk):
+    """
+    :return: 要分批删除的查询集（每个分片一个），按删除的先后顺序
+    """
+    if kind == 'author':
+        querysets = [Book.objects.filter(author_id=pk), ArchivedBook.objects.filter(author_id=pk)]
+    else:
+        querysets = [
+            Book.objects.filter(owner_id=pk), ArchivedBook.objects.filter(owner_id=pk),
+            Borrowing.objects.filter(user_id=pk), ArchivedBorrowing.objects.filter(user_id=pk),
+        ]
+    return [shard_queryset for queryset in querysets for shard_queryset in sharding.gather(queryset.order_by('pk'))]
+
+
+def delete_in_batches(queryset, batch_size, progress=None):
+    """
+    每批重新查询一次 id（上一批已经删掉了），一批一个事务
+    :return: 删除的数量
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # 汇总表、图书数量的变化整批合并后再写（见 rollups.batched）
+        with transaction.atomic(using=queryset.db), rollups.batched(), bookcounts.batched():
+            batch = model.objects.using(queryset.db).filter(pk__in=ids)
+            if model is Borrowing:
+                # 删除用户还没归还的借阅记录：把库存还给图书（见 books/inventory.py）
+                inventory.borrowings_deleting(batch, queryset.db)
+            batch.delete()
+        deleted += len(ids)
+        if progress is not None:
+            progress(len(ids))
+
+
+def find_pending(kind, pk):
+    return Job.objects.filter(
+        name=DELETE_TASK, payload__kind=kind, payload__id=pk, status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING],
+    ).order_by('id').first()
+
+
+def request_delete(instance, owner=None):
+    """
+    提交删除任务
+    :param instance: Author 或 User
+    :return: Job
+    """
+    kind = 'author' if isinstance(instance, Author) else 'user'
+    return find_pending(kind, instance.pk) or jobs.enqueue(DELETE_TASK, {'kind': kind, 'id': instance.pk}, owner=owner)
+
+
+def run_delete(kind, pk, batch_size=None, progress=None):
+    """
+    按批删除关联数据，最后删除对象本身（可以重复执行：已经删掉的部分不会再删）
+    :param progress: progress(已删除数量, 总数)
+    :return: {'deleted': 删除的关联数据条数, 'found': 对象是否还存在}
+    """
+    batch_size = batch_size or get_batch_size()
+    steps = get_steps(kind, pk)
+    total = sum(queryset.count() for queryset in steps)
+    done = 0
+
+    def advance(count):
+        nonlocal done
+        done += count
+        if progress is not None:
+            progress(done, total)
+
+    for queryset in steps:
+        delete_in_batches(queryset, batch_size, advance)
+    # 作者 / 用户的主副本在默认数据库，删除后由信号同步删除其它分片里的副本（见 books/sharding.py）
+    instance = MODELS[kind]._base_manager.using(sharding.HOME_ALIAS).filter(pk=pk).first()
+    if instance is not None:
+        with transaction.atomic(using=sharding.HOME_ALIAS):
+            instance.delete()
+    return {'deleted': done, 'found': instance is not None}
@@ -0,0 +1,189 @@
+import base64
+import binascii
+from collections import OrderedDict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import sharding
+from .models import Book, Author, Tag, ChangeLogEntry
+
+# 增量同步（变更订阅）：客户端不再每次全量下载 `/api/books/`，只拉取上次同步之后的变化
+# 1. 第一次同步：先调用 `GET /api/changes/` 拿到当前游标，再全量下载图书 / 作者 / 标签
+#    （先拿游标再下载：下载期间发生的变化下次同步会再收到一次，重复应用不影响结果）
+# 2. 之后每次：`GET /api/changes/?since=<上次返回的 cursor>`，`has_more=true` 时继续用新游标拉取
+# 返回示例：
+# "changes": [
+#     {"type": "book", "id": 3, "action": "updated", "data": {...图书完整数据...}},
+#     {"type": "tag",  "id": 5, "action": "deleted"}        ← 墓碑记录：对象已删除，只有 id
+# ],
+# "cursor": "djE6MTIz",   ← 不透明的字符串，客户端原样保存即可
+# "has_more": false
+# 💡 同一个对象在一页里变化多次只返回一条（最终状态）；普通用户只会收到自己的图书
+# ⚠️ 标签被删除时，图书里对应的标签关系由数据库级联删除，不会产生图书的变更记录，客户端收到标签的墓碑后自行移除
+# ⚠️ `QuerySet.update()` 不触发信号，不会记录变更（和分页计数、统计汇总表一样的限制）
+CURSOR_PREFIX = 'v1:'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+
+class CursorExpired(Exception):
+    """游标比保留的变更日志还旧，中间的变化已经被清理，客户端需要全量同步"""
+
+
+def encode_cursor(seq):
+    return base64.urlsafe_b64encode(f'{CURSOR_PREFIX}{seq}'.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    :raise ValueError: 游标格式不对
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(cursor)
+    if not value.startswith(CURSOR_PREFIX):
+        raise ValueError(cursor)
+    seq = int(value[len(CURSOR_PREFIX):])
+    if seq < 0:
+        raise ValueError(cursor)
+    return seq
+
+
+# === 写入变更日志（由 books/signals.py 调用，和数据修改在同一个事务里） ===
+def write_entries(entries, using):
+    home = sharding.home_alias(using)
+    if home == using:
+        ChangeLogEntry.objects.using(using).bulk_create(entries)
+    else:
+        # 分片上的修改（见 books/sharding.py）：变更日志在默认数据库，等分片的事务提交后再写，
+        # 读取方不会先看到日志、后看到数据
+        transaction.on_commit(partial(ChangeLogEntry.objects.using(home).bulk_create, entries), using=using)
+
+
+def record(kind, object_id, action, owner_id=None, using='default'):
+    write_entries([ChangeLogEntry(kind=kind, object_id=object_id, action=action, owner_id=owner_id)], using)
+
+
+def record_many(kind, objects, action, using='default'):
+    """
+    :param objects: [(object_id, owner_id)]
+    """
+    write_entries([
+        ChangeLogEntry(kind=kind, object_id=object_id, action=action, owner_id=owner_id)
+        for object_id, owner_id in objects
+    ], using)
+
+
+def record_books_updated(book_ids, using='default', owners=None):
+    """
+    图书的标签变化：记录为图书被修改
+    :param owners: 已知的 {book_id: owner_id}，不全时查一次数据库
+    :return: 记录了的图书 {book_id: owner_id}（调用方还要按拥有者让计数缓存失效）
+    """
+    book_ids = set(book_ids)
+    if not book_ids:
+        return {}
+    if owners is None or not book_ids <= set(owners):
+        owners = dict(Book.objects.using(using).filter(pk__in=book_ids).values_list('id', 'owner_id'))
+    # 已经不存在的图书（同一个事务里被删除了）不需要记录
+    owners = {book_id: owners[book_id] for book_id in sorted(book_ids) if book_id in owners}
+    record_many(ChangeLogEntry.KIND_BOOK, list(owners.items()), ChangeLogEntry.ACTION_UPDATED, using)
+    return owners
+
+
+# === 读取变更 ===
+def visible_entries(user):
+    entries = ChangeLogEntry.objects.all()
+    if user.is_staff:
+        return entries
+    # 普通用户：所有作者、标签的变化 + 自己的图书的变化
+    return entries.filter(~Q(kind=ChangeLogEntry.KIND_BOOK) | Q(owner_id=user.pk))
+
+
+def get_latest_seq():
+    return ChangeLogEntry.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+
+def check_cursor(since):
+    """
+    游标之后的记录已经被 prune_changelog 清理掉时抛出 CursorExpired
+    💡 清理时总会保留最新的一条，所以最旧的保留记录一定存在
+    """
+    oldest = ChangeLogEntry.objects.order_by('seq').values_list('seq', flat=True).first()
+    if oldest is not None and since < oldest - 1:
+        raise CursorExpired(since)
+
+
+def merge_entries(entries):
+    """
+    同一个对象的多条记录合并成一条：最终被删除 → deleted；否则窗口里新增过 → created；其余 → updated
+    :return: OrderedDict{(kind, object_id): action}，按对象最后一次变化的顺序排列
+    """
+    merged = OrderedDict()
+    for entry in entries:
+        key = (entry.kind, entry.object_id)
+        previous = merged.pop(key, None)
+        action = entry.action
+        if action == ChangeLogEntry.ACTION_HIGHLIGHTED:
+            action = ChangeLogEntry.ACTION_UPDATED
+        if action == ChangeLogEntry.ACTION_UPDATED and previous == ChangeLogEntry.ACTION_CREATED:
+            action = ChangeLogEntry.ACTION_CREATED
+        merged[key] = action
+    return merged
+
+
+def get_kind_loaders():
+    # 在函数里导入，避免 serializers → writes → signals → changes 循环导入
+    from .serializers import BookSerializer, AuthorSerializer, TagSerializer
+    return {
+        ChangeLogEntry.KIND_BOOK: (
+            Book.objects.select_related('author', 'owner').prefetch_related('tags'), BookSerializer
+        ),
+        ChangeLogEntry.KIND_AUTHOR: (Author.objects.all(), AuthorSerializer),
+        ChangeLogEntry.KIND_TAG: (Tag.objects.all(), TagSerializer),
+    }
+
+
+def get_changes(user, since, limit=DEFAULT_LIMIT, context=None):
+    """
+    :return: (变化列表, 新游标, 是否还有更多)
+    """
+    # 先取当前最大序号：本页没有可见的变化时，游标直接跳到这里，下次不用再扫描这些记录
+    latest = get_latest_seq()
+    entries = list(visible_entries(user).filter(seq__gt=since, seq__lte=latest).order_by('seq')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    cursor = entries[-1].seq if has_more else max(latest, since)
+
+    merged = merge_entries(entries)
+    # 每种对象只查一次数据库
+    loaders = get_kind_loaders()
+    objects = {}
+    for kind, (queryset, serializer_class) in loaders.items():
+        ids = [object_id for (entry_kind, object_id), action in merged.items()
+               if entry_kind == kind and action != ChangeLogEntry.ACTION_DELETED]
+        if not ids:
+            continue
+        querysets = [queryset]
+        if kind == ChangeLogEntry.KIND_BOOK:
+            # 图书可能分布在多个分片：普通用户只查自己的分片，管理员查所有分片
+            if user.is_staff:
+                querysets = sharding.gather(queryset)
+            else:
+                querysets = [queryset.using(sharding.shard_for_owner(user.pk)).filter(owner=user)]
+        for queryset in querysets:
+            for obj in queryset.filter(pk__in=ids):
+                objects[(kind, obj.pk)] = serializer_class(obj, context=context or {}).data
+
+    changes = []
+    for (kind, object_id), action in merged.items():
+        data = objects.get((kind, object_id))
+        if action == ChangeLogEntry.ACTION_DELETED or data is None:
+            # 已经不存在（或者不再属于当前用户）的对象返回墓碑记录
+            changes.append({'type': kind, 'id': object_id, 'action': ChangeLogEntry.ACTION_DELETED})
+        else:
+            changes.append({'type': kind, 'id': object_id, 'action': action, 'data': data})
+    return changes, encode_cursor(cursor), has_more
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+# 分页计数策略用到的工具函数
+# | 方式         | 适用场景                         | 是否精确 |
+# | ------------ | -------------------------------- | -------- |
+# | 缓存计数     | 按用户范围 + 过滤条件缓存 COUNT  | 精确（写入提交后失效） |
+# | 维护的计数器 | 没有任何过滤条件的整表           | 精确（写入提交后加减，过期后重新统计） |
+# | 数据库估算值 | 超大整表（PostgreSQL / MySQL）   | 不精确   |
+# ⚠️ 失效和加减都只发生在写入的进程里：别的进程（没有共享缓存时）、不发送信号的写入（`QuerySet.update()`、直接执行 SQL）
+#    都不会更新它，所以缓存都有过期时间，偏差最多持续这么久；
+#    没有配置共享缓存（默认的 LocMemCache 每个进程一份）时，从缓存里读到的计数返回 `count_exact: false`
+
+# 💡 缓存 key 里带一个“版本号”，写入图书时把版本号 +1，旧的计数缓存就自然失效了（不用逐个删除）
+COUNT_VERSION_KEY = 'books:count:version:{scope}'
+COUNT_CACHE_KEY = 'books:count:{label}:{scope}:{version}:{digest}'
+TABLE_COUNT_KEY = 'books:count:table:{alias}:{label}'
+
+
+def scope_for_user(user):
+    """
+    计数缓存的用户范围：管理员看全部图书，普通用户只看自己的图书
+    """
+    if user.is_staff:
+        return 'all'
+    return f'owner:{user.pk}'
+
+
+def is_shared_cache():
+    """
+    缓存是不是所有进程共用的（Redis、Memcached、数据库、文件等）；LocMemCache 每个进程一份，DummyCache 不缓存
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def get_scope_version(scope):
+    key = COUNT_VERSION_KEY.format(scope=scope)
+    version = cache.get(key)
+    if version is None:
+        # 用毫秒时间戳做初始版本：缓存被清空后重新生成的版本号不会和旧版本撞车
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_counts(owner_id=None):
+    """
+    图书写入的事务提交后调用（`transaction.on_commit`）：让“全部”范围以及该图书拥有者范围的计数缓存失效
+    ⚠️ 不要在事务提交前调用：提交前的请求会用新版本号缓存旧的计数
+    """
+    scopes = ['all']
+    if owner_id is not None:
+        scopes.append(f'owner:{owner_id}')
+    for scope in scopes:
+        try:
+            cache.incr(COUNT_VERSION_KEY.format(scope=scope))
+        except ValueError:
+            # 版本号不存在 → 说明这个范围下还没有任何缓存，无需处理
+            pass
+
+
+def get_cached_count(queryset, scope, params, timeout):
+    """
+    按（用户范围, 过滤条件）缓存 COUNT(*) 结果
+    :param params: 参与计数的查询参数（已去掉分页、排序等无关参数）
+    :return: (count, 是否精确)：刚查出来的，或者共享缓存里的才算精确
+    """
+    digest = hashlib.md5(
+        json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    key = COUNT_CACHE_KEY.format(
+        label=queryset.model._meta.label_lower,
+        scope=scope,
+        version=get_scope_version(scope),
+        digest=digest,
+    )
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+        return count, True
+    return count, is_shared_cache()
+
+
+def estimate_table_count(model, using='default'):
+    """
+    读取数据库统计信息里的估算行数，不扫描整张表；不支持的数据库返回 None
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [table],
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL 从未 ANALYZE 过的表 reltuples 是 -1
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def get_table_count(queryset, estimate_threshold, timeout):
+    """
+    整表计数：优先用维护好的计数器；没有计数器（或已过期）时，大表用估算值，小表精确计数并写入计数器
+    :param timeout: 计数器保留多少秒
+    :return: (count, 是否精确)：刚统计的，或者共享缓存里的计数器才算精确
+    """
+    model = queryset.model
+    key = TABLE_COUNT_KEY.format(alias=queryset.db, label=model._meta.label_lower)
+    count = cache.get(key)
+    if count is not None:
+        return count, is_shared_cache()
+    estimate = estimate_table_count(model, using=queryset.db)
+    if estimate is not None and estimate >= estimate_threshold:
+        return estimate, False
+    count = queryset.count()
+    # `add` 而不是 `set`：如果并发请求已经写好了计数器，就不要覆盖它
+    cache.add(key, count, timeout)
+    return count, True
+
+
+def adjust_table_count(model, delta, using='default'):
+    """
+    事务提交后调用：新增 +1，删除 -1；计数器不存在（或已过期）时什么也不做（下次读取时重新统计）
+    💡 `incr` / `decr` 不会改变计数器的过期时间
+    """
+    key = TABLE_COUNT_KEY.format(alias=using, label=model._meta.label_lower)
+    try:
+        if delta >= 0:
+            cache.incr(key, delta)
+        else:
+            cache.decr(key, -delta)
+    except ValueError:
+        pass
@@ -4,6 +4,12 @@
 VALIDATION_ERROR = 'VALIDATION_ERROR'
 NOT_FOUND = 'NOT_FOUND'
 PERMISSION_DENIED = 'PERMISSION_DENIED'
+IDEMPOTENCY_KEY_REUSED = 'IDEMPOTENCY_KEY_REUSED'                    # 同一个 Idempotency-Key 用于不同的请求
+IDEMPOTENCY_REQUEST_IN_PROGRESS = 'IDEMPOTENCY_REQUEST_IN_PROGRESS'  # 相同的请求还在处理中
+CHANGES_CURSOR_EXPIRED = 'CHANGES_CURSOR_EXPIRED'                    # 增量同步的游标太旧，需要全量同步
+SERVICE_UNAVAILABLE = 'SERVICE_UNAVAILABLE'                          # 服务暂时不可用（比如实时推送连接数已满）
+EXPORT_NOT_READY = 'EXPORT_NOT_READY'                                # 导出文件还没有生成完
+EXPORT_EXPIRED = 'EXPORT_EXPIRED'                                    # 导出文件已经被清理，需要重新导出
 BAD_REQUEST= 'BAD_REQUEST',
 UNAUTHORIZED= 'UNAUTHORIZED',
 FORBIDDEN= 'FORBIDDEN',
@@ -19,4 +25,5 @@ COVER_IMAGE_TOO_LARGE = 'COVER_IMAGE_TOO_LARGE'
 HIGHLIGHTED_BOOK_CANNOT_BE_DELETED = 'HIGHLIGHTED_BOOK_CANNOT_BE_DELETED'
 AUTHOR_BANNED = 'AUTHOR_BANNED'
 BOOK_ALREADY_BORROWED = 'BOOK_ALREADY_BORROWED'
-BOOK_OUT_OF_STOCK = 'BOOK_OUT_OF_STOCK'
\ No newline at end of file
+BOOK_OUT_OF_STOCK = 'BOOK_OUT_OF_STOCK'
+BOOK_NOT_BORROWED = 'BOOK_NOT_BORROWED'   # 归还一本没有借的书
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import changes, sharding
+from .models import Book, ChangeLogEntry
+
+logger = logging.getLogger(__name__)
+
+# 图书变化实时推送（Server-Sent Events）：看板不用再每隔几秒轮询 `/api/books/highlighted/`、`/api/books/recent/`
+# 用法：`GET /api/events/books/`（浏览器里 `new EventSource('/api/events/books/')`，用登录后的 session 认证）
+# 每个事件的格式：
+#   id: djE6MTIz                  ← 和增量同步接口的游标相同，断线重连时浏览器自动带上 `Last-Event-ID`
+#   event: book.updated           ← book.created / book.updated / book.highlighted / book.deleted
+#   data: {"type": "book", "id": 3, "action": "updated", "data": {...图书完整数据...}}
+# | 问题                 | 做法                                                                   |
+# | -------------------- | ---------------------------------------------------------------------- |
+# | 跨进程               | 所有进程都把变化写进变更日志表（ChangeLogEntry），每个进程只有一个轮询任务按序号读取新记录， |
+# |                      | 再分发给本进程的所有连接：查询次数和连接数无关，不需要 Redis 等消息服务 |
+# | 上千个连接           | 每个连接只是一个协程 + 一个队列（不占线程）；事件只序列化一次，按拥有者直接找到要通知的连接 |
+# | 权限                 | 管理员收到所有图书的事件，普通用户只收到自己的图书的事件               |
+# | 断线重连             | 带 `Last-Event-ID` 时先从变更日志补发错过的事件；错过太多（或日志已清理）时发送 `reset` 事件， |
+# |                      | 客户端改用 `/api/changes/?since=<游标>` 同步或重新全量加载             |
+# | 客户端太慢           | 队列满了就断开连接，客户端重连后从变更日志补发，不会丢事件             |
+# ⚠️ 必须用 ASGI 部署（比如 `uvicorn bookapi.asgi:application`）：WSGI 下每个连接会一直占用一个线程
+# ⚠️ 推送的 data 里封面图片是相对路径（没有请求上下文，拼不出完整域名）
+# ⚠️ 和增量同步一样，`QuerySet.update()` 不会产生事件
+EVENT_PREFIX = 'book.'
+FETCH_BATCH_SIZE = 500
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class BookEvent:
+    """
+    一条变更日志对应的事件，SSE 文本在创建时就生成好，分发给所有连接时不再重复序列化
+    """
+    def __init__(self, seq, book_id, action, owner_id, data=None, staff_visible=True):
+        self.seq = seq
+        self.owner_id = owner_id
+        self.action = action
+        # 拥有者变更时给原拥有者的墓碑：图书还在，管理员不需要收到删除事件
+        self.staff_visible = staff_visible
+        payload = {'type': ChangeLogEntry.KIND_BOOK, 'id': book_id, 'action': action}
+        if data is not None:
+            payload['data'] = data
+        self.frame = format_frame(changes.encode_cursor(seq), EVENT_PREFIX + action, payload)
+
+
+def format_frame(event_id, event, payload):
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+def load_events(since, limit=FETCH_BATCH_SIZE):
+    """
+    读取序号 since 之后的图书变更，图书数据一次查询加载
+    :return: 事件列表（按序号排列）
+    """
+    from .serializers import BookSerializer  # 避免 serializers → writes → signals 循环导入
+
+    entries = list(
+        ChangeLogEntry.objects.filter(seq__gt=since, kind=ChangeLogEntry.KIND_BOOK).order_by('seq')[:limit]
+    )
+    if not entries:
+        return []
+    queryset = Book.objects.select_related('author', 'owner').prefetch_related('tags').filter(
+        pk__in={entry.object_id for entry in entries}
+    )
+    books = {book.pk: book for shard_queryset in sharding.gather(queryset) for book in shard_queryset}
+    data = {pk: BookSerializer(book).data for pk, book in books.items()}
+    events = []
+    for entry in entries:
+        book = books.get(entry.object_id)
+        if entry.action == ChangeLogEntry.ACTION_DELETED or book is None:
+            events.append(BookEvent(
+                entry.seq, entry.object_id, ChangeLogEntry.ACTION_DELETED, entry.owner_id,
+                staff_visible=book is None,
+            ))
+        else:
+            events.append(BookEvent(entry.seq, entry.object_id, entry.action, entry.owner_id, data[entry.object_id]))
+    return events
+
+
+class Subscriber:
+    def __init__(self, user_id, is_staff, queue_size, last_seq=0):
+        self.user_id = user_id
+        self.is_staff = is_staff
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.last_seq = last_seq  # 已经发出的最大序号，补发和实时推送重叠的事件会被跳过
+        self.overflowed = False
+
+    def accepts(self, event):
+        if self.is_staff:
+            return event.staff_visible
+        return event.owner_id == self.user_id
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBroker:
+    """
+    单个事件循环里的事件分发：一个轮询任务读取变更日志，推送到各个连接的队列
+    """
+    def __init__(self):
+        self._staff = set()
+        self._by_owner = defaultdict(set)  # 拥有者 id → 连接，分发时不用遍历所有连接
+        self._task = None
+        self._last_seq = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._staff) + sum(len(subscribers) for subscribers in self._by_owner.values())
+
+    async def subscribe(self, user, last_seq=0):
+        if self._task is None:
+            # 先确定轮询的起点再登记连接：登记之后的变化一定会被推送
+            latest = await sync_to_async(changes.get_latest_seq)()
+            if self._task is None:
+                self._last_seq = latest
+                self._task = asyncio.get_running_loop().create_task(self.poll())
+        subscriber = Subscriber(user.pk, user.is_staff, get_setting('BOOKS_EVENTS_QUEUE_SIZE', 100), last_seq)
+        if subscriber.is_staff:
+            self._staff.add(subscriber)
+        else:
+            self._by_owner[subscriber.user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber.is_staff:
+            self._staff.discard(subscriber)
+        else:
+            subscribers = self._by_owner.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_owner[subscriber.user_id]
+        if not self.subscriber_count and self._task is not None:
+            # 没有连接了就停止轮询，下一个连接进来时重新开始
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, events):
+        for event in events:
+            if event.staff_visible:
+                for subscriber in self._staff:
+                    subscriber.push(event)
+            for subscriber in self._by_owner.get(event.owner_id, ()):
+                subscriber.push(event)
+
+    async def poll(self):
+        interval = get_setting('BOOKS_EVENTS_POLL_INTERVAL', 1.0)
+        while True:
+            try:
+                events = await sync_to_async(load_events)(self._last_seq)
+            except Exception:
+                logger.exception('读取变更日志失败')
+                events = []
+            if events:
+                self._last_seq = events[-1].seq
+                self.publish(events)
+            # 一批读满了说明还有积压，马上读下一批
+            if len(events) < FETCH_BATCH_SIZE:
+                await asyncio.sleep(interval)
+
+
+# 每个事件循环一个分发器：ASGI 部署时一个进程只有一个事件循环，也就只有一个轮询任务
+_brokers = weakref.WeakKeyDictionary()
+
+
+def get_broker():
+    loop = asyncio.get_running_loop()
+    broker = _brokers.get(loop)
+    if broker is None:
+        broker = _brokers[loop] = EventBroker()
+    return broker
+
+
+def get_event_user(request):
+    """
+    用 DRF 配置的认证方式（JWT / session / basic）识别用户，认证失败或匿名返回 None
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def load_replay(user, since):
+    """
+    断线重连时补发错过的事件
+    :return: (事件列表, 是否需要客户端重新同步)
+    """
+    limit = get_setting('BOOKS_EVENTS_REPLAY_LIMIT', 1000)
+    try:
+        changes.check_cursor(since)
+    except changes.CursorExpired:
+        return [], True
+    events = load_events(since, limit + 1)
+    if len(events) > limit:
+        return [], True
+    subscriber = Subscriber(user.pk, user.is_staff, 0)
+    return [event for event in events if subscriber.accepts(event)], False
+
+
+async def stream_events(user, last_event_id=None):
+    """
+    一个连接的事件流：补发错过的事件 → 实时推送，没有事件时定时发送心跳注释，防止代理断开空闲连接
+    """
+    heartbeat = get_setting('BOOKS_EVENTS_HEARTBEAT', 15)
+    broker = get_broker()
+    # 先登记再补发：两者重叠的事件按序号跳过，中间不会漏掉
+    subscriber = await broker.subscribe(user)
+    try:
+        yield f'retry: {get_setting("BOOKS_EVENTS_RETRY_MS", 3000)}\n\n'.encode('utf-8')
+        if last_event_id is not None:
+            events, reset = await sync_to_async(load_replay)(user, last_event_id)
+            if reset:
+                latest = await sync_to_async(changes.get_latest_seq)()
+                subscriber.last_seq = latest
+                yield format_frame(changes.encode_cursor(latest), 'reset', {'cursor': changes.encode_cursor(latest)})
+            for event in events:
+                subscriber.last_seq = event.seq
+                yield event.frame
+        while True:
+            if subscriber.overflowed and subscriber.queue.empty():
+                # 客户端太慢，断开后由客户端带着 Last-Event-ID 重连补发
+                return
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b': ping\n\n'
+                continue
+            if event.seq <= subscriber.last_seq or not subscriber.accepts(event):
+                continue
+            subscriber.last_seq = event.seq
+            yield event.frame
+    finally:
+        broker.unsubscribe(subscriber)
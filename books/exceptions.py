@@ -1,5 +1,5 @@
 from rest_framework.exceptions import APIException
-from .error_codes import COVER_IMAGE_TOO_LARGE, HIGHLIGHTED_BOOK_CANNOT_BE_DELETED,BOOK_BUSINESS_ERROR,BOOK_OUT_OF_STOCK,BOOK_ALREADY_BORROWED,AUTHOR_BANNED
+from .error_codes import SERVICE_UNAVAILABLE, COVER_IMAGE_TOO_LARGE, HIGHLIGHTED_BOOK_CANNOT_BE_DELETED,BOOK_BUSINESS_ERROR,BOOK_OUT_OF_STOCK,BOOK_ALREADY_BORROWED,AUTHOR_BANNED,BOOK_NOT_BORROWED
 
 class BookBusinessException(APIException):
     """
@@ -27,6 +27,11 @@ class BookAlreadyBorrowedError(BookBusinessException):
     default_code = BOOK_ALREADY_BORROWED
     default_detail = '该书已被借出，无法重复借阅'
 
+class BookNotBorrowedError(BookBusinessException):
+    status_code = 400
+    default_code = BOOK_NOT_BORROWED
+    default_detail = '没有借阅这本书，无法归还'
+
 class AuthorBannedError(BookBusinessException):
     status_code = 403 # 权限类错误用403
     default_code = AUTHOR_BANNED
@@ -41,4 +46,10 @@ class HighlightedBookCannotBeDeletedError(BookBusinessException):
 class CoverImageTooLargeError(BookBusinessException):
     status_code = 400
     default_code = COVER_IMAGE_TOO_LARGE
-    default_detail = '封面图片不能超过5MB'
\ No newline at end of file
+    default_detail = '封面图片不能超过5MB'
+
+# 写线程（books/writer.py）在限定时间内没有处理完写操作
+class WriterTimeoutError(APIException):
+    status_code = 503
+    default_code = SERVICE_UNAVAILABLE
+    default_detail = '写入排队超时，请稍后重试'
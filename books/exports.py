@@ -0,0 +1,296 @@
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from . import changes, jobs, sharding
+from .filters import BookFilter
+from .models import Book, Job
+
+# 图书导出：在后台任务里生成整个（过滤后的）图书目录文件，客户端查询进度、完成后下载，不用翻几千页 `/api/books/`
+# 1. `POST /api/exports/` 提交：{"format": "csv", "compression": "gzip", "filters": {"min_price": 30, "tags": "1,3"}}
+#    filters 和图书列表接口的过滤参数（BookFilter）相同
+# 2. `GET /api/exports/<id>/` 查看状态和进度（progress），完成后返回 download_url
+# 3. `GET /api/exports/<id>/download/` 下载，支持 `Range` 断点续传
+# | 格式     | 说明                                                   |
+# | -------- | ------------------------------------------------------ |
+# | `csv`    | 带 BOM 的 UTF-8（Excel 直接打开中文不乱码），标签用 `|` 分隔 |
+# | `ndjson` | 每行一个 JSON 对象，标签是数组                         |
+# 💡 相同的导出（同一个可见范围、格式、压缩、过滤条件）在数据没有变化之前直接复用已经生成的文件：
+#    “数据有没有变化”用变更日志的最新序号判断（见 books/changes.py），任何图书 / 作者 / 标签的修改都会让旧文件失效
+# 💡 管理员导出全部图书，普通用户只导出自己的图书
+# 💡 导出文件保留 `BOOKS_EXPORT_RETENTION` 秒：每次导出完成时顺便清理过期的文件，也可以定期执行
+#    `python manage.py prune_exports`；文件被清理后下载返回 410，再提交一次相同的导出会重新生成
+EXPORT_TASK = 'export_books'
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', '.csv'),
+    'ndjson': ('application/x-ndjson', '.ndjson'),
+}
+COMPRESSIONS = {
+    'none': '',
+    'gzip': '.gz',
+}
+ARTIFACT_PATTERN = re.compile(r'^[0-9a-f]{32}-\d+\.')  # 导出文件（含临时文件）的文件名：{key}-{seq}.扩展名
+CSV_COLUMNS = ('id', 'title', 'author', 'price', 'published_date', 'is_highlighted', 'owner', 'tags', 'updated_at')
+
+
+def get_export_dir():
+    return Path(getattr(settings, 'BOOKS_EXPORT_DIR', Path(settings.BASE_DIR) / 'exports'))
+
+
+def get_retention():
+    return getattr(settings, 'BOOKS_EXPORT_RETENTION', 24 * 3600)
+
+
+def get_scope(user):
+    return 'all' if user.is_staff else f'owner:{user.pk}'
+
+
+def get_scoped_querysets(scope):
+    """
+    :return: 查询集列表：管理员的导出每个分片一个（见 books/sharding.py），普通用户只查自己的分片
+    """
+    queryset = Book.objects.select_related('author', 'owner').prefetch_related('tags').order_by('id')
+    if scope == 'all':
+        return sharding.gather(queryset)
+    owner_id = int(scope.split(':', 1)[1])
+    return [queryset.using(sharding.shard_for_owner(owner_id)).filter(owner_id=owner_id)]
+
+
+def normalize_filters(filters):
+    # 数字和字符串统一成字符串（和 URL 查询参数一样），`{"min_price": 30}` 和 `{"min_price": "30"}` 算同一个导出
+    return {name: str(value) for name, value in sorted(filters.items()) if value not in (None, '')}
+
+
+def validate_filters(filters):
+    """
+    :return: 错误信息（字段 → 错误列表），没有错误时返回空字典
+    """
+    unknown = set(filters) - set(BookFilter.base_filters)
+    if unknown:
+        return {name: ['不支持这个过滤参数'] for name in sorted(unknown)}
+    filterset = BookFilter(data=filters, queryset=Book.objects.none())
+    return {} if filterset.is_valid() else filterset.errors
+
+
+def get_export_key(scope, export_format, compression, filters):
+    data = json.dumps([scope, export_format, compression, filters], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def get_artifact_path(payload):
+    _, extension = FORMATS[payload['format']]
+    return get_export_dir() / f"{payload['key']}-{payload['seq']}{extension}{COMPRESSIONS[payload['compression']]}"
+
+
+def find_reusable_export(key, seq):
+    """
+    数据没有变化时，复用排队中、执行中或已经完成（文件还在）的相同导出
+    """
+    job = (
+        Job.objects.filter(name=EXPORT_TASK, payload__key=key, payload__seq=seq)
+        .exclude(status=Job.STATUS_FAILED)
+        .order_by('-id')
+        .first()
+    )
+    if job is not None and job.status == Job.STATUS_SUCCEEDED and not get_artifact_path(job.payload).exists():
+        return None
+    return job
+
+
+def request_export(user, export_format, compression, filters):
+    """
+    :return: (Job, 是否复用了已有的导出)
+    """
+    scope = get_scope(user)
+    filters = normalize_filters(filters)
+    key = get_export_key(scope, export_format, compression, filters)
+    seq = changes.get_latest_seq()
+    job = find_reusable_export(key, seq)
+    if job is not None:
+        return job, True
+    payload = {
+        'scope': scope, 'format': export_format, 'compression': compression,
+        'filters': filters, 'key': key, 'seq': seq,
+    }
+    return jobs.enqueue(EXPORT_TASK, payload, owner=user), False
+
+
+def export_row(book):
+    return {
+        'id': book.pk,
+        'title': book.title,
+        'author': book.author.name,
+        'price': str(book.price),
+        'published_date': book.published_date.isoformat(),
+        'is_highlighted': book.is_highlighted,
+        'owner': book.owner.username if book.owner else None,
+        'tags': [tag.name for tag in book.tags.all()],
+        'updated_at': book.updated_at.isoformat(),
+    }
+
+
+def open_artifact(path, compression):
+    raw = open(path, 'wb')
+    if compression == 'gzip':
+        # mtime=0：相同的数据生成的文件字节完全相同
+        return gzip.GzipFile(fileobj=raw, mode='wb', mtime=0), raw
+    return raw, raw
+
+
+def build_export(job):
+    """
+    后台任务：按 id 顺序分批读取图书写入临时文件，完成后改名成正式文件（下载时不会读到写了一半的文件）
+    """
+    payload = job.payload
+    querysets = [
+        BookFilter(data=payload['filters'], queryset=queryset).qs for queryset in get_scoped_querysets(payload['scope'])
+    ]
+    total = sum(queryset.count() for queryset in querysets)
+    chunk_size = getattr(settings, 'BOOKS_EXPORT_CHUNK_SIZE', 2000)
+    path = get_artifact_path(payload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'{path.name}.{job.pk}.tmp')
+
+    rows = 0
+    try:
+        stream, raw = open_artifact(temp_path, payload['compression'])
+        with raw, stream:
+            text = io.TextIOWrapper(stream, encoding='utf-8-sig' if payload['format'] == 'csv' else 'utf-8', newline='')
+            writer = None
+            if payload['format'] == 'csv':
+                writer = csv.writer(text)
+                writer.writerow(CSV_COLUMNS)
+            # iterator() 分批读取，不会一次把所有图书加载到内存；每批的标签用一条查询预取
+            # 多个分片按 id 归并（每个分片已经按 id 排好序），文件里仍然是按 id 排列
+            books = heapq.merge(
+                *(queryset.iterator(chunk_size=chunk_size) for queryset in querysets), key=lambda book: book.pk
+            )
+            for book in books:
+                row = export_row(book)
+                if writer is not None:
+                    row['tags'] = '|'.join(row['tags'])
+                    writer.writerow([row[column] for column in CSV_COLUMNS])
+                else:
+                    text.write(json.dumps(row, ensure_ascii=False) + '\n')
+                rows += 1
+                if rows % chunk_size == 0:
+                    jobs.report_progress(job, rows * 100 // max(total, 1) - 1)
+            text.flush()
+            text.detach()
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    # 同一个导出的旧文件（数据变化之前生成的）已经不会再被复用
+    for stale in path.parent.glob(f"{payload['key']}-*"):
+        if stale != path and not stale.name.endswith('.tmp'):
+            stale.unlink(missing_ok=True)
+    prune_exports()
+    return {'file': path.name, 'size': path.stat().st_size, 'rows': rows}
+
+
+def prune_exports(retention=None):
+    """
+    删除生成超过 retention 秒的导出文件（包括任务异常退出留下的临时文件；写入中的临时文件修改时间一直在更新，不会被删除）
+    :return: 删除的文件数
+    """
+    retention = get_retention() if retention is None else retention
+    cutoff = time.time() - retention
+    export_dir = get_export_dir()
+    if not export_dir.is_dir():
+        return 0
+    deleted = 0
+    for path in export_dir.iterdir():
+        if ARTIFACT_PATTERN.match(path.name) and path.is_file() and path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            deleted += 1
+    return deleted
+
+
+def get_download_name(job):
+    _, extension = FORMATS[job.payload['format']]
+    return f'books-{job.pk}{extension}{COMPRESSIONS[job.payload["compression"]]}'
+
+
+def get_content_type(job):
+    if job.payload['compression'] == 'gzip':
+        return 'application/gzip'
+    return FORMATS[job.payload['format']][0]
+
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    解析 `Range: bytes=0-99` / `bytes=100-` / `bytes=-100`（最后 100 个字节）
+    :return: (start, end)（包含 end）；不是单个字节范围时返回 None（按完整文件返回）
+    :raise ValueError: 范围超出文件大小（416）
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(path, start, length, block_size=64 * 1024):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def file_response(request, job):
+    """
+    返回导出文件，支持单个 `Range` 范围（206）和 `If-Range`（文件变了就返回完整文件）
+    """
+    path = get_artifact_path(job.payload)
+    size = path.stat().st_size
+    etag = f'"{path.name}"'
+    content_type = get_content_type(job)
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(path, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = content_disposition_header(True, get_download_name(job))
+    return response
@@ -0,0 +1,107 @@
+from django.db.models import Count, F, IntegerField
+from django.db.models.functions import Cast, ExtractYear, Floor
+
+from .rollups import get_price_band_width
+
+# 分面统计（facets）：在当前过滤条件下，统计每个作者 / 标签 / 出版年份 / 价格区间各有多少本书
+# URL示例：GET /api/books/?min_price=30&facets=author,tag
+# - `facets=all` 表示返回全部分面
+# - 每个分面只执行一条 GROUP BY 查询，不会按分面的取值逐个查询
+# 返回格式：
+# "facets": {
+#     "author": [{"value": 1, "label": "鲁迅", "count": 3}],
+#     "price":  [{"value": 30, "label": "30-40", "count": 2}]
+# }
+FACETS = ('author', 'tag', 'year', 'price')
+DEFAULT_FACET_LIMIT = 20
+MAX_FACET_LIMIT = 100
+
+
+def parse_facets(request):
+    """
+    解析 `?facets=author,tag`，返回需要统计的分面名字列表（不认识的名字直接忽略）
+    """
+    names = []
+    for value in request.query_params.getlist('facets'):
+        names.extend(name.strip() for name in value.split(',') if name.strip())
+    if 'all' in names:
+        return list(FACETS)
+    return [name for name in FACETS if name in names]
+
+
+def parse_facet_limit(request):
+    try:
+        limit = int(request.query_params.get('facet_limit', DEFAULT_FACET_LIMIT))
+    except ValueError:
+        limit = DEFAULT_FACET_LIMIT
+    return max(1, min(limit, MAX_FACET_LIMIT))
+
+
+def author_facet(queryset, limit):
+    rows = (
+        queryset.order_by()
+        .values('author_id', 'author__name')
+        .annotate(count=Count('id'))
+        .order_by('-count', 'author_id')[:limit]
+    )
+    return [{'value': row['author_id'], 'label': row['author__name'], 'count': row['count']} for row in rows]
+
+
+def tag_facet(queryset, limit):
+    # 直接在中间表上分组：WHERE book_id IN (当前过滤条件的子查询)
+    through = queryset.model.tags.through
+    rows = (
+        through.objects.using(queryset.db)
+        .filter(book_id__in=queryset.order_by().values('pk'))
+        .values('tag_id', 'tag__name')
+        .annotate(count=Count('book_id'))
+        .order_by('-count', 'tag_id')[:limit]
+    )
+    return [{'value': row['tag_id'], 'label': row['tag__name'], 'count': row['count']} for row in rows]
+
+
+def year_facet(queryset, limit):
+    rows = (
+        queryset.order_by()
+        .annotate(year=ExtractYear('published_date'))
+        .values('year')
+        .annotate(count=Count('id'))
+        .order_by('year')
+    )
+    return [{'value': row['year'], 'label': str(row['year']), 'count': row['count']} for row in rows]
+
+
+def price_facet(queryset, limit):
+    # 价格区间和统计接口 `/api/stats/prices/` 使用同一个区间宽度
+    width = get_price_band_width()
+    rows = (
+        queryset.order_by()
+        .annotate(band=Cast(Floor(F('price') / width), IntegerField()))
+        .values('band')
+        .annotate(count=Count('id'))
+        .order_by('band')
+    )
+    return [
+        {
+            'value': row['band'] * width,
+            'label': f"{row['band'] * width}-{(row['band'] + 1) * width}",
+            'count': row['count'],
+        }
+        for row in rows
+    ]
+
+
+FACET_FUNCTIONS = {
+    'author': author_facet,
+    'tag': tag_facet,
+    'year': year_facet,
+    'price': price_facet,
+}
+
+
+def compute_facets(queryset, names, limit=DEFAULT_FACET_LIMIT):
+    """
+    :param queryset: 已经应用了过滤条件（但还没分页）的查询集
+    :param names: 需要统计的分面
+    """
+    return {name: FACET_FUNCTIONS[name](queryset, limit) for name in names}
@@ -1,5 +1,6 @@
 import django_filters
-from .models import Book
+from django.db.models import Count
+from .models import Author, Book, Tag
 # 按价格范围过滤，需要自定义过滤器
 # URL示例：GET /api/books/?min_price=30&max_price=60
 # 💡 `lookup_expr` 常见值：
@@ -9,6 +10,21 @@ from .models import Book
 # - `'lt'` → <
 # - `'icontains'` → 包含（模糊）
 
+# 逗号分隔的数字列表过滤器，例如 `?tags=1,3,5`
+# `BaseInFilter` 负责按逗号拆分，`NumberFilter` 负责校验每一项都是数字
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+def get_tag_link_fields(model):
+    """
+    返回 (中间表, 指向图书的字段名, 指向标签的字段名)，比如 books_book_tags 表的 book_id / tag_id
+    """
+    field = model._meta.get_field('tags')
+    through = field.remote_field.through
+    return through, field.m2m_column_name(), field.m2m_reverse_name()
+
+
 # `FilterSet` 是 `django-filter` 提供的基类，专门用于定义一组过滤规则。继承后，这个类就具备了“自动解析 URL 查询参数并生成数据库查询条件”的能力。
 class BookFilter(django_filters.FilterSet):
     # | 部分                          | 说明                                                        |
@@ -25,7 +41,56 @@ class BookFilter(django_filters.FilterSet):
     # | `field_name="price"` | 依然作用于 `Book.price` 字段    |
     # | `lookup_expr='lte'`  | 表示 **“小于等于”（≤）**        |
     max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    # 按标签过滤（多对多）
+    # | 参数                | 语义                             | 生成的 SQL                                  |
+    # | ------------------- | -------------------------------- | ------------------------------------------- |
+    # | `?tags=1,3`         | 含有任意一个标签（ANY）          | `WHERE id IN (SELECT book_id FROM 中间表 WHERE tag_id IN (1, 3))` |
+    # | `?tags_all=1,3`     | 同时含有所有标签（ALL）          | `WHERE id IN (... GROUP BY book_id HAVING COUNT(*) = 2)` |
+    # 💡 没有用 `filter(tags__in=...).distinct()`：JOIN 会让一本书出现多次，再 DISTINCT 去重，数据量大时很慢
+    tags = NumberInFilter(method='filter_tags_any')
+    tags_all = NumberInFilter(method='filter_tags_all')
+
+    def filter_tags_any(self, queryset, name, value):
+        tag_ids = {int(tag_id) for tag_id in value}
+        if not tag_ids:
+            return queryset
+        through, book_column, tag_column = get_tag_link_fields(queryset.model)
+        # 半连接子查询：从 (tag_id, book_id) 索引出发取 book_id，一本书只会匹配一次，不需要 DISTINCT
+        links = through.objects.filter(**{f'{tag_column}__in': tag_ids}).values(book_column)
+        return queryset.filter(pk__in=links)
+
+    def filter_tags_all(self, queryset, name, value):
+        tag_ids = {int(tag_id) for tag_id in value}
+        if not tag_ids:
+            return queryset
+        through, book_column, tag_column = get_tag_link_fields(queryset.model)
+        # 中间表上 (book_id, tag_id) 唯一，所以命中标签的数量 == 要求的标签数量 就说明全部都有
+        matched = (
+            through.objects.filter(**{f'{tag_column}__in': tag_ids})
+            .values(book_column)
+            .annotate(matched_tags=Count(tag_column))
+            .filter(matched_tags=len(tag_ids))
+            .values(book_column)
+        )
+        return queryset.filter(pk__in=matched)
     # 开始定义内部配置类 `Meta`
     class Meta:
         model = Book  #指定这个 `FilterSet` 要作用于哪个 Django 模型
-        fields = ['author']   #fields = ['author']   只自动加 author 过滤（`author`（自动创建，精确匹配）  ），price 用手动字段控制
\ No newline at end of file
+        fields = ['author']   #fields = ['author']   只自动加 author 过滤（`author`（自动创建，精确匹配）  ），price 用手动字段控制
+
+# 作者、标签按图书数量过滤：`?min_books=10&max_books=100`（book_count 是冗余字段，有索引，见 books/bookcounts.py）
+class BookCountFilter(django_filters.FilterSet):
+    min_books = django_filters.NumberFilter(field_name='book_count', lookup_expr='gte')
+    max_books = django_filters.NumberFilter(field_name='book_count', lookup_expr='lte')
+
+
+class AuthorFilter(BookCountFilter):
+    class Meta:
+        model = Author
+        fields = ['min_books', 'max_books']
+
+
+class TagFilter(BookCountFilter):
+    class Meta:
+        model = Tag
+        fields = ['min_books', 'max_books']
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import Max
+
+from . import sharding
+from .models import Book, ChangeLogEntry
+
+logger = logging.getLogger(__name__)
+
+# 热点数据：每个进程在内存里保存“最近添加的图书”和“高亮图书”，`recent` / `highlighted` 接口直接读内存，不查数据库
+# | 数据       | 结构                             | 说明                                    |
+# | ---------- | -------------------------------- | --------------------------------------- |
+# | 最近添加   | `deque(maxlen=N)` 环形缓冲区     | 新书从左边进，最旧的自动挤出去          |
+# | 高亮图书   | `dict`（按 id 排序输出）         | 超过容量就标记为“不完整”，接口回退查库  |
+# 🔄 更新方式：
+# - 本进程写入图书 → 信号（事务提交后）只重新加载这一本书，增量更新内存
+# - 多进程（gunicorn 多个 worker）→ 共享缓存里有一个版本号，任何写入都会 +1；
+#   读的时候发现版本号和自己的不一致，说明别的进程改过数据，重新从数据库预热
+# - 兜底：每隔 `BOOKS_HOTSET_RECHECK_INTERVAL` 秒查一次变更日志的最大序号（主键上取 MAX，一条很快的查询），
+#   和预热时记下的不一致就重新预热
+# ⚠️ 默认的 LocMemCache 每个进程一份，版本号只在本进程内有效；没有配置共享缓存（Redis / Memcached 等）时
+#    靠上面的兜底检查，其他进程的修改最多延迟这么久（本进程的修改也会让兜底检查多预热一次）
+VERSION_KEY = 'books:hotset:version'
+
+
+class HotBooks:
+    def __init__(self, recent_size=None, highlighted_size=None, recheck_interval=None):
+        self.recent_size = recent_size or getattr(settings, 'BOOKS_HOTSET_RECENT_SIZE', 5)
+        self.highlighted_size = highlighted_size or getattr(settings, 'BOOKS_HOTSET_HIGHLIGHTED_SIZE', 200)
+        self.recheck_interval = recheck_interval or getattr(settings, 'BOOKS_HOTSET_RECHECK_INTERVAL', 5)
+        self._lock = threading.RLock()
+        self._recent = deque(maxlen=self.recent_size)
+        self._highlighted = {}
+        self._highlighted_complete = False
+        self._warm = False
+        self._version = None
+        self._change_seq = None  # 预热时变更日志的最大序号
+        self._checked_at = 0.0   # 上次检查变更日志的时间（time.monotonic()）
+
+    def get_queryset(self):
+        # 一次性把序列化需要的关联数据都查出来，之后序列化不会再触发查询
+        return Book.objects.select_related('author', 'owner').prefetch_related('tags')
+
+    def warm_up(self):
+        """
+        从数据库加载热点数据（冷启动、或发现其他进程修改过数据时调用）
+        """
+        # 先读版本号再查库：查库期间如果有新的写入，版本号会变，下次读取时再预热一次
+        version = self.get_shared_version()
+        change_seq = self.get_change_seq()
+        # 开启分片时每个分片各取一份再合并（id 全局递增，按 id 排序仍然是添加的先后顺序）
+        recent = sorted(
+            (book for queryset in sharding.gather(self.get_queryset().order_by('-id'))
+             for book in queryset[:self.recent_size]),
+            key=lambda book: -book.pk,
+        )[:self.recent_size]
+        highlighted = sorted(
+            (book for queryset in sharding.gather(self.get_queryset().filter(is_highlighted=True).order_by('id'))
+             for book in queryset[:self.highlighted_size + 1]),
+            key=lambda book: book.pk,
+        )[:self.highlighted_size + 1]
+        with self._lock:
+            self._recent = deque(recent, maxlen=self.recent_size)
+            self._highlighted = {book.pk: book for book in highlighted[:self.highlighted_size]}
+            self._highlighted_complete = len(highlighted) <= self.highlighted_size
+            self._version = version
+            self._change_seq = change_seq
+            self._checked_at = time.monotonic()
+            self._warm = True
+
+    def get_shared_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 0, None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def get_change_seq(self):
+        return ChangeLogEntry.objects.using(sharding.HOME_ALIAS).aggregate(seq=Max('seq'))['seq']
+
+    def changed_elsewhere(self):
+        """
+        兜底检查：距离上次检查超过 recheck_interval 秒时，看变更日志有没有新记录
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.recheck_interval:
+            return False
+        self._checked_at = now
+        return self.get_change_seq() != self._change_seq
+
+    def ensure_fresh(self):
+        # 检查版本号只读一次缓存；每隔 recheck_interval 秒才查一次数据库
+        if not self._warm or cache.get(VERSION_KEY) != self._version or self.changed_elsewhere():
+            self.warm_up()
+
+    def get_recent(self):
+        self.ensure_fresh()
+        with self._lock:
+            return list(self._recent)
+
+    def get_highlighted(self, owner_id=None):
+        """
+        :param owner_id: 只返回这个用户的图书；None 表示全部（管理员）
+        :return: 图书列表；高亮图书太多、内存里不完整时返回 None（调用方回退查数据库）
+        """
+        self.ensure_fresh()
+        with self._lock:
+            if not self._highlighted_complete:
+                return None
+            books = sorted(self._highlighted.values(), key=lambda book: book.pk)
+        if owner_id is not None:
+            books = [book for book in books if book.owner_id == owner_id]
+        return books
+
+    def is_relevant(self, book_id, is_highlighted=None):
+        # 和热点数据无关的图书（不在“最近添加”里、也不是高亮）就不用重新加载
+        with self._lock:
+            ids = [item.pk for item in self._recent]
+            return (
+                book_id in ids
+                or len(ids) < self.recent_size
+                or book_id > ids[0]
+                or book_id in self._highlighted
+                or bool(is_highlighted)
+            )
+
+    def book_changed(self, book_id, using='default', is_highlighted=None):
+        """
+        事务提交后调用：重新加载这一本书（新增、修改、标签变化）
+        :param is_highlighted: 图书当前是否高亮（信号里已知时传入，可以省掉无关图书的查询）
+        """
+        if not self._warm or not self.is_relevant(book_id, is_highlighted):
+            self.publish_change()
+            return
+        book = self.get_queryset().using(using).filter(pk=book_id).first()
+        if book is None:
+            self.book_removed(book_id)
+            return
+        with self._lock:
+            ids = [item.pk for item in self._recent]
+            if book.pk in ids:
+                self._recent[ids.index(book.pk)] = book
+            elif not ids or book.pk > ids[0]:
+                # 比缓冲区里最新的还新 → 是刚添加的书，放到最左边
+                self._recent.appendleft(book)
+            if book.is_highlighted:
+                self._highlighted[book.pk] = book
+                if len(self._highlighted) > self.highlighted_size:
+                    self._highlighted.pop(max(self._highlighted))
+                    self._highlighted_complete = False
+            else:
+                self._highlighted.pop(book.pk, None)
+        self.publish_change()
+
+    def book_removed(self, book_id):
+        with self._lock:
+            ids = [item.pk for item in self._recent]
+            if book_id in ids:
+                # “最近添加”少了一本，需要从数据库补齐，下次读取时重新预热
+                self._warm = False
+            self._highlighted.pop(book_id, None)
+        self.publish_change()
+
+    def invalidate(self):
+        """
+        作者、标签等关联数据变化时调用：整体失效，下次读取时重新预热
+        """
+        with self._lock:
+            self._warm = False
+        self.publish_change()
+
+    def publish_change(self):
+        """
+        版本号 +1，通知其他进程；如果版本号跳了不止 1，说明其他进程也改过，自己也要重新预热
+        """
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            self._warm = False
+            return
+        with self._lock:
+            if self._warm and self._version is not None and version == self._version + 1:
+                self._version = version
+            else:
+                self._warm = False
+
+
+hot_books = HotBooks()
+
+
+def warm_up_on_startup():
+    """
+    进程启动时预热（在 wsgi.py / asgi.py 里调用），数据库还没迁移时只记录日志，不影响启动
+    """
+    if not getattr(settings, 'BOOKS_HOTSET_WARMUP_ON_STARTUP', True):
+        return
+    try:
+        hot_books.warm_up()
+    except DatabaseError:
+        logger.warning('热点图书预热失败，将在第一次请求时加载', exc_info=True)
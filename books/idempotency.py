@@ -0,0 +1,302 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from bookapi.utils import error_response
+from . import sharding
+from .error_codes import VALIDATION_ERROR, IDEMPOTENCY_KEY_REUSED, IDEMPOTENCY_REQUEST_IN_PROGRESS
+from .models import IdempotencyRecord
+
+# 幂等键（Idempotency-Key）：网络不好的客户端重试写请求时，不会重复创建图书
+# 用法：请求头带上 `Idempotency-Key: <客户端生成的唯一字符串，比如 UUID>`
+# | 情况                                 | 处理                                                     |
+# | ------------------------------------ | -------------------------------------------------------- |
+# | 第一次请求                           | 正常执行，把响应（状态码 < 500）保存下来                 |
+# | 重试（同一个 key、同样的请求内容）   | 直接返回保存的响应，不校验（本进程保存过的连数据库都不查），响应头带 `Idempotent-Replayed: true` |
+# | 并发的重复请求（第一个还没执行完）   | 等第一个执行完，返回同一个响应（只执行一次，不管在不在同一个进程） |
+# | 同一个 key 但请求内容不同            | 返回 422                                                 |
+# | 第一次请求出错（5xx / 未处理的异常） | 不保存，允许客户端用同一个 key 重试                      |
+# 💡 key 按用户隔离，不同用户用同一个 key 互不影响
+# 💡 两层存储，每个保存 `BOOKS_IDEMPOTENCY_TTL` 秒：
+# | 层         | 存在哪里                                    | 作用                                                     |
+# | ---------- | ------------------------------------------- | -------------------------------------------------------- |
+# | 本地       | 进程内存（LRU，最多 `BOOKS_IDEMPOTENCY_MAX_KEYS` 个） | 同一个进程里的重试不查数据库；并发的重复请求用 Event 等待 |
+# | 共享       | 默认数据库的 IdempotencyRecord 表           | 多进程部署时重试落到别的 worker 上也能命中；(用户, key) 唯一约束保证只有一个请求执行 |
+#    本地没有记录时才查共享表；别的进程正在执行时每隔 `SHARED_POLL_INTERVAL` 秒查一次，等它执行完
+# 💡 共享表里执行中的记录有租约（`BOOKS_IDEMPOTENCY_LOCK_TIMEOUT` 秒），进程异常退出后过了租约别的请求可以接手；
+#    过期的记录用到时顺便删除，其余的由 `python manage.py prune_idempotency_keys` 定期清理
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+SHARED_POLL_INTERVAL = 0.1
+
+
+class IdempotencyEntry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.event = threading.Event()  # 第一个请求执行完（或放弃）时通知等待的重复请求
+        self.result = None              # (状态码, 数据, 响应头)
+        self.expires_at = None          # 执行完之后才开始计算过期时间
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or getattr(settings, 'BOOKS_IDEMPOTENCY_MAX_KEYS', 10000)
+        self.ttl = ttl or getattr(settings, 'BOOKS_IDEMPOTENCY_TTL', 24 * 3600)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 按最近使用排序（LRU）
+
+    def begin(self, key, fingerprint):
+        """
+        :return: (entry, 是否由当前请求执行)；已有同一个 key 的记录时返回那条记录
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, False
+            entry = IdempotencyEntry(fingerprint)
+            self._entries[key] = entry
+            self.evict(now)
+            return entry, True
+
+    def evict(self, now):
+        # 先清理过期的，再按 LRU 淘汰到容量以内（正在执行的请求不淘汰）
+        for key in [key for key, entry in self._entries.items() if entry.expires_at is not None and entry.expires_at <= now]:
+            del self._entries[key]
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if self._entries[key].expires_at is not None:
+                del self._entries[key]
+
+    def finish(self, key, entry, result):
+        with self._lock:
+            entry.result = result
+            entry.expires_at = time.monotonic() + self.ttl
+        entry.event.set()
+
+    def abandon(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+idempotency_store = IdempotencyStore()
+
+
+# === 共享存储（IdempotencyRecord 表） ===
+def get_ttl():
+    return getattr(settings, 'BOOKS_IDEMPOTENCY_TTL', 24 * 3600)
+
+
+def get_lock_timeout():
+    return getattr(settings, 'BOOKS_IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+
+def claim_shared(user_id, key, fingerprint):
+    """
+    在共享表里抢执行权
+    :return: (record, 是否由当前请求执行)；已有没过期的记录时返回那条记录
+    """
+    records = IdempotencyRecord.objects.using(sharding.HOME_ALIAS)
+    while True:
+        now = timezone.now()
+        record = records.filter(user_id=user_id, key=key).first()
+        if record is not None:
+            if record.expires_at > now:
+                return record, False
+            # 过期了（包括执行中的请求租约到期）：删掉重新抢
+            records.filter(pk=record.pk, expires_at=record.expires_at).delete()
+        try:
+            with transaction.atomic(using=sharding.HOME_ALIAS):
+                record = records.create(
+                    user_id=user_id, key=key, fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=get_lock_timeout()),
+                )
+            return record, True
+        except IntegrityError:
+            # 别的进程刚插入了同一个 key，重新读取
+            continue
+
+
+def begin_shared(user_id, key, fingerprint):
+    """
+    :return: (record, 是否由当前请求执行)；不是执行者且 record.status_code 为空表示等待超时
+    """
+    deadline = time.monotonic() + get_wait_timeout()
+    while True:
+        record, is_leader = claim_shared(user_id, key, fingerprint)
+        if is_leader or record.fingerprint != fingerprint or record.status_code is not None:
+            return record, is_leader
+        # 别的进程正在执行：等它执行完（放弃的话记录会被删除，下一轮由当前请求执行）
+        if time.monotonic() >= deadline:
+            return record, False
+        time.sleep(SHARED_POLL_INTERVAL)
+
+
+def finish_shared(record, result):
+    status_code, data, headers = result
+    IdempotencyRecord.objects.using(sharding.HOME_ALIAS).filter(pk=record.pk).update(
+        status_code=status_code, data=data, headers=headers,
+        expires_at=timezone.now() + timedelta(seconds=get_ttl()),
+    )
+
+
+def abandon_shared(record):
+    IdempotencyRecord.objects.using(sharding.HOME_ALIAS).filter(pk=record.pk, status_code__isnull=True).delete()
+
+
+def get_result(record):
+    return record.status_code, record.data, record.headers
+
+
+def prune_shared():
+    """
+    :return: 删除的过期记录数
+    """
+    deleted, _ = IdempotencyRecord.objects.using(sharding.HOME_ALIAS).filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def describe_value(value):
+    # 上传的文件用“文件名:大小”表示
+    if hasattr(value, 'size'):
+        return f'{value.name}:{value.size}'
+    return value
+
+
+def get_fingerprint(request):
+    """
+    请求内容的摘要（方法 + 路径 + 请求体），用来发现“同一个 key 但请求内容不同”
+    """
+    digest = hashlib.sha256(f'{request.method} {request.get_full_path()}\n'.encode('utf-8'))
+    try:
+        digest.update(request._request.body)
+    except RawPostDataException:
+        # multipart 上传（带封面图片）时请求体已经被解析过、不能再读了，改用解析后的数据
+        data = {key: [describe_value(value) for value in values] for key, values in request.data.lists()}
+        digest.update(json.dumps(data, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def snapshot(response):
+    # 保存成纯 JSON 数据：不引用序列化器和模型对象，重放时也不需要再查数据库
+    data = json.loads(JSONRenderer().render(response.data)) if response.data is not None else None
+    headers = {name: response[name] for name in ('Location',) if response.has_header(name)}
+    return response.status_code, data, headers
+
+
+def replay(result):
+    status_code, data, headers = result
+    response = Response(data, status=status_code, headers=headers)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def get_wait_timeout():
+    return getattr(settings, 'BOOKS_IDEMPOTENCY_WAIT_TIMEOUT', 10)
+
+
+def idempotent(handler):
+    """
+    视图方法装饰器：支持 `Idempotency-Key` 请求头（放在 @action 等装饰器的下面，紧贴方法）
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return error_response(
+                error_code=VALIDATION_ERROR,
+                message=f"{IDEMPOTENCY_HEADER} 不能超过 {MAX_KEY_LENGTH} 个字符",
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        store_key = (request.user.pk, key)
+        fingerprint = get_fingerprint(request)
+        while True:
+            entry, is_leader = idempotency_store.begin(store_key, fingerprint)
+            if entry.fingerprint != fingerprint:
+                return error_response(
+                    error_code=IDEMPOTENCY_KEY_REUSED,
+                    message=f"{IDEMPOTENCY_HEADER} 已经用于另一个不同的请求",
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if is_leader:
+                break
+            # 重复请求：等第一个请求执行完
+            if not entry.event.wait(get_wait_timeout()):
+                return error_response(
+                    error_code=IDEMPOTENCY_REQUEST_IN_PROGRESS,
+                    message="相同的请求正在处理中，请稍后重试",
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if entry.result is not None:
+                return replay(entry.result)
+            # 第一个请求放弃了（出错），重新抢执行权
+
+        # 本进程里没有记录：再看共享表（重试可能落在别的进程上，或者别的进程正在执行）
+        try:
+            record, is_leader = begin_shared(request.user.pk, key, fingerprint)
+        except BaseException:
+            idempotency_store.abandon(store_key, entry)
+            raise
+        if not is_leader:
+            if record.status_code is not None and record.fingerprint == fingerprint:
+                result = get_result(record)
+                idempotency_store.finish(store_key, entry, result)
+                return replay(result)
+            idempotency_store.abandon(store_key, entry)
+            if record.fingerprint != fingerprint:
+                return error_response(
+                    error_code=IDEMPOTENCY_KEY_REUSED,
+                    message=f"{IDEMPOTENCY_HEADER} 已经用于另一个不同的请求",
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            return error_response(
+                error_code=IDEMPOTENCY_REQUEST_IN_PROGRESS,
+                message="相同的请求正在处理中，请稍后重试",
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            try:
+                response = handler(self, request, *args, **kwargs)
+            except Exception as exc:
+                # 404、校验失败等 DRF 能处理的异常也转成响应保存下来；其它异常会继续抛出
+                response = self.handle_exception(exc)
+        except BaseException:
+            abandon_shared(record)
+            idempotency_store.abandon(store_key, entry)
+            raise
+        if response.status_code >= 500:
+            abandon_shared(record)
+            idempotency_store.abandon(store_key, entry)
+        else:
+            result = snapshot(response)
+            finish_shared(record, result)
+            idempotency_store.finish(store_key, entry, result)
+        return response
+
+    return wrapper
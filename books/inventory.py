@@ -0,0 +1,95 @@
+from collections import Counter
+from functools import partial
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changes
+from .exceptions import BookOutOfStockError, BookAlreadyBorrowedError, BookNotBorrowedError
+from .hotset import hot_books
+from .models import Book, Borrowing, ChangeLogEntry
+
+# 库存和借阅：高并发下不能超借
+# | 写法                                          | 并发时会怎样                                         |
+# | --------------------------------------------- | ---------------------------------------------------- |
+# | 读出 stock → 判断 > 0 → `book.save()`         | 两个请求同时读到 1，都借出成功，库存变成 0（实际借出 2 本） |
+# | `UPDATE ... SET stock = stock - 1 WHERE id = ? AND stock > 0` | 判断和修改在数据库里一步完成，影响行数为 0 就是没有库存 |
+# 借出：先插入借阅记录（部分唯一约束挡住重复借阅），再带条件地减库存；任何一步失败整个事务回滚
+# 归还：带条件地把未归还的记录标记为已归还（重复归还只会成功一次），再加库存
+# 💡 `QuerySet.update()` 不发送信号，这里手动记录变更日志、刷新热点图书（库存显示在图书数据里）
+# 💡 基准测试：`python -m benchmarks.bench_borrowing`
+
+
+def get_book_db(book):
+    return book._state.db or router.db_for_write(Book, instance=book)
+
+
+def book_stock_changed(book, using):
+    changes.record(ChangeLogEntry.KIND_BOOK, book.pk, ChangeLogEntry.ACTION_UPDATED, book.owner_id, using)
+    transaction.on_commit(partial(hot_books.book_changed, book.pk, using), using=using)
+
+
+def borrowings_deleting(borrowings, using):
+    """
+    删除借阅记录之前调用（同一个事务里）：还没归还的记录删掉后就没法归还了，对应图书的库存先加回来
+    :param borrowings: 要删除的借阅记录（查询集）
+    """
+    counts = Counter(borrowings.filter(returned_at__isnull=True).values_list('book_id', flat=True))
+    # 按“加回的数量”分组，一组一条 UPDATE
+    groups = {}
+    for book_id, count in counts.items():
+        groups.setdefault(count, []).append(book_id)
+    for count, book_ids in groups.items():
+        Book.objects.using(using).filter(pk__in=book_ids).update(stock=F('stock') + count)
+    for book in Book.objects.using(using).filter(pk__in=counts).only('id', 'owner_id'):
+        book_stock_changed(book, using)
+
+
+def get_stock(book, using):
+    return Book.objects.using(using).values_list('stock', flat=True).get(pk=book.pk)
+
+
+def borrow(book, user):
+    """
+    借出一本
+    :return: 借阅记录（borrowing.book.stock 是借出后的库存）
+    :raise BookAlreadyBorrowedError: 这个用户已经借了这本书还没有归还
+    :raise BookOutOfStockError: 没有库存
+    """
+    using = get_book_db(book)
+    with transaction.atomic(using=using):
+        try:
+            with transaction.atomic(using=using):
+                borrowing = Borrowing.objects.using(using).create(book=book, user_id=user.pk)
+        except IntegrityError:
+            raise BookAlreadyBorrowedError()
+        if not Book.objects.using(using).filter(pk=book.pk, stock__gt=0).update(stock=F('stock') - 1):
+            raise BookOutOfStockError()
+        stock = get_stock(book, using)
+        book_stock_changed(book, using)
+    book.stock = stock
+    return borrowing
+
+
+def return_book(book, user):
+    """
+    归还一本
+    :return: 借阅记录（borrowing.book.stock 是归还后的库存）
+    :raise BookNotBorrowedError: 这个用户没有借这本书（或者已经归还）
+    """
+    using = get_book_db(book)
+    with transaction.atomic(using=using):
+        active = Borrowing.objects.using(using).filter(book_id=book.pk, user_id=user.pk, returned_at__isnull=True)
+        borrowing = active.first()
+        now = timezone.now()
+        # 两个归还请求同时到达时只有一个能把 returned_at 从空改成当前时间
+        if borrowing is None or not active.filter(pk=borrowing.pk).update(returned_at=now):
+            raise BookNotBorrowedError()
+        Book.objects.using(using).filter(pk=book.pk).update(stock=F('stock') + 1)
+        stock = get_stock(book, using)
+        book_stock_changed(book, using)
+    borrowing.returned_at = now
+    book.stock = stock
+    borrowing.book = book
+    return borrowing
@@ -0,0 +1,225 @@
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# 本地后台任务队列：任务存在数据库的 Job 表里，`python manage.py run_jobs` 启动 worker 执行，不需要额外的消息服务
+# 1. 定义任务：在 books/tasks.py 里用 `@task('任务名称')` 装饰一个函数，函数接收 Job 对象，返回值（JSON）保存为执行结果
+# 2. 提交任务：`enqueue('任务名称', {参数}, owner=request.user)`，马上返回 Job 对象（状态 queued）
+# 3. 查看状态：`GET /api/jobs/<id>/`
+# | 规则       | 说明                                                                    |
+# | ---------- | ----------------------------------------------------------------------- |
+# | 优先级     | `priority` 越大越先执行，相同优先级先进先出                              |
+# | 并发       | 一个 worker 进程开 `--concurrency` 个线程；也可以启动多个 worker 进程    |
+# | 重试       | 任务抛出异常时，在 `max_attempts` 次以内重新排队，等待时间指数增长（带随机抖动，避免一起重试） |
+# | 异常退出   | worker 被强制杀掉时任务停在 running，超过 `BOOKS_JOBS_LOCK_TIMEOUT` 秒后重新排队 |
+# ⚠️ 任务可能被执行不止一次（重试、超时回收），任务函数要能安全地重复执行
+_registry = {}
+
+
+class TaskInfo:
+    def __init__(self, name, func, max_attempts, priority):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.priority = priority
+
+
+def task(name, max_attempts=3, priority=0):
+    """
+    注册任务的装饰器
+    :param max_attempts: 最多执行几次（1 表示失败不重试）
+    :param priority: 默认优先级，提交时可以覆盖
+    """
+    def decorator(func):
+        _registry[name] = TaskInfo(name, func, max_attempts, priority)
+        return func
+    return decorator
+
+
+def get_task(name):
+    """
+    :raise KeyError: 没有注册这个任务
+    """
+    return _registry[name]
+
+
+def get_task_names():
+    return sorted(_registry)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(name, payload=None, owner=None, priority=None, delay=0):
+    """
+    提交任务
+    :param delay: 延迟多少秒后才执行
+    """
+    info = get_task(name)
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        owner=owner,
+        priority=info.priority if priority is None else priority,
+        max_attempts=info.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def report_progress(job, progress):
+    """
+    任务执行过程中更新进度（0~100）
+    """
+    job.progress = max(0, min(int(progress), 100))
+    Job.objects.filter(pk=job.pk).update(progress=job.progress)
+
+
+def get_backoff(attempts):
+    """
+    第 attempts 次失败后等待多少秒再重试：基础时间 × 2^(attempts-1)，不超过上限，再乘一个 0.5~1 的随机数
+    """
+    base = get_setting('BOOKS_JOBS_RETRY_BACKOFF', 10)
+    delay = min(base * 2 ** (attempts - 1), get_setting('BOOKS_JOBS_RETRY_BACKOFF_MAX', 3600))
+    return delay * random.uniform(0.5, 1)
+
+
+def recover_stale_jobs():
+    """
+    回收执行超时的任务（worker 异常退出后留下的 running 状态）
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        locked_at__lt=now - timedelta(seconds=get_setting('BOOKS_JOBS_LOCK_TIMEOUT', 3600)),
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED, error='执行超时', locked_by='', finished_at=now
+    )
+    stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.STATUS_QUEUED, error='执行超时', locked_by='', run_after=now
+    )
+
+
+def claim_next(worker_id):
+    """
+    领取一个可以执行的任务：先找候选，再用带条件的 UPDATE 抢占（别的 worker 抢先了就换下一个）
+    :return: Job，没有可执行的任务时返回 None
+    """
+    queued = Job.objects.filter(status=Job.STATUS_QUEUED)
+    for _ in range(5):
+        now = timezone.now()
+        job_id = (
+            queued.filter(run_after__lte=now).order_by('-priority', 'id').values_list('id', flat=True).first()
+        )
+        if job_id is None:
+            return None
+        claimed = queued.filter(pk=job_id).update(
+            status=Job.STATUS_RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    """
+    执行一个已领取的任务，并记录结果
+    :return: 是否执行成功
+    """
+    try:
+        result = get_task(job.name).func(job)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('任务 %s 执行失败（第 %s 次）', job, job.attempts)
+        # 未注册的任务重试也没用，直接失败
+        retry = job.name in _registry and job.attempts < job.max_attempts
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.STATUS_QUEUED if retry else Job.STATUS_FAILED,
+            run_after=timezone.now() + timedelta(seconds=get_backoff(job.attempts)),
+            error=error,
+            locked_by='',
+            finished_at=None if retry else timezone.now(),
+        )
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.STATUS_SUCCEEDED, result=result, progress=100, error='', locked_by='', finished_at=timezone.now()
+    )
+    return True
+
+
+class Worker:
+    """
+    `python manage.py run_jobs` 使用的 worker：concurrency 个线程各自循环“领取 → 执行”
+    """
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = max(1, concurrency or get_setting('BOOKS_JOBS_CONCURRENCY', 2))
+        self.poll_interval = poll_interval or get_setting('BOOKS_JOBS_POLL_INTERVAL', 1.0)
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        不再领取新任务，正在执行的任务执行完后退出
+        """
+        self._stop.set()
+
+    def run_once(self, worker_id):
+        """
+        :return: 是否执行了任务
+        """
+        job = claim_next(worker_id)
+        if job is None:
+            return False
+        run_job(job)
+        return True
+
+    def loop(self, index, burst):
+        worker_id = f'{self.name}:{index}'
+        while not self._stop.is_set():
+            close_old_connections()
+            if self.run_once(worker_id):
+                continue
+            if burst:
+                break
+            recover_stale_jobs()
+            self._stop.wait(self.poll_interval)
+
+    def run(self, burst=False):
+        """
+        :param burst: 队列里没有可执行的任务时就退出（测试、定时脚本里使用）
+        """
+        recover_stale_jobs()
+        if self.concurrency == 1:
+            # 只有一个线程时在当前线程执行（测试时能看到测试事务里的数据）
+            self.loop(0, burst)
+            return
+        threads = [
+            threading.Thread(target=self.run_thread, args=(index, burst), name=f'job-worker-{index}', daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # 带超时的 join：主线程还能及时处理 Ctrl+C 信号
+            while thread.is_alive():
+                thread.join(0.5)
+
+    def run_thread(self, index, burst):
+        try:
+            self.loop(index, burst)
+        finally:
+            connections.close_all()
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import archive
+
+
+# 用法：
+#   python manage.py archive_books --days 365                      超过一年没有修改的图书移到归档表
+#   python manage.py archive_books --published-before 2000-01-01   只归档 2000 年以前出版的（同时满足 --days）
+#   python manage.py archive_books --restore 12 15                 把归档的图书恢复到图书表
+# 每批（`--batch-size`，默认 BOOKS_ARCHIVE_BATCH_SIZE）一个事务，可以在业务运行时执行，也可以中途停止
+class Command(BaseCommand):
+    help = '把长时间没有修改的图书移到归档表（或者从归档表恢复）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='超过多少天没有修改的图书（默认 BOOKS_ARCHIVE_AFTER_DAYS）')
+        parser.add_argument('--published-before', type=date.fromisoformat, help='只归档这个日期以前出版的图书')
+        parser.add_argument('--batch-size', type=int, help='每批移动多少本（默认 BOOKS_ARCHIVE_BATCH_SIZE）')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='ID', help='恢复这些 id 的归档图书')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            count = archive.restore_books(options['restore'])
+            self.stdout.write(self.style.SUCCESS(f'已恢复 {count} 本图书'))
+            return
+        if options['batch_size'] is not None and options['batch_size'] <= 0:
+            raise CommandError('--batch-size 必须大于 0')
+        queryset = archive.get_archive_candidates(options['days'], options['published_before'])
+        count = archive.archive_books(
+            queryset,
+            options['batch_size'],
+            progress=lambda total: self.stdout.write(f'已归档 {total} 本……'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'归档完成，共 {count} 本图书'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bookapi.schema import build_schema, get_schema_dir
+
+
+# 用法：python manage.py build_openapi_schema
+# 部署（或修改接口）后执行一次，生成 /api/schema/ 返回的静态文档
+class Command(BaseCommand):
+    help = '生成 OpenAPI 文档静态文件（YAML / JSON 以及 gzip 预压缩版本）'
+
+    def handle(self, *args, **options):
+        contents = build_schema()
+        for fmt, content in contents.items():
+            self.stdout.write(f'schema.{fmt}: {len(content)} 字节')
+        self.stdout.write(self.style.SUCCESS(f'OpenAPI 文档已生成到 {get_schema_dir()}'))
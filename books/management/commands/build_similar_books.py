@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from books import similarity
+
+
+# 用法：python manage.py build_similar_books [--refresh]
+# 全量重算每本书的相似图书（见 books/similarity.py），建议每天定时执行一次
+# `--refresh` 只刷新标记为过期的图书（平时由后台任务 refresh_similar_books 自动执行）
+class Command(BaseCommand):
+    help = '重新计算相似图书（按共同的标签和作者）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', action='store_true', help='只增量刷新标记为过期的图书')
+
+    def handle(self, *args, **options):
+        if options['refresh']:
+            count = similarity.refresh()
+            self.stdout.write(self.style.SUCCESS(f'相似图书增量刷新完成，更新了 {count} 本'))
+            return
+        count = similarity.rebuild(progress=lambda done, total: self.stdout.write(f'已计算 {done}/{total} 本……'))
+        self.stdout.write(self.style.SUCCESS(f'相似图书重算完成，共 {count} 本'))
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from books import cascade
+
+
+# 用法：python manage.py delete_user <用户名> [--now] [--batch-size 500]
+# 用户的图书、归档图书、借阅记录分批删除，最后删除用户（见 books/cascade.py）
+# 默认提交后台任务（由 run_jobs 执行）；`--now` 在当前进程里直接执行并显示进度
+class Command(BaseCommand):
+    help = '分批删除用户及其图书'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--now', action='store_true', help='不提交后台任务，直接执行')
+        parser.add_argument('--batch-size', type=int, default=None, help='每批删除多少条（默认 BOOKS_DELETE_BATCH_SIZE）')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"用户不存在：{options['username']}")
+        if not options['now']:
+            job = cascade.request_delete(user)
+            self.stdout.write(self.style.SUCCESS(f'删除任务已提交：#{job.pk}（查看进度：GET /api/jobs/{job.pk}/）'))
+            return
+        progress = lambda done, total: self.stdout.write(f'已删除 {done}/{total}')
+        result = cascade.run_delete('user', user.pk, batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"用户 {user.username} 已删除，关联数据 {result['deleted']} 条"))
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.models import ChangeLogEntry
+
+
+# 用法：python manage.py prune_changelog --days 30
+# 删除 N 天以前的变更日志；游标比保留的记录还旧的客户端会收到 410，需要重新全量同步
+class Command(BaseCommand):
+    help = '清理旧的变更日志（增量同步用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='保留最近多少天的记录（默认30天）')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        latest = ChangeLogEntry.objects.order_by('-seq').values_list('seq', flat=True).first()
+        # 总是保留最新的一条：判断游标是否过期要用到“最旧的保留记录”
+        deleted, _ = ChangeLogEntry.objects.filter(created_at__lt=cutoff).exclude(seq=latest).delete()
+        self.stdout.write(self.style.SUCCESS(f'已清理 {deleted} 条变更日志'))
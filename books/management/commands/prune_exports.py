@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from books.exports import get_retention, prune_exports
+
+
+# 用法：python manage.py prune_exports --hours 12
+# 删除导出目录里生成超过保留时间（默认 BOOKS_EXPORT_RETENTION）的导出文件；下载已清理的导出会收到 410，需要重新导出
+class Command(BaseCommand):
+    help = '清理过期的图书导出文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, help='保留最近多少小时生成的文件（默认 BOOKS_EXPORT_RETENTION）')
+
+    def handle(self, *args, **options):
+        retention = options['hours'] * 3600 if options['hours'] is not None else get_retention()
+        deleted = prune_exports(retention)
+        self.stdout.write(self.style.SUCCESS(f'已清理 {deleted} 个导出文件'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from books.idempotency import prune_shared
+
+
+# 用法：python manage.py prune_idempotency_keys
+# 删除共享表里已经过期的幂等键记录（过了 BOOKS_IDEMPOTENCY_TTL 的响应、租约到期的执行中记录），可以放在定时任务里
+class Command(BaseCommand):
+    help = '清理过期的幂等键记录'
+
+    def handle(self, *args, **options):
+        deleted = prune_shared()
+        self.stdout.write(self.style.SUCCESS(f'已清理 {deleted} 条幂等键记录'))
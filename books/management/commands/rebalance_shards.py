@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from books import sharding
+from books.models import Author, Tag
+
+
+# 用法：python manage.py rebalance_shards [--batch-size 500]
+# 开启分片、或者修改 BOOKS_SHARDS（增减分片）之后执行（先对新的分片执行 `migrate --database <别名>`）：
+# 1. 把默认数据库里的作者、标签、用户同步到每个分片
+# 2. 把每本图书（以及归档的图书）搬到拥有者现在对应的分片，每批一个事务
+# ⚠️ 按取余分片，分片数量变化时大部分用户的图书都要搬家，尽量在业务低峰期执行
+class Command(BaseCommand):
+    help = '同步作者/标签/用户到各个分片，并把图书搬到拥有者对应的分片'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批移动多少本（默认 500）')
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError('没有开启分片（settings.BOOKS_SHARDS 为空）')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size 必须大于 0')
+        synced = sharding.sync_references([Author, Tag, User])
+        self.stdout.write(f'已同步 {synced} 条作者/标签/用户')
+        count = sharding.rebalance(
+            options['batch_size'],
+            progress=lambda total: self.stdout.write(f'已移动 {total} 本……'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'分片调整完成，共移动 {count} 本图书'))
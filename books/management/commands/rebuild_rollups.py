@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from books import rollups
+
+
+# 用法：python manage.py rebuild_rollups
+# 统计汇总表平时由信号增量维护；批量导入数据、修改价格区间宽度、或者怀疑数据有偏差时，执行这个命令从头重建
+class Command(BaseCommand):
+    help = '从图书表重新生成统计汇总表（作者/标签/年份/价格区间）'
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'统计汇总表重建完成，共 {count} 行'))
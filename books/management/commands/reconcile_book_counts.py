@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books import bookcounts
+
+
+# 用法：python manage.py reconcile_book_counts
+# 作者、标签的图书数量平时由信号增量维护（见 books/bookcounts.py）；批量导入数据后、或者怀疑有偏差时执行这个命令修正
+class Command(BaseCommand):
+    help = '按图书表的实际数据修正作者、标签的图书数量'
+
+    def handle(self, *args, **options):
+        fixed = bookcounts.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f"图书数量修正完成：作者 {fixed['authors']} 个，标签 {fixed['tags']} 个"
+        ))
@@ -0,0 +1,34 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from books.jobs import Worker
+
+
+# 用法：python manage.py run_jobs --concurrency 4
+# 启动后台任务 worker（任务队列见 books/jobs.py），可以同时启动多个进程；
+# 收到 Ctrl+C / SIGTERM 后不再领取新任务，等正在执行的任务完成再退出
+# `--burst`：执行完当前所有可执行的任务就退出（适合放在定时脚本里）
+class Command(BaseCommand):
+    help = '执行后台任务队列里的任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='同时执行几个任务（默认 BOOKS_JOBS_CONCURRENCY）')
+        parser.add_argument('--poll-interval', type=float, help='队列为空时隔多少秒再查一次（默认 BOOKS_JOBS_POLL_INTERVAL）')
+        parser.add_argument('--burst', action='store_true', help='队列里没有可执行的任务时退出')
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+
+        def shutdown(signum, frame):
+            self.stdout.write('正在停止：等待执行中的任务完成……')
+            worker.stop()
+
+        previous = {signum: signal.signal(signum, shutdown) for signum in (signal.SIGINT, signal.SIGTERM)}
+        self.stdout.write(f'worker {worker.name} 已启动，并发数 {worker.concurrency}')
+        try:
+            worker.run(burst=options['burst'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS('worker 已退出'))
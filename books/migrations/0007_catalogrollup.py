@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_book_cover_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('total', '全部'), ('author', '作者'), ('tag', '标签'), ('year', '出版年份'), ('price_band', '价格区间')], max_length=20, verbose_name='维度')),
+                ('key', models.CharField(blank=True, max_length=50, verbose_name='维度取值')),
+                ('book_count', models.BigIntegerField(default=0, verbose_name='图书数量')),
+                ('price_total', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='价格合计')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='unique_rollup_dimension_key')],
+            },
+        ),
+    ]
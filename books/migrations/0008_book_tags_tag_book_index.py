@@ -0,0 +1,18 @@
+# 按标签过滤时（?tags= / ?tags_all= / 分面统计）都是从 tag_id 出发查中间表，
+# Django 自动生成的中间表只有 (book_id, tag_id) 唯一索引和单列索引，这里补一个 (tag_id, book_id) 覆盖索引
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_catalogrollup'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX books_book_tags_tag_book_idx ON books_book_tags (tag_id, book_id)',
+            reverse_sql='DROP INDEX books_book_tags_tag_book_idx',
+        ),
+    ]
@@ -0,0 +1,47 @@
+# 增量同步：图书 / 作者 / 标签增加修改时间，新增变更日志表
+# 已有数据的修改时间设置为执行迁移的时间
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_tags_tag_book_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='修改时间'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='修改时间'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='修改时间'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False, verbose_name='序号')),
+                ('kind', models.CharField(choices=[('book', '图书'), ('author', '作者'), ('tag', '标签')], max_length=10, verbose_name='对象类型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象id')),
+                ('action', models.CharField(choices=[('created', '新增'), ('updated', '修改'), ('deleted', '删除')], max_length=10, verbose_name='操作')),
+                ('owner_id', models.BigIntegerField(blank=True, null=True, verbose_name='图书拥有者id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='记录时间')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='books_changelog_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_updated_at_changelogentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changelogentry',
+            name='action',
+            field=models.CharField(choices=[('created', '新增'), ('updated', '修改'), ('deleted', '删除'), ('highlighted', '高亮')], max_length=12, verbose_name='操作'),
+        ),
+    ]
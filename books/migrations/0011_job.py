@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_changelogentry_action_highlighted'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='任务名称')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='任务参数')),
+                ('priority', models.IntegerField(default=0, verbose_name='优先级')),
+                ('status', models.CharField(choices=[('queued', '排队中'), ('running', '执行中'), ('succeeded', '成功'), ('failed', '失败')], default='queued', max_length=10, verbose_name='状态')),
+                ('run_after', models.DateTimeField(verbose_name='最早执行时间')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='已执行次数')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='最多执行次数')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='进度')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='执行结果')),
+                ('error', models.TextField(blank=True, verbose_name='最近一次错误')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='执行的worker')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='开始执行时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='提交时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to=settings.AUTH_USER_MODEL, verbose_name='提交者')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', '-priority', 'id'], name='books_job_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBook',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='图书id')),
+                ('title', models.CharField(max_length=100, verbose_name='书名')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6, verbose_name='价格')),
+                ('published_date', models.DateField(verbose_name='出版日期')),
+                ('is_highlighted', models.BooleanField(default=False, verbose_name='是否高亮')),
+                ('cover_image', models.ImageField(blank=True, null=True, upload_to='covers/', verbose_name='封面图片')),
+                ('updated_at', models.DateTimeField(verbose_name='修改时间')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='归档时间')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_books', to='books.author', verbose_name='作者')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_books', to=settings.AUTH_USER_MODEL, verbose_name='拥有者')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBookTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='books.archivedbook')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='books.tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedbook',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='archived_books', through='books.ArchivedBookTag', to='books.tag', verbose_name='标签'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbooktag',
+            index=models.Index(fields=['tag', 'book'], name='books_archivedtag_tag_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedbooktag',
+            constraint=models.UniqueConstraint(fields=('book', 'tag'), name='unique_archived_book_tag'),
+        ),
+    ]
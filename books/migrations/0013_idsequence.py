@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_archivedbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='序列名称')),
+                ('next_id', models.BigIntegerField(verbose_name='下一个id')),
+            ],
+        ),
+    ]
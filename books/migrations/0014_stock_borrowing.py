@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_idsequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedbook',
+            name='stock',
+            field=models.PositiveIntegerField(default=1, verbose_name='库存'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='stock',
+            field=models.PositiveIntegerField(default=1, verbose_name='库存'),
+        ),
+        migrations.CreateModel(
+            name='Borrowing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('borrowed_at', models.DateTimeField(auto_now_add=True, verbose_name='借出时间')),
+                ('returned_at', models.DateTimeField(blank=True, null=True, verbose_name='归还时间')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='borrowings', to='books.book', verbose_name='图书')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='borrowings', to=settings.AUTH_USER_MODEL, verbose_name='借阅人')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'returned_at'], name='books_borrowing_user_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('returned_at__isnull', True)), fields=('book', 'user'), name='unique_active_borrowing')],
+            },
+        ),
+    ]
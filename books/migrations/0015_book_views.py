@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_stock_borrowing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedbook',
+            name='views',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='浏览次数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='views',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='浏览次数'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-views', 'id'], name='books_book_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['owner', '-views'], name='books_book_owner_views_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_book_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarBookList',
+            fields=[
+                ('book_id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='图书id')),
+                ('similar_ids', models.JSONField(default=list, verbose_name='相似图书id')),
+                ('scores', models.JSONField(default=list, verbose_name='相似度')),
+                ('dirty_at', models.DateTimeField(blank=True, null=True, verbose_name='标记过期的时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='计算时间')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dirty_at'], name='books_similar_dirty_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_book_counts(apps, schema_editor):
+    # 按当前数据库里的图书填上初始值（开启分片时迁移完再执行 reconcile_book_counts，把各分片的图书加起来）
+    Author = apps.get_model('books', 'Author')
+    Tag = apps.get_model('books', 'Tag')
+    Book = apps.get_model('books', 'Book')
+    using = schema_editor.connection.alias
+    books = Book.objects.using(using).filter(author_id=OuterRef('pk')).order_by().values('author_id')
+    Author.objects.using(using).update(book_count=Coalesce(
+        Subquery(books.annotate(count=Count('id')).values('count')), Value(0)
+    ))
+    links = Book.tags.through.objects.using(using).filter(tag_id=OuterRef('pk')).order_by().values('tag_id')
+    Tag.objects.using(using).update(book_count=Coalesce(
+        Subquery(links.annotate(count=Count('book_id')).values('count')), Value(0)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_similarbooklist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='图书数量'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='图书数量'),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['book_count'], name='books_author_book_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['book_count'], name='books_tag_book_count_idx'),
+        ),
+        migrations.RunPython(fill_book_counts, migrations.RunPython.noop),
+    ]
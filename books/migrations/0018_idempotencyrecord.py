@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0017_author_tag_book_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, verbose_name='幂等键')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='请求摘要')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='响应状态码')),
+                ('data', models.JSONField(blank=True, null=True, verbose_name='响应数据')),
+                ('headers', models.JSONField(blank=True, default=dict, verbose_name='响应头')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='books_idempotency_expires_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'key'), name='books_idempotency_user_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0018_idempotencyrecord'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrowing',
+            name='borrowed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='借出时间'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedBorrowing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('borrowed_at', models.DateTimeField(verbose_name='借出时间')),
+                ('returned_at', models.DateTimeField(blank=True, null=True, verbose_name='归还时间')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='borrowings', to='books.archivedbook', verbose_name='图书')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowings', to=settings.AUTH_USER_MODEL, verbose_name='借阅人')),
+            ],
+        ),
+    ]
@@ -1,25 +1,69 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+class BookCountMixin(models.Model):
+    # 图书数量（冗余字段，由信号用 F() 表达式维护，见 books/bookcounts.py），列表接口可以按它排序、过滤
+    book_count = models.IntegerField(default=0, editable=False, verbose_name="图书数量")
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # 修改名字等字段时不要把读出来的旧计数写回去，否则会覆盖同时发生的 F() 更新
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'book_count'
+            ]
+        super().save(*args, **kwargs)
+
+
 # | 代码                                               | 解释                         |
 # | -------------------------------------------------- | ---------------------------- |
 # | `class Author(models.Model):`                      | 定义一个叫 `Author` 的模型   |
 # | `name = models.CharField(max_length=100)`          | 作者姓名，最多100字符        |
 # | `email = models.EmailField(blank=True, null=True)` | 邮箱字段，可为空             |
 # | `def __str__(self): return self.name`              | 打印对象时显示名字，方便调试 |
-class Author(models.Model):
+class Author(BookCountMixin):
     name = models.CharField(max_length=100, verbose_name="姓名")
     email = models.EmailField(blank=True, null=True, verbose_name="邮箱")
+    # 最后修改时间（增量同步用，见 books/changes.py）
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="修改时间")
+
+    class Meta:
+        indexes = [models.Index(fields=['book_count'], name='books_author_book_count_idx')]
+
     def __str__(self):
         return self.name
 # 新增标签模型，一本书可以有多个标签，一个标签可以属于多本书，这就是典型的多对多关系
 # | 标签模型，比如 “小说”、“科幻”、“经典” |
-class Tag(models.Model):
+class Tag(BookCountMixin):
     # unique=True：确保标签名字唯一，不能重复
     name = models.CharField(max_length=50, unique=True, verbose_name="标签名字")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="修改时间")
+
+    class Meta:
+        indexes = [models.Index(fields=['book_count'], name='books_tag_book_count_idx')]
+
     def __str__(self):
         return self.name
 
 
+class BookQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # 没有用 `.using()` 指定数据库时，交给 `save()` 按图书的拥有者选择分片（见 books/sharding.py）
+        # 💡 Django 默认的 `create()` 在保存前就确定了数据库，路由拿不到图书对象
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
 # Create your models here.
 # 定义一个叫 `Book` 的类，它继承自 `models.Model` → 表示这是一个数据库表。
 class Book(models.Model):
@@ -64,10 +108,338 @@ class Book(models.Model):
         null=True,          # 数据库允许为空
         verbose_name='封面图片'
     )
+    # `auto_now=True`：每次 save() 自动更新为当前时间（`QuerySet.update()` 不会触发）
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="修改时间")
+    # 可借阅的库存（见 books/inventory.py）：借出 / 归还用带条件的 UPDATE 增减，不要先读出来再 save()
+    stock = models.PositiveIntegerField(default=1, verbose_name="库存")
+    # 浏览次数（见 books/viewcounts.py）：先在进程内存里累加，定期批量 `views = views + n` 写回，不是实时的
+    views = models.PositiveBigIntegerField(default=0, verbose_name="浏览次数")
+
+    objects = BookQuerySet.as_manager()
+
+    # 这两列由带条件的 / 累加的 UPDATE 修改，save() 时没有改过就不写回（见 save()）
+    COUNTER_FIELDS = ('stock', 'views')
+
+    class Meta:
+        indexes = [
+            # “热门图书”（popular 接口）按浏览次数倒序取前 N 本：管理员看全部，普通用户只看自己的
+            models.Index(fields=['-views', 'id'], name='books_book_views_idx'),
+            models.Index(fields=['owner', '-views'], name='books_book_owner_views_idx'),
+        ]
+
     # 这是一个“魔法方法”，当你在 Django 后台或打印对象时，会显示书名而不是 `<Book object>`。
     def __str__(self):
         return self.title # 在后台显示书名，而不是“Book object”
 
+    # 从数据库加载对象时记下原始字段值，信号里可以据此判断“改了什么”（比如 owner 变了）
+    # 💡 这是 Django 官方文档推荐的写法，不会多查一次数据库
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # 修改书名等字段时不要把读出来的旧库存 / 浏览次数写回去，否则会覆盖同时发生的借出、归还、浏览计数
+        # 只有确实被改过（比如拥有者补货）才写这一列
+        loaded = getattr(self, '_loaded_values', None)
+        if (
+            loaded is not None and not self._state.adding
+            and kwargs.get('update_fields') is None and not kwargs.get('force_insert')
+        ):
+            unchanged = {name for name in self.COUNTER_FIELDS if name in loaded and getattr(self, name) == loaded[name]}
+            if unchanged:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in unchanged and field.attname in loaded
+                ]
+        super().save(*args, **kwargs)
+        # 保存成功后（post_save 信号已经处理完），把“原始值”更新成当前值
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+        }
+
+
+
+# 归档图书：长时间没有修改的图书从 `books_book` 移到这张表（`python manage.py archive_books`，见 books/archive.py）
+# 字段和 Book 相同，id 沿用原来的图书 id（接口里的 id 不变）；默认查询只查 Book 表，带 `?include_archived=1` 时两张表一起查
+# 💡 归档的图书只读：修改、删除接口都找不到它，需要修改时先用 `archive_books --restore <id>` 恢复
+class ArchivedBook(models.Model):
+    id = models.BigIntegerField(primary_key=True, verbose_name="图书id")
+    title = models.CharField(max_length=100, verbose_name="书名")
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='archived_books', verbose_name="作者")
+    tags = models.ManyToManyField(
+        Tag, through='ArchivedBookTag', blank=True, related_name='archived_books', verbose_name="标签"
+    )
+    price = models.DecimalField(max_digits=6, decimal_places=2, verbose_name="价格")
+    published_date = models.DateField(verbose_name="出版日期")
+    is_highlighted = models.BooleanField(default=False, verbose_name="是否高亮")
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, related_name='archived_books', verbose_name="拥有者"
+    )
+    cover_image = models.ImageField(upload_to='covers/', blank=True, null=True, verbose_name='封面图片')
+    # 归档前最后一次修改的时间（原样保留，不会自动更新）
+    updated_at = models.DateTimeField(verbose_name="修改时间")
+    stock = models.PositiveIntegerField(default=1, verbose_name="库存")
+    views = models.PositiveBigIntegerField(default=0, verbose_name="浏览次数")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="归档时间")
+
+    def __str__(self):
+        return self.title
+
+
+# 归档图书的标签关系；字段名和 Book 的中间表一样是 book_id / tag_id，按标签过滤、分面统计的代码可以直接复用
+class ArchivedBookTag(models.Model):
+    book = models.ForeignKey(ArchivedBook, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'tag'], name='unique_archived_book_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'book'], name='books_archivedtag_tag_idx'),
+        ]
+
+
+
+
+
+
+# 统计汇总表（rollup）：按维度预先累计图书数量和价格合计，统计接口直接读这张小表，不再扫描整个图书表
+# | 维度 `dimension` | `key` 的含义        | 示例          |
+# | ---------------- | ------------------- | ------------- |
+# | `total`          | 固定为空字符串      | `''`          |
+# | `author`         | 作者 id             | `'3'`         |
+# | `tag`            | 标签 id             | `'5'`         |
+# | `year`           | 出版年份            | `'2023'`      |
+# | `price_band`     | 价格区间的下限      | `'30'`（30~40）|
+# 💡 由信号增量维护（见 `books/rollups.py`），`python manage.py rebuild_rollups` 可以从头重建
+class CatalogRollup(models.Model):
+    DIMENSION_TOTAL = 'total'
+    DIMENSION_AUTHOR = 'author'
+    DIMENSION_TAG = 'tag'
+    DIMENSION_YEAR = 'year'
+    DIMENSION_PRICE_BAND = 'price_band'
+    DIMENSION_CHOICES = [
+        (DIMENSION_TOTAL, '全部'),
+        (DIMENSION_AUTHOR, '作者'),
+        (DIMENSION_TAG, '标签'),
+        (DIMENSION_YEAR, '出版年份'),
+        (DIMENSION_PRICE_BAND, '价格区间'),
+    ]
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES, verbose_name="维度")
+    key = models.CharField(max_length=50, blank=True, verbose_name="维度取值")
+    book_count = models.BigIntegerField(default=0, verbose_name="图书数量")
+    price_total = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="价格合计")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='unique_rollup_dimension_key'),
+        ]
 
+    def __str__(self):
+        return f'{self.dimension}:{self.key}'
+
+    @property
+    def average_price(self):
+        if not self.book_count:
+            return None
+        return (self.price_total / self.book_count).quantize(Decimal('0.01'))
+
+
+# 变更日志：图书 / 作者 / 标签每次新增、修改、删除都追加一行，客户端按序号增量同步（见 books/changes.py）
+# | 字段        | 说明                                                          |
+# | ----------- | ------------------------------------------------------------- |
+# | `seq`       | 自增主键，单调递增，增量同步的游标就是它                      |
+# | `kind`      | 对象类型：book / author / tag                                 |
+# | `object_id` | 对象 id（删除后对象已经不存在，这里仍然保留 → 墓碑记录）      |
+# | `action`    | created / updated / deleted                                   |
+# | `owner_id`  | 图书的拥有者（普通用户只同步自己的图书）；作者、标签为空      |
+# 💡 `python manage.py prune_changelog --days 30` 清理旧记录，游标比保留的记录还旧时客户端需要全量同步
+class ChangeLogEntry(models.Model):
+    KIND_BOOK = 'book'
+    KIND_AUTHOR = 'author'
+    KIND_TAG = 'tag'
+    KIND_CHOICES = [
+        (KIND_BOOK, '图书'),
+        (KIND_AUTHOR, '作者'),
+        (KIND_TAG, '标签'),
+    ]
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_DELETED = 'deleted'
+    ACTION_HIGHLIGHTED = 'highlighted'  # 图书被设为高亮（也是一种修改，增量同步接口里按 updated 返回）
+    ACTION_CHOICES = [
+        (ACTION_CREATED, '新增'),
+        (ACTION_UPDATED, '修改'),
+        (ACTION_DELETED, '删除'),
+        (ACTION_HIGHLIGHTED, '高亮'),
+    ]
+    seq = models.BigAutoField(primary_key=True, verbose_name="序号")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name="对象类型")
+    object_id = models.BigIntegerField(verbose_name="对象id")
+    action = models.CharField(max_length=12, choices=ACTION_CHOICES, verbose_name="操作")
+    owner_id = models.BigIntegerField(null=True, blank=True, verbose_name="图书拥有者id")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="记录时间")
+
+    class Meta:
+        indexes = [
+            # 清理旧记录（prune_changelog）按时间删除
+            models.Index(fields=['created_at'], name='books_changelog_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.seq}:{self.kind}:{self.object_id}:{self.action}'
+
+
+# 后台任务队列：耗时的操作（重建统计、导出等）写进这张表，由 `python manage.py run_jobs` 进程执行（见 books/jobs.py）
+# | 字段          | 说明                                                            |
+# | ------------- | --------------------------------------------------------------- |
+# | `name`        | 任务名称，对应 books/tasks.py 里用 `@task` 注册的函数          |
+# | `payload`     | 任务参数（JSON）                                               |
+# | `priority`    | 优先级，数字越大越先执行；相同优先级先进先出                    |
+# | `status`      | queued → running → succeeded / failed（失败可重试时回到 queued）|
+# | `run_after`   | 不早于这个时间执行（重试的退避时间）                            |
+# | `attempts`    | 已经执行的次数；达到 `max_attempts` 后不再重试                  |
+# | `progress`    | 进度（0~100），任务执行过程中更新                               |
+# | `locked_by`   | 正在执行的 worker，worker 异常退出时靠 `locked_at` 超时回收      |
+# 💡 不需要 Redis / RabbitMQ：任务的领取用一条带条件的 UPDATE 完成，多个 worker 进程不会重复领取
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, '排队中'),
+        (STATUS_RUNNING, '执行中'),
+        (STATUS_SUCCEEDED, '成功'),
+        (STATUS_FAILED, '失败'),
+    ]
+    name = models.CharField(max_length=100, verbose_name="任务名称")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="任务参数")
+    priority = models.IntegerField(default=0, verbose_name="优先级")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, verbose_name="状态")
+    run_after = models.DateTimeField(verbose_name="最早执行时间")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="已执行次数")
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name="最多执行次数")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="进度")
+    result = models.JSONField(null=True, blank=True, verbose_name="执行结果")
+    error = models.TextField(blank=True, verbose_name="最近一次错误")
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs', verbose_name="提交者"
+    )
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="执行的worker")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="开始执行时间")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="提交时间")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完成时间")
+
+    class Meta:
+        indexes = [
+            # worker 领取任务：WHERE status='queued' AND run_after <= now ORDER BY priority DESC, id
+            models.Index(fields=['status', '-priority', 'id'], name='books_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.pk}:{self.name}:{self.status}'
+
+
+# 幂等键的共享记录（见 books/idempotency.py）：所有进程都能看到，重试落到另一个 worker 上也不会重复执行
+# | 字段               | 说明                                                                       |
+# | ------------------ | -------------------------------------------------------------------------- |
+# | `user` + `key`     | 唯一约束：同一个用户的同一个 key 只有一条，插入成功的请求负责执行           |
+# | `fingerprint`      | 请求内容的摘要，发现“同一个 key 但请求内容不同”                            |
+# | `status_code`      | 保存的响应状态码；为空表示第一个请求还在执行                               |
+# | `data` / `headers` | 保存的响应（纯 JSON）                                                      |
+# | `expires_at`       | 执行中：租约到期时间（进程异常退出后别的请求可以接手）；执行完：保存到什么时候 |
+class IdempotencyRecord(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name="用户")
+    key = models.CharField(max_length=255, verbose_name="幂等键")
+    fingerprint = models.CharField(max_length=64, verbose_name="请求摘要")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="响应状态码")
+    data = models.JSONField(null=True, blank=True, verbose_name="响应数据")
+    headers = models.JSONField(default=dict, blank=True, verbose_name="响应头")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    expires_at = models.DateTimeField(verbose_name="过期时间")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='books_idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            # 清理过期记录（prune_idempotency_keys）
+            models.Index(fields=['expires_at'], name='books_idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key}:{self.status_code}'
 
+
+# 全局 id 序列：分片之后每个分片的自增 id 会重复，图书的 id 改由这张表统一分配（见 books/sharding.py）
+# 只存在默认数据库里；一次分配一段（批量创建时一条 UPDATE 分配所有 id）
+class IdSequence(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="序列名称")
+    next_id = models.BigIntegerField(verbose_name="下一个id")
+
+    def __str__(self):
+        return f'{self.name}:{self.next_id}'
+
+
+# 借阅记录：一次借出一行，归还时填上 returned_at（保留历史）
+# 💡 “同一个用户同一本书只能借一本”由部分唯一约束保证（只约束未归还的记录），并发重复借阅也只会成功一次
+# 开启分片时借阅记录和图书在同一个分片（外键指向图书）
+class Borrowing(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='borrowings', verbose_name="图书")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='borrowings', verbose_name="借阅人")
+    # 💡 不用 auto_now_add：归档 / 恢复、搬到其它分片时复制记录要保留原来的借出时间（auto_now_add 保存时总是覆盖）
+    borrowed_at = models.DateTimeField(default=timezone.now, verbose_name="借出时间")
+    returned_at = models.DateTimeField(null=True, blank=True, verbose_name="归还时间")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'user'], condition=models.Q(returned_at__isnull=True), name='unique_active_borrowing'
+            ),
+        ]
+        indexes = [
+            # 查询“我借了哪些书”
+            models.Index(fields=['user', 'returned_at'], name='books_borrowing_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.book_id}'
+
+
+# 归档图书的借阅记录（见 books/archive.py）：图书归档时从借阅记录表复制过来，恢复时再复制回去
+# 💡 还有人借着没还的图书不归档，所以这里都是已经归还的记录
+class ArchivedBorrowing(models.Model):
+    book = models.ForeignKey(ArchivedBook, on_delete=models.CASCADE, related_name='borrowings', verbose_name="图书")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrowings', verbose_name="借阅人")
+    borrowed_at = models.DateTimeField(verbose_name="借出时间")
+    returned_at = models.DateTimeField(null=True, blank=True, verbose_name="归还时间")
+
+    def __str__(self):
+        return f'{self.user_id}:{self.book_id}'
+
+
+# 相似图书：每本书一行，保存预先算好的前 K 本相似图书（见 books/similarity.py）
+# | 字段          | 说明                                                               |
+# | ------------- | ------------------------------------------------------------------ |
+# | `book_id`     | 图书 id（不用外键：开启分片时图书在各个分片上，这张表只在默认数据库） |
+# | `similar_ids` | 相似图书的 id，按相似度从高到低                                    |
+# | `scores`      | 对应的相似度（0~1）                                                |
+# | `dirty_at`    | 图书的标签 / 作者变了，等待后台任务增量刷新；为空表示是最新的      |
+class SimilarBookList(models.Model):
+    book_id = models.BigIntegerField(primary_key=True, verbose_name="图书id")
+    similar_ids = models.JSONField(default=list, verbose_name="相似图书id")
+    scores = models.JSONField(default=list, verbose_name="相似度")
+    dirty_at = models.DateTimeField(null=True, blank=True, verbose_name="标记过期的时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="计算时间")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dirty_at'], name='books_similar_dirty_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id}:{self.similar_ids}'
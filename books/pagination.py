@@ -1,7 +1,78 @@
+from functools import partial
+
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import QuerySet
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from .counting import scope_for_user, get_cached_count, get_table_count
+
+
+# 使用预先算好的总数，避免 Django 的 Paginator 再执行一次 COUNT(*)
+class CountedPaginator(DjangoPaginator):
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        if count is not None:
+            # `Paginator.count` 是 cached_property，直接赋值就不会再去查数据库
+            self.count = count
+
+
 # 自定义分页类，继承 DRF 的分页基类
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10                       # 默认每页10条
     page_size_query_param = 'page_size'  # 允许客户端通过 ?page_size=20 控制每页数量
     max_page_size = 100                 # 每页最大100条（防止滥用），防止用户设 `page_size=999999` 拖垮服务器
-    page_query_param = 'p'              # 把 `?page=2` 改成 `?p=2`（更短，可选）
\ No newline at end of file
+    page_query_param = 'p'              # 把 `?page=2` 改成 `?p=2`（更短，可选）
+
+    # === 计数策略 ===
+    # | 取值       | 说明                                                           |
+    # | ---------- | -------------------------------------------------------------- |
+    # | `'exact'`  | 每次都执行 COUNT(*)（DRF 默认行为）                            |
+    # | `'cached'` | 按（用户范围, 过滤条件）缓存 COUNT(*)，图书写入时失效          |
+    # | `'auto'`   | 同 `'cached'`；没有任何过滤条件的整表改用维护的计数器或估算值  |
+    count_strategy = 'auto'
+    count_cache_timeout = 60            # 计数缓存最多保留60秒（多进程且没有共享缓存时，旧数据最多延迟这么久）
+    table_count_timeout = 60            # 整表计数器最多保留60秒，过期后重新统计（原因同上，另外还有不发送信号的写入）
+    estimate_threshold = 100000         # 整表超过10万行且数据库支持时，直接用估算值
+    # 这些查询参数不影响总数，不参与缓存 key
+    count_ignored_params = ('p', 'page_size', 'ordering', 'format', 'facets', 'facet_limit')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count, self.count_exact = self.get_count(queryset, request)
+        self.django_paginator_class = partial(CountedPaginator, count=self.count)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset, request):
+        """
+        按计数策略计算总数
+        :return: (count, 是否精确)
+        """
+        if self.count_strategy == 'exact' or not isinstance(queryset, QuerySet):
+            return queryset.count(), True
+        # `query.where` 为空 → 没有任何过滤条件（管理员查看全部图书）
+        if self.count_strategy == 'auto' and not queryset.query.where:
+            return get_table_count(queryset, self.estimate_threshold, self.table_count_timeout)
+        params = {
+            key: request.query_params.getlist(key)
+            for key in request.query_params
+            if key not in self.count_ignored_params
+        }
+        params['path'] = request.path
+        return get_cached_count(queryset, scope_for_user(request.user), params, self.count_cache_timeout)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_exact': self.count_exact,  # False 表示 count 是估算值，或者是（没有共享缓存时）可能过时的缓存值
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_exact'] = {
+            'type': 'boolean',
+            'example': True,
+        }
+        return response_schema
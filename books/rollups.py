@@ -0,0 +1,241 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractYear
+
+from . import sharding
+from .models import Book, CatalogRollup
+
+# 统计汇总表的增量维护
+# 每本书对下面这些“格子”各贡献（1 本, 价格）：
+# - 全部 `total`
+# - 所属作者 `author`
+# - 出版年份 `year`
+# - 价格区间 `price_band`
+# - 每个标签 `tag`（标签关系变化时由 m2m_changed 单独维护）
+
+ZERO = Decimal('0')
+_local = threading.local()  # batched() 期间攒下的变化量（每个线程各自一份）
+
+
+def get_price_band_width():
+    # 价格区间宽度（默认每10元一个区间），修改后需要执行 rebuild_rollups
+    return getattr(settings, 'BOOKS_PRICE_BAND_WIDTH', 10)
+
+
+def price_band(price):
+    width = Decimal(get_price_band_width())
+    return str(int(price // width * width))
+
+
+def normalize_book_values(author_id, price, published_date):
+    """
+    把字段值转换成标准类型（比如测试里直接传的字符串日期、float 价格）
+    """
+    price = Book._meta.get_field('price').to_python(price)
+    published_date = Book._meta.get_field('published_date').to_python(published_date)
+    return author_id, price, published_date
+
+
+def book_cells(author_id, price, published_date):
+    """
+    一本书（不含标签）所在的所有汇总格子
+    """
+    author_id, price, published_date = normalize_book_values(author_id, price, published_date)
+    return [
+        (CatalogRollup.DIMENSION_TOTAL, ''),
+        (CatalogRollup.DIMENSION_AUTHOR, str(author_id)),
+        (CatalogRollup.DIMENSION_YEAR, str(published_date.year)),
+        (CatalogRollup.DIMENSION_PRICE_BAND, price_band(price)),
+    ], price
+
+
+@contextmanager
+def batched():
+    """
+    期间的所有变化量先攒在内存里，结束时合并写入（一次删除很多本时，每个格子只更新一次，而不是每本书更新一次）
+    💡 放在事务里面使用：出错时攒下的变化量直接丢弃，和事务一起回滚
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = new_deltas()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    apply_deltas(pending)
+
+
+def apply_deltas(deltas):
+    """
+    把累计好的变化量写入汇总表（在 batched() 里时先攒起来）
+    :param deltas: {(dimension, key): [count_delta, price_delta]}
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        for cell, (count_delta, price_delta) in deltas.items():
+            pending[cell][0] += count_delta
+            pending[cell][1] += price_delta
+        return
+    for (dimension, key), (count_delta, price_delta) in deltas.items():
+        if not count_delta and not price_delta:
+            continue
+        # 用 F() 表达式在数据库里原子地加减，不会出现“读-改-写”的并发覆盖
+        rollups = CatalogRollup.objects.filter(dimension=dimension, key=key)
+        updated = rollups.update(
+            book_count=F('book_count') + count_delta,
+            price_total=F('price_total') + price_delta,
+        )
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                CatalogRollup.objects.create(
+                    dimension=dimension, key=key, book_count=count_delta, price_total=price_delta
+                )
+        except IntegrityError:
+            # 并发请求先创建了这一行，再更新一次即可
+            rollups.update(
+                book_count=F('book_count') + count_delta,
+                price_total=F('price_total') + price_delta,
+            )
+
+
+def add_book(deltas, author_id, price, published_date, sign=1, tag_ids=()):
+    cells, price = book_cells(author_id, price, published_date)
+    for cell in cells:
+        deltas[cell][0] += sign
+        deltas[cell][1] += sign * price
+    for tag_id in tag_ids:
+        cell = (CatalogRollup.DIMENSION_TAG, str(tag_id))
+        deltas[cell][0] += sign
+        deltas[cell][1] += sign * price
+
+
+def new_deltas():
+    return defaultdict(lambda: [0, ZERO])
+
+
+def book_created(book):
+    deltas = new_deltas()
+    add_book(deltas, book.author_id, book.price, book.published_date)
+    apply_deltas(deltas)
+
+
+def books_created(books, tag_links):
+    """
+    批量创建的图书：所有图书和标签关系的变化量合并后一起写入
+    :param tag_links: 新增的 (book_id, tag_id) 列表
+    """
+    tags_by_book = defaultdict(list)
+    for book_id, tag_id in tag_links:
+        tags_by_book[book_id].append(tag_id)
+    deltas = new_deltas()
+    for book in books:
+        add_book(deltas, book.author_id, book.price, book.published_date, tag_ids=tags_by_book[book.pk])
+    apply_deltas(deltas)
+
+
+def book_changed(book, old_values):
+    """
+    图书被修改：先减去旧值的贡献，再加上新值的贡献（没变的格子会相互抵消）
+    """
+    old = (old_values['author_id'], old_values['price'], old_values['published_date'])
+    new = normalize_book_values(book.author_id, book.price, book.published_date)
+    old = normalize_book_values(*old)
+    if old == new:
+        return
+    deltas = new_deltas()
+    add_book(deltas, *old, sign=-1)
+    add_book(deltas, *new)
+    # 价格变了，这本书所在的每个标签的价格合计也要跟着变
+    if old[1] != new[1]:
+        for tag_id in book.tags.values_list('id', flat=True):
+            deltas[(CatalogRollup.DIMENSION_TAG, str(tag_id))][1] += new[1] - old[1]
+    apply_deltas(deltas)
+
+
+def book_deleted(book, tag_ids):
+    deltas = new_deltas()
+    add_book(deltas, book.author_id, book.price, book.published_date, sign=-1, tag_ids=tag_ids)
+    apply_deltas(deltas)
+
+
+def tag_links_changed(pairs, sign, using='default', prices=None):
+    """
+    标签关系变化（新增/删除的 (book_id, tag_id) 对）
+    :param prices: 已知的 {book_id: 价格}（从图书这一侧修改标签时直接传入，省一次查询）
+    """
+    if not pairs:
+        return
+    book_ids = {book_id for book_id, _ in pairs}
+    if prices is None or not book_ids <= set(prices):
+        prices = dict(Book.objects.using(using).filter(pk__in=book_ids).values_list('id', 'price'))
+    else:
+        # 内存里的价格可能还是字符串 / float（比如 `Book.objects.create(price='30')`）
+        price_field = Book._meta.get_field('price')
+        prices = {book_id: price_field.to_python(price) for book_id, price in prices.items()}
+    deltas = new_deltas()
+    for book_id, tag_id in pairs:
+        cell = (CatalogRollup.DIMENSION_TAG, str(tag_id))
+        deltas[cell][0] += sign
+        deltas[cell][1] += sign * prices.get(book_id, ZERO)
+    apply_deltas(deltas)
+
+
+def remove_dimension_key(dimension, key):
+    CatalogRollup.objects.filter(dimension=dimension, key=str(key)).delete()
+
+
+def rebuild():
+    """
+    从头重建汇总表（全表聚合，只在管理命令里使用）
+    开启分片时（见 books/sharding.py）每个分片分别聚合，再把同一个格子的结果相加
+    :return: 生成的汇总行数
+    """
+    cells = new_deltas()
+
+    def add_cells(dimension, queryset, key_name):
+        for item in queryset:
+            cell = cells[(dimension, '' if key_name is None else str(item[key_name]))]
+            cell[0] += item['book_count']
+            cell[1] += item['price_total'] or ZERO
+
+    aggregates = {'book_count': Count('id'), 'price_total': Sum('price')}
+    for using in sharding.get_aliases():
+        books = Book.objects.using(using).order_by()
+        add_cells(CatalogRollup.DIMENSION_TOTAL, [books.aggregate(**aggregates)], None)
+        add_cells(CatalogRollup.DIMENSION_AUTHOR, books.values('author_id').annotate(**aggregates), 'author_id')
+        add_cells(
+            CatalogRollup.DIMENSION_YEAR,
+            books.annotate(year=ExtractYear('published_date')).values('year').annotate(**aggregates),
+            'year',
+        )
+        add_cells(
+            CatalogRollup.DIMENSION_TAG,
+            Book.tags.through.objects.using(using).order_by().values('tag_id').annotate(
+                book_count=Count('book_id'), price_total=Sum('book__price')
+            ),
+            'tag_id',
+        )
+        # 价格区间：按区间宽度在 Python 里分组（只取 price 一列，流式读取）
+        for price in books.values_list('price', flat=True).iterator(chunk_size=2000):
+            cell = cells[(CatalogRollup.DIMENSION_PRICE_BAND, price_band(price))]
+            cell[0] += 1
+            cell[1] += price
+
+    rows = [
+        CatalogRollup(dimension=dimension, key=key, book_count=count, price_total=total)
+        for (dimension, key), (count, total) in cells.items() if count
+    ]
+    with transaction.atomic():
+        CatalogRollup.objects.all().delete()
+        CatalogRollup.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
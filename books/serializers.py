@@ -1,18 +1,46 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.template.context_processors import request
 from rest_framework import serializers
-from .models import Book, Author, Tag
+from .models import Book, Author, Tag, CatalogRollup, Job, Borrowing
 from django.contrib.auth.models import User
+from . import exports, jobs, writes
 
 class AuthorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Author
-        fields = ('id', 'name')  # 隐藏字段email
+        fields = ('id', 'name', 'book_count', 'updated_at')  # 隐藏字段email
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
+# 只校验 id 的格式（是不是整数），不查数据库
+# 真正的查询由 BookSerializer 统一完成：同一个模型的所有 id 只查一次 `WHERE id IN (...)`
+# 💡 DRF 自带的 `PrimaryKeyRelatedField` 每个 id 都会执行一次 `queryset.get(pk=...)`，传 5 个标签就是 5 条 SQL
+class DeferredPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+# 批量创建图书（请求体是数组）时使用：先把所有图书引用的 id 一次性查出来，再逐本校验
+class BookListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.prefetch_related_objects(data)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        return writes.bulk_create_books(validated_data)
+
+
 # 定义一个叫 `BookSerializer` 的类，它继承自 `ModelSerializer`（专门用来序列化模型的）。
 # 💡 为什么用 `ModelSerializer`？
 # 因为它能自动根据模型生成字段，还能自动处理“保存到数据库”的逻辑，省去大量代码！
@@ -32,13 +60,14 @@ class BookSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
     # === 写入时：用独立字段接收 ID ===
-    author_id = serializers.PrimaryKeyRelatedField(
+    # 💡 三个 id 字段都用 DeferredPrimaryKeyRelatedField：校验时每个模型只查一次数据库（见 to_internal_value）
+    author_id = DeferredPrimaryKeyRelatedField(
         queryset=Author.objects.all(),
         write_only=True,
         source='author'      # 关键：把 author_id 的值赋给 book.author
     )
 
-    owner_id = serializers.PrimaryKeyRelatedField(
+    owner_id = DeferredPrimaryKeyRelatedField(
         queryset=User.objects.all(),
         write_only=True,
         required=False,   # owner 可选（因为模型里 null=True）
@@ -87,7 +116,7 @@ class BookSerializer(serializers.ModelSerializer):
     # | -------------------- | --------------- | --------- | -------------------------------------------------- |
     # | **创建图书（POST）** | 发送            | `tag_ids` | `[1, 3]`                                           |
     # | **获取图书（GET）**  | 接收            | `tags`    | `[{"id":1,"name":"经典"}, {"id":3,"name":"小说"}]` |
-    tag_ids = serializers.PrimaryKeyRelatedField(
+    tag_ids = DeferredPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all(),
         write_only=True,
@@ -117,6 +146,79 @@ class BookSerializer(serializers.ModelSerializer):
         model = Book
         # 表示序列化 **所有字段**（id, title, author, price, published_date）。你也可以写成 `['id', 'title', 'author']` 只选部分字段。
         fields = '__all__' # 包含所有字段（含 read_only 和 write_only）
+        read_only_fields = ('views',)  # 浏览次数只能由详情接口累加（见 books/viewcounts.py）
+        list_serializer_class = BookListSerializer  # many=True 时使用的列表序列化器
+
+    # === 批量查询关联对象 ===
+    # 校验流程：字段先把 id 转成整数 → 这里按模型收集所有 id，每个模型一条 IN 查询 → 把 id 换成对象
+    # 查询结果缓存在最外层序列化器上，批量创建时所有图书共用，不会重复查询
+    def get_deferred_fields(self):
+        """
+        :return: {字段名: (source, 是否多值, 字段对象)}
+        """
+        result = {}
+        for name, field in self.fields.items():
+            if isinstance(field, serializers.ManyRelatedField) and isinstance(field.child_relation, DeferredPrimaryKeyRelatedField):
+                result[name] = (field.source, True, field.child_relation)
+            elif isinstance(field, DeferredPrimaryKeyRelatedField):
+                result[name] = (field.source, False, field)
+        return result
+
+    def get_related_cache(self):
+        # {字段名: {id: 对象，不存在时为 None}}
+        return self.root.__dict__.setdefault('_related_cache', defaultdict(dict))
+
+    def load_related_objects(self, pks_by_field):
+        cache = self.get_related_cache()
+        deferred = self.get_deferred_fields()
+        for name, pks in pks_by_field.items():
+            known = cache[name]
+            missing = set(pks) - set(known)
+            if not missing:
+                continue
+            found = {obj.pk: obj for obj in deferred[name][2].get_queryset().filter(pk__in=missing)}
+            for pk in missing:
+                known[pk] = found.get(pk)
+
+    def prefetch_related_objects(self, items):
+        """
+        批量创建时调用：从原始请求数据里收集所有 id，提前查好
+        """
+        pks_by_field = defaultdict(set)
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            for name, (source, many, field) in self.get_deferred_fields().items():
+                value = item.get(name)
+                for pk in (value if many and isinstance(value, list) else [value]):
+                    try:
+                        pks_by_field[name].add(field.to_internal_value(pk))
+                    except serializers.ValidationError:
+                        pass  # 格式不对的 id 留给逐本校验时报错
+        self.load_related_objects(pks_by_field)
+
+    def to_internal_value(self, data):
+        attrs = super().to_internal_value(data)
+        deferred = self.get_deferred_fields()
+        values = {
+            name: attrs[source] if many else [attrs[source]]
+            for name, (source, many, field) in deferred.items()
+            if attrs.get(source) is not None
+        }
+        self.load_related_objects(values)
+        cache = self.get_related_cache()
+        errors = {}
+        for name, pks in values.items():
+            source, many, field = deferred[name]
+            objects = [cache[name][pk] for pk in pks]
+            missing = [pk for pk, obj in zip(pks, objects) if obj is None]
+            if missing:
+                errors[name] = [field.error_messages['does_not_exist'].format(pk_value=pk) for pk in missing]
+            else:
+                attrs[source] = objects if many else objects[0]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
 
     # `FileField` 和 `ImageField` 在序列化时默认只返回相对路径，比如 `/media/covers/1.jpg`。我们通过 `get_cover_image` 方法返回**完整 URL**。
     # | 代码                              | 说明                                     |
@@ -156,24 +258,11 @@ class BookSerializer(serializers.ModelSerializer):
     # ```
     # 因为 DRF 默认就会把 `cover_image` 传给 `create()`，只要字段在 `fields = '__all__'` 中。
     # 但你手动 `pop` 再赋值也没错，只是多此一举 😅
+    # 💡 现在封面图片和其它字段一起 INSERT，新书的标签直接批量 INSERT，整个过程在一个事务里（见 books/writes.py）
     def create(self, validated_data):
         # DRF 已自动处理 author 和 tags（因为用了 source）
         # return super().create(validated_data)
-
-        # 先从 validated_data 中取出 tags 字段（可能是 tag_ids 列表）并删除该字段，下面重新赋值
-        tag_ids = validated_data.pop('tags', []) # 注意：source='tags' 所以字段名是 'tags'
-        # 从validated_data中取出文件cover_image，并删除该文件，下面重新赋值
-        cover_image = validated_data.pop('cover_image', None)
-        book = Book.objects.create(**validated_data)
-        if tag_ids:
-            # 重新赋值
-            # 设置 tags（必须用 .set()）
-            book.tags.set(tag_ids)
-        if cover_image:
-            # 重新赋值
-            book.cover_image = cover_image
-            book.save()
-        return book
+        return writes.create_book(validated_data)
 
     # | 代码                                                    | 说明                                     |
     # | ------------------------------------------------------- | ---------------------------------------- |
@@ -186,15 +275,8 @@ class BookSerializer(serializers.ModelSerializer):
     # ⚠️ 注意：**旧图片不会自动删除！
     def update(self, instance, validated_data):
         # return super().update(instance, validated_data)
-        cover_image = validated_data.pop('cover_image', None)
-        tag_ids = validated_data.pop('tags', [])
-        instance =super().update(instance, validated_data)
-        if tag_ids:
-            instance.tags.set(tag_ids)
-        if cover_image:
-            instance.cover_image = cover_image
-            instance.save()
-        return instance
+        # 封面图片和其它字段在同一条 UPDATE 里保存，不再 save() 两次
+        return writes.update_book(instance, validated_data)
 
     # create 和 update 可以省略！DRF 默认行为已经足够， 除非你要做特殊处理（如删除旧文件），✅ 因为 `ModelSerializer` 默认就能处理 `FileField`/`ImageField` 的上传和保存！
 
@@ -217,3 +299,135 @@ class BookSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("吴承恩的书不能高于100元")
         return data
 
+
+
+# 作者带上最新的几本书（`GET /api/authors/?include_books=3`）
+# 图书由视图用一条窗口函数查询取出，放在 context['latest_books'] 里（{作者 id: [图书]}），这里不再查询
+class AuthorWithBooksSerializer(AuthorSerializer):
+    books = serializers.SerializerMethodField()
+
+    class Meta(AuthorSerializer.Meta):
+        fields = AuthorSerializer.Meta.fields + ('books',)
+
+    def get_books(self, author):
+        books = self.context.get('latest_books', {}).get(author.pk, [])
+        return BookSerializer(books, many=True, context=self.context).data
+
+
+# 统计汇总行（只读）
+class CatalogRollupSerializer(serializers.ModelSerializer):
+    average_price = serializers.DecimalField(max_digits=16, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = CatalogRollup
+        fields = ('key', 'book_count', 'price_total', 'average_price')
+
+
+# 批量请求（`POST /api/batch/`）的请求体
+class BatchSubRequestSerializer(serializers.Serializer):
+    id = serializers.CharField(required=False, max_length=50)  # 客户端自定义的标识，原样返回；不传时用序号
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.CharField(max_length=500)
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        if not value.startswith('/'):
+            raise serializers.ValidationError("路径必须以 / 开头")
+        return value
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        max_requests = self.context.get('max_requests')
+        if max_requests and len(value) > max_requests:
+            raise serializers.ValidationError(f"一次最多 {max_requests} 个子请求")
+        return value
+
+
+# 后台任务的状态（GET /api/jobs/）；管理员提交任务时只能填写 name、payload、priority
+class JobSerializer(serializers.ModelSerializer):
+    owner = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = (
+            'id', 'name', 'payload', 'priority', 'status', 'progress', 'attempts', 'max_attempts',
+            'run_after', 'result', 'error', 'owner', 'created_at', 'finished_at',
+        )
+        read_only_fields = (
+            'status', 'progress', 'attempts', 'max_attempts', 'run_after', 'result', 'error', 'created_at', 'finished_at',
+        )
+
+    def validate_name(self, value):
+        if value not in jobs.get_task_names():
+            raise serializers.ValidationError(f"没有这个任务，可用的任务：{', '.join(jobs.get_task_names())}")
+        return value
+
+    def validate_payload(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("任务参数必须是 JSON 对象")
+        return value
+
+    def create(self, validated_data):
+        return jobs.enqueue(**validated_data)
+
+
+# 借阅记录（借出 / 归还接口、我的借阅列表，见 books/inventory.py）；stock 是操作之后的剩余库存
+class BorrowingSerializer(serializers.ModelSerializer):
+    book_title = serializers.CharField(source='book.title', read_only=True)
+    stock = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Borrowing
+        fields = ('id', 'book', 'book_title', 'borrowed_at', 'returned_at', 'stock')
+        read_only_fields = fields
+
+    def get_stock(self, obj):
+        return obj.book.stock
+
+
+# 提交图书导出（`POST /api/exports/`，见 books/exports.py）
+class ExportRequestSerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=list(exports.FORMATS), default='csv')
+    compression = serializers.ChoiceField(choices=list(exports.COMPRESSIONS), default='none')
+    filters = serializers.DictField(required=False, default=dict)
+
+    def validate_filters(self, value):
+        value = exports.normalize_filters(value)
+        errors = exports.validate_filters(value)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
+
+# 批量修改标签（`POST /api/books/bulk-tags/`，见 books/bulktags.py）：ids 和 filters 二选一，add 和 remove 至少填一个
+class BulkTagUpdateSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=10000)
+    filters = serializers.DictField(required=False)  # 和图书列表的查询参数相同，比如 {"tags": "3", "min_price": 30}
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=100)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=100)
+
+    def validate_filters(self, value):
+        value = exports.normalize_filters(value)
+        errors = exports.validate_filters(value)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
+    def validate(self, data):
+        if ('ids' in data) == ('filters' in data):
+            raise serializers.ValidationError("ids 和 filters 必须二选一")
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError("add 和 remove 至少填一个")
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError("同一个标签不能既添加又移除")
+        existing = set(Tag.objects.filter(pk__in={*data['add'], *data['remove']}).values_list('id', flat=True))
+        errors = {
+            name: [f'标签不存在：{tag_id}' for tag_id in sorted(set(data[name]) - existing)]
+            for name in ('add', 'remove') if set(data[name]) - existing
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
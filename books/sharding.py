@@ -0,0 +1,332 @@
+import zlib
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+
+from .counting import adjust_table_count
+from .models import Book, ArchivedBook, ArchivedBookTag, ArchivedBorrowing, Borrowing, IdSequence
+
+# 按拥有者水平分片：每个用户的图书（以及标签关系、归档的图书）放在同一个数据库里，图书多了可以分到多个数据库
+# 开启：设置环境变量 `BOOKS_SHARDS=default,shard1`（settings.py 据此配置 BOOKS_SHARDS 和对应的 DATABASES），
+#       再对每个分片执行 `python manage.py migrate --database shard1`
+# | 数据                              | 放在哪里                                                          |
+# | --------------------------------- | ----------------------------------------------------------------- |
+# | 图书、标签关系、归档图书          | 拥有者 id 的 crc32 对分片数取余，同一个用户的图书总在同一个分片    |
+# | 作者、标签、用户                  | 默认数据库是主副本，保存 / 删除时同步到其它分片（分片里的外键、JOIN 照常使用） |
+# | 汇总表、变更日志、任务队列、id 序列 | 只在默认数据库                                                   |
+# | 操作                 | 做法                                                                     |
+# | -------------------- | ------------------------------------------------------------------------ |
+# | 普通用户的所有接口   | 只查自己的分片（数据库路由 ShardRouter + BookViewSet.get_queryset）      |
+# | 管理员的列表 / 搜索  | 每个分片各查一次，再合并排序、分页（见 ScatterGatherList）              |
+# | 管理员的详情 / 修改  | 先找到图书所在的分片                                                     |
+# | 新增图书             | id 由默认数据库里的全局序列分配（IdSequence），各分片的 id 不会重复      |
+# | 修改拥有者           | 事务提交后图书和标签关系一起搬到新拥有者的分片（见 move_books）          |
+# ⚠️ 跨分片没有分布式事务：批量创建时每个分片各自一个事务；分片上的修改提交之后才写变更日志
+# ⚠️ 修改 BOOKS_SHARDS（增减分片）后执行 `python manage.py rebalance_shards` 把图书搬到新的分片
+# ⚠️ 从标签这一侧修改关系（`tag.book_set.add(...)`）和旧的示例视图（`/api/books-fbv/`、`/api/books-cbv/` 等）只访问默认数据库
+HOME_ALIAS = 'default'
+BOOK_SEQUENCE = 'books.book'
+# 分片的表 → 标签关系表（两张关系表的字段都是 book_id / tag_id）
+SHARDED_MODELS = {
+    Book: Book.tags.through,
+    ArchivedBook: ArchivedBookTag,
+}
+# 分片的表 → 借阅记录表
+BORROWING_MODELS = {
+    Book: Borrowing,
+    ArchivedBook: ArchivedBorrowing,
+}
+
+
+def is_enabled():
+    return bool(getattr(settings, 'BOOKS_SHARDS', None))
+
+
+def get_aliases():
+    """
+    :return: 所有分片的数据库别名；没有开启分片时只有默认数据库
+    """
+    return list(getattr(settings, 'BOOKS_SHARDS', None) or [HOME_ALIAS])
+
+
+def shard_for_owner(owner_id):
+    """
+    拥有者所在的分片：crc32 在不同进程、不同机器上结果都一样（Python 的 hash() 每次启动都不同）
+    没有拥有者的图书放在第一个分片
+    """
+    aliases = get_aliases()
+    if owner_id is None:
+        return aliases[0]
+    return aliases[zlib.crc32(str(owner_id).encode('ascii')) % len(aliases)]
+
+
+def home_alias(using):
+    """
+    汇总表、变更日志等只在默认数据库的表：分片上的写入也要写到默认数据库
+    """
+    return HOME_ALIAS if is_enabled() else using
+
+
+def is_replica(using):
+    """
+    是不是作者 / 标签 / 用户的副本所在的数据库（同步写入副本时不再处理信号）
+    """
+    return is_enabled() and using != HOME_ALIAS
+
+
+def gather(queryset):
+    """
+    管理员的查询：每个分片一个查询集
+    """
+    if not is_enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in get_aliases()]
+
+
+def locate_book(pk):
+    """
+    管理员按 id 查找图书时，先找到图书所在的分片；都找不到时返回第一个分片（接口照常返回 404）
+    """
+    aliases = get_aliases()
+    if not is_enabled():
+        return aliases[0]
+    for alias in aliases:
+        for model in SHARDED_MODELS:
+            try:
+                if model.objects.using(alias).filter(pk=pk).exists():
+                    return alias
+            except (TypeError, ValueError):
+                return aliases[0]
+    return aliases[0]
+
+
+class ShardRouter:
+    """
+    数据库路由（settings.DATABASE_ROUTERS）：图书、标签关系、归档图书按拥有者路由，其它模型交给默认规则
+    """
+    def get_shard(self, model, instance):
+        if not is_enabled() or (model not in SHARDED_MODELS and model not in SHARDED_MODELS.values()):
+            return None
+        if isinstance(instance, tuple(SHARDED_MODELS)):
+            # 已经保存过的图书就在它所在的分片；新建的图书按拥有者选择
+            # 💡 新建的图书在设置外键时 `_state.db` 就会被填上默认数据库，所以不能只看 `_state.db`
+            if instance._state.db and not instance._state.adding:
+                return instance._state.db
+            return shard_for_owner(instance.owner_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.get_shard(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self.get_shard(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 作者、标签、用户在每个分片都有副本，图书可以关联默认数据库里查出来的对象
+        if is_enabled():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+# === 全局 id ===
+def get_max_book_id():
+    max_id = 0
+    for alias in get_aliases():
+        for model in SHARDED_MODELS:
+            max_id = max(max_id, model.objects.using(alias).aggregate(max_id=Max('id'))['max_id'] or 0)
+    return max_id
+
+
+def allocate_book_ids(count):
+    """
+    从全局序列分配 count 个连续的图书 id（一条 UPDATE，多个进程同时分配也不会重复）
+    :return: range
+    """
+    with transaction.atomic(using=HOME_ALIAS):
+        sequences = IdSequence.objects.using(HOME_ALIAS).filter(name=BOOK_SEQUENCE)
+        if not sequences.update(next_id=F('next_id') + count):
+            # 第一次分配：从所有分片里现有的最大 id 往后排
+            start = get_max_book_id() + 1
+            try:
+                with transaction.atomic(using=HOME_ALIAS):
+                    IdSequence.objects.using(HOME_ALIAS).create(name=BOOK_SEQUENCE, next_id=start + count)
+                return range(start, start + count)
+            except IntegrityError:
+                # 别的进程同时创建了序列
+                sequences.update(next_id=F('next_id') + count)
+        next_id = sequences.values_list('next_id', flat=True).get()
+    return range(next_id - count, next_id)
+
+
+def assign_ids(books):
+    """
+    开启分片时给还没有 id 的新图书分配全局 id（没有开启时用数据库的自增 id）
+    """
+    if not is_enabled():
+        return
+    books = [book for book in books if book.pk is None]
+    for book, pk in zip(books, allocate_book_ids(len(books)) if books else ()):
+        book.pk = pk
+
+
+# === 作者、标签、用户的副本 ===
+def get_copy_values(instance):
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields if not field.primary_key
+    }
+
+
+def replicate_saved(instance, using):
+    """
+    默认数据库里保存之后，同步到其它分片（UPDATE，没有就 INSERT；不发送信号）
+    """
+    if not is_enabled() or using != HOME_ALIAS:
+        return
+    model = type(instance)
+    values = get_copy_values(instance)
+    for alias in get_aliases():
+        if alias == HOME_ALIAS:
+            continue
+        if not model._base_manager.using(alias).filter(pk=instance.pk).update(**values):
+            model._base_manager.using(alias).bulk_create([model(pk=instance.pk, **values)])
+
+
+def replicate_deleted(instance, using):
+    """
+    默认数据库里删除之后，其它分片里也删除（正常的删除流程：级联删除分片里的图书，照常发送图书的删除信号）
+    """
+    if not is_enabled() or using != HOME_ALIAS:
+        return
+    for alias in get_aliases():
+        if alias != HOME_ALIAS:
+            type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def sync_references(models):
+    """
+    把默认数据库里已有的作者 / 标签 / 用户全部同步到各个分片（刚开启分片、或者新增分片时使用）
+    :return: 同步的行数
+    """
+    total = 0
+    for model in models:
+        for instance in model._base_manager.using(HOME_ALIAS).iterator(chunk_size=500):
+            replicate_saved(instance, HOME_ALIAS)
+            total += 1
+    return total
+
+
+# === 在分片之间移动图书 ===
+def move_books(model, book_ids, source, target):
+    """
+    把图书（和标签关系、借阅记录）从 source 分片移到 target 分片：数据没有变化，只是换了位置，所以不发送信号
+    :param model: Book 或 ArchivedBook
+    :return: 移动的数量
+    """
+    through = SHARDED_MODELS[model]
+    with transaction.atomic(using=target), transaction.atomic(using=source):
+        books = list(model._base_manager.using(source).filter(pk__in=book_ids))
+        if not books:
+            return 0
+        ids = [book.pk for book in books]
+        links = list(through.objects.using(source).filter(book_id__in=ids).values_list('book_id', 'tag_id'))
+        model._base_manager.using(target).bulk_create(books)
+        through.objects.using(target).bulk_create([through(book_id=book_id, tag_id=tag_id) for book_id, tag_id in links])
+        through.objects.using(source).filter(book_id__in=ids)._raw_delete(source)
+        # 借阅记录的 id 只在分片内唯一，到了目标分片重新分配
+        borrowing_model = BORROWING_MODELS[model]
+        borrowings = list(borrowing_model.objects.using(source).filter(book_id__in=ids))
+        for borrowing in borrowings:
+            borrowing.pk = None
+        borrowing_model.objects.using(target).bulk_create(borrowings)
+        borrowing_model.objects.using(source).filter(book_id__in=ids)._raw_delete(source)
+        model._base_manager.using(source).filter(pk__in=ids)._raw_delete(source)
+        # 不发送信号，两个分片的整表计数器在这里加减（见 books/counting.py）
+        transaction.on_commit(partial(adjust_table_count, model, -len(ids), source), using=source)
+        transaction.on_commit(partial(adjust_table_count, model, len(ids), target), using=target)
+    return len(books)
+
+
+def get_misplaced_owners(model, alias):
+    """
+    :return: {目标分片: [拥有者 id]}，这些拥有者的图书不在它们应该在的分片上
+    """
+    misplaced = {}
+    owner_ids = model._base_manager.using(alias).order_by().values_list('owner_id', flat=True).distinct()
+    for owner_id in owner_ids:
+        target = shard_for_owner(owner_id)
+        if target != alias:
+            misplaced.setdefault(target, []).append(owner_id)
+    return misplaced
+
+
+def rebalance(batch_size=500, progress=None):
+    """
+    修改分片配置后，把每本图书搬到拥有者现在对应的分片（分批移动，每批一个事务）
+    :return: 移动的总数
+    """
+    total = 0
+    for alias in get_aliases():
+        for model in SHARDED_MODELS:
+            for target, owner_ids in get_misplaced_owners(model, alias).items():
+                queryset = model._base_manager.using(alias).filter(owner_id__in=owner_ids).order_by('id')
+                while True:
+                    book_ids = list(queryset.values_list('id', flat=True)[:batch_size])
+                    if not book_ids:
+                        break
+                    total += move_books(model, book_ids, alias, target)
+                    if progress is not None:
+                        progress(total)
+    return total
+
+
+class ScatterGatherList:
+    """
+    多个分片（以及归档表）的查询合并成一个列表，给分页器使用（支持 count() 和切片）
+    切片 [start:stop] 时每个查询集按相同的排序只取前 stop 行的 id 和排序字段，在内存里合并排序，
+    再分别按 id 加载这一页的对象
+    ⚠️ 翻到第 N 页时每个分片要取 N × 每页数量行，很深的分页建议加过滤条件
+    """
+    ordered = True  # 告诉 Django 的分页器：结果已经排好序
+
+    def __init__(self, querysets):
+        from .archive import get_ordering  # 避免 archive → writes → signals → sharding 循环导入
+
+        self.querysets = querysets
+        self.ordering = get_ordering(querysets[0])
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        columns = list(dict.fromkeys(['id'] + [field.lstrip('-') for field in self.ordering]))
+        rows = []
+        for index, queryset in enumerate(self.querysets):
+            values = queryset.order_by(*self.ordering).values_list(*columns)
+            if key.stop is not None:
+                values = values[:key.stop]
+            rows.extend((index, *row) for row in values)
+        # 多个排序字段、升降序混合：从最后一个字段开始逐个做稳定排序
+        for field in reversed(self.ordering):
+            position = columns.index(field.lstrip('-')) + 1
+            rows.sort(key=lambda row: row[position], reverse=field.startswith('-'))
+        rows = rows[key]
+        objects = {}
+        for index, queryset in enumerate(self.querysets):
+            ids = [row[1] for row in rows if row[0] == index]
+            if ids:
+                objects.update({(index, obj.pk): obj for obj in queryset.filter(pk__in=ids)})
+        return [objects[(row[0], row[1])] for row in rows if (row[0], row[1]) in objects]
@@ -0,0 +1,216 @@
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+
+from . import bookcounts, changes, rollups, sharding, similarity
+from .counting import invalidate_counts, adjust_table_count
+from .hotset import hot_books
+from .models import Book, Author, Tag, CatalogRollup, ChangeLogEntry
+
+# 修改图书时需要知道的“旧值”
+TRACKED_FIELDS = ('author_id', 'price', 'published_date', 'owner_id', 'is_highlighted')
+
+# 自定义信号：批量创建图书（`bulk_create` 不会发送 post_save / m2m_changed，见 books/writes.py）
+# 参数：books（已有 id 的图书列表）、tag_links（(book_id, tag_id) 列表）、using
+books_bulk_created = Signal()
+
+
+# 信号处理函数：图书写入后维护分页计数、统计汇总表、作者 / 标签的图书数量、内存里的热点图书和变更日志
+# - `pre_save`：保存之前触发，这里用来补齐旧值
+# - `post_save`：新增或修改之后触发（`created=True` 表示新增）
+# - `pre_delete` / `post_delete`：删除之前 / 之后触发
+# - `m2m_changed`：多对多关系（图书的标签）变化时触发
+@receiver(pre_save, sender=Book)
+def book_pre_save(sender, instance, using, **kwargs):
+    if instance._state.adding:
+        # 开启分片时新书的 id 由全局序列分配（见 books/sharding.py）
+        sharding.assign_ids([instance])
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(field in loaded for field in TRACKED_FIELDS):
+        return
+    # 对象不是从数据库加载的（或者只加载了部分字段），查一次旧值
+    old = Book.objects.using(using).filter(pk=instance.pk).values(*TRACKED_FIELDS).first()
+    instance._loaded_values = {**loaded, **(old or {})}
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, using, **kwargs):
+    old_values = getattr(instance, '_loaded_values', {})
+    # 计数缓存在事务提交后才失效：提交前别的请求查到的还是旧数据，不能让它们用新版本号缓存起来
+    transaction.on_commit(partial(invalidate_counts, owner_id=instance.owner_id), using=using)
+    # owner 被修改时，原拥有者的计数也要失效
+    old_owner_id = old_values.get('owner_id')
+    if old_owner_id is not None and old_owner_id != instance.owner_id:
+        transaction.on_commit(partial(invalidate_counts, owner_id=old_owner_id), using=using)
+    if created:
+        transaction.on_commit(partial(adjust_table_count, Book, 1, using), using=using)
+        rollups.book_created(instance)
+        bookcounts.authors_changed({instance.author_id: 1}, using)
+    elif all(field in old_values for field in TRACKED_FIELDS):
+        rollups.book_changed(instance, old_values)
+        if old_values['author_id'] != instance.author_id:
+            bookcounts.authors_changed({old_values['author_id']: -1, instance.author_id: 1}, using)
+    # 分片：拥有者变了，图书要搬到新拥有者的分片
+    # 💡 在源分片的事务提交后再搬：提交前搬的话，源分片回滚时目标分片里已经有了这本书（两个数据库不在同一个事务里）；
+    #    搬的过程中出错时图书留在原分片，`python manage.py rebalance_shards` 会再搬一次
+    target = sharding.shard_for_owner(instance.owner_id) if sharding.is_enabled() else using
+    if target != using:
+        transaction.on_commit(partial(move_to_shard, instance, using, target), using=using)
+    transaction.on_commit(
+        partial(hot_books.book_changed, instance.pk, target, instance.is_highlighted), using=using
+    )
+    # 变更日志：拥有者变了，对原拥有者来说这本书“被删除”了（普通用户只同步自己的图书）
+    if old_owner_id is not None and old_owner_id != instance.owner_id:
+        changes.record(ChangeLogEntry.KIND_BOOK, instance.pk, ChangeLogEntry.ACTION_DELETED, old_owner_id, using)
+    if created:
+        action = ChangeLogEntry.ACTION_CREATED
+    elif instance.is_highlighted and old_values.get('is_highlighted') is False:
+        # 单独记录“被设为高亮”，实时推送（books/events.py）据此发出 book.highlighted 事件
+        action = ChangeLogEntry.ACTION_HIGHLIGHTED
+    else:
+        action = ChangeLogEntry.ACTION_UPDATED
+    changes.record(ChangeLogEntry.KIND_BOOK, instance.pk, action, instance.owner_id, using)
+    # 新书、或者换了作者：相似图书要重新计算（见 books/similarity.py）
+    if created or old_values.get('author_id', instance.author_id) != instance.author_id:
+        similarity.mark_dirty([instance.pk], using)
+
+
+def move_to_shard(instance, source, target):
+    sharding.move_books(Book, [instance.pk], source, target)
+    instance._state.db = target
+
+
+@receiver(books_bulk_created, sender=Book)
+def books_bulk_saved(sender, books, tag_links, using, **kwargs):
+    for owner_id in {book.owner_id for book in books}:
+        transaction.on_commit(partial(invalidate_counts, owner_id=owner_id), using=using)
+    transaction.on_commit(partial(adjust_table_count, Book, len(books), using), using=using)
+    rollups.books_created(books, tag_links)
+    bookcounts.authors_changed(Counter(book.author_id for book in books), using)
+    bookcounts.tag_links_changed(tag_links, 1, using)
+    # 一次新增很多本，不逐本重新加载，让热点图书整体失效
+    transaction.on_commit(hot_books.invalidate, using=using)
+    changes.record_many(
+        ChangeLogEntry.KIND_BOOK, [(book.pk, book.owner_id) for book in books], ChangeLogEntry.ACTION_CREATED, using
+    )
+    similarity.mark_dirty([book.pk for book in books], using)
+
+
+@receiver(pre_delete, sender=Book)
+def book_pre_delete(sender, instance, using, **kwargs):
+    # 删除后标签关系就没了，先记下来
+    instance._deleted_tag_ids = list(
+        Book.tags.through.objects.using(using).filter(book_id=instance.pk).values_list('tag_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(invalidate_counts, owner_id=instance.owner_id), using=using)
+    transaction.on_commit(partial(adjust_table_count, Book, -1, using), using=using)
+    rollups.book_deleted(instance, getattr(instance, '_deleted_tag_ids', []))
+    bookcounts.authors_changed({instance.author_id: -1}, using)
+    bookcounts.tag_links_changed(
+        [(instance.pk, tag_id) for tag_id in getattr(instance, '_deleted_tag_ids', [])], -1, using
+    )
+    transaction.on_commit(partial(hot_books.book_removed, instance.pk), using=using)
+    changes.record(ChangeLogEntry.KIND_BOOK, instance.pk, ChangeLogEntry.ACTION_DELETED, instance.owner_id, using)
+    similarity.mark_dirty([instance.pk], using)
+
+
+def get_link_pairs(instance, reverse, pk_set):
+    """
+    把 m2m_changed 的参数统一转换成 (book_id, tag_id) 列表
+    - `reverse=False`：从图书这一侧操作（`book.tags.add(...)`），`pk_set` 是标签 id
+    - `reverse=True`：从标签这一侧操作（`tag.book_set.add(...)`），`pk_set` 是图书 id
+    """
+    if reverse:
+        return [(book_id, instance.pk) for book_id in pk_set]
+    return [(instance.pk, tag_id) for tag_id in pk_set]
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+def book_tags_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        # `remove()` 传入的 id 不一定真的存在关系，这里查出真正会被删除的关系
+        links = sender.objects.using(using).filter(**{'tag_id' if reverse else 'book_id': instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{'book_id__in' if reverse else 'tag_id__in': pk_set})
+        instance._removed_tag_links = list(links.values_list('book_id', 'tag_id'))
+    elif action == 'post_add':
+        pairs = get_link_pairs(instance, reverse, pk_set)
+        # 从图书这一侧添加标签时，图书的价格就在 instance 上
+        prices = None if reverse else {instance.pk: instance.price}
+        rollups.tag_links_changed(pairs, 1, using, prices)
+        bookcounts.tag_links_changed(pairs, 1, using)
+        book_links_changed(instance, reverse, pairs, using)
+    elif action in ('post_remove', 'post_clear'):
+        pairs = instance.__dict__.pop('_removed_tag_links', [])
+        rollups.tag_links_changed(pairs, -1, using)
+        bookcounts.tag_links_changed(pairs, -1, using)
+        book_links_changed(instance, reverse, pairs, using)
+
+
+def book_links_changed(instance, reverse, pairs, using):
+    # 标签变化后，内存里的热点图书要重新加载（标签是嵌套在图书数据里返回的）
+    book_ids = {book_id for book_id, _ in pairs}
+    for book_id in book_ids:
+        transaction.on_commit(partial(hot_books.book_changed, book_id, using), using=using)
+    # 对同步的客户端来说图书的数据变了
+    owners = None if reverse else {instance.pk: instance.owner_id}
+    owners = changes.record_books_updated(book_ids, using, owners)
+    similarity.mark_dirty(book_ids, using)
+    # 按标签过滤（?tags=...）的分页计数缓存也要失效（见 books/counting.py）
+    for owner_id in set(owners.values()):
+        transaction.on_commit(partial(invalidate_counts, owner_id=owner_id), using=using)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Tag)
+def author_or_tag_saved(sender, instance, created, using, **kwargs):
+    if sharding.is_replica(using):
+        return
+    # 作者名、标签名也嵌套在图书数据里，修改后热点图书整体失效
+    if not created:
+        transaction.on_commit(hot_books.invalidate, using=using)
+    kind = ChangeLogEntry.KIND_AUTHOR if sender is Author else ChangeLogEntry.KIND_TAG
+    action = ChangeLogEntry.ACTION_CREATED if created else ChangeLogEntry.ACTION_UPDATED
+    changes.record(kind, instance.pk, action, using=using)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, using, **kwargs):
+    if sharding.is_replica(using):
+        return
+    rollups.remove_dimension_key(CatalogRollup.DIMENSION_AUTHOR, instance.pk)
+    transaction.on_commit(hot_books.invalidate, using=using)
+    changes.record(ChangeLogEntry.KIND_AUTHOR, instance.pk, ChangeLogEntry.ACTION_DELETED, using=using)
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, using, **kwargs):
+    if sharding.is_replica(using):
+        return
+    rollups.remove_dimension_key(CatalogRollup.DIMENSION_TAG, instance.pk)
+    transaction.on_commit(hot_books.invalidate, using=using)
+    changes.record(ChangeLogEntry.KIND_TAG, instance.pk, ChangeLogEntry.ACTION_DELETED, using=using)
+
+
+# 分片：作者、标签、用户在每个分片都有一份副本（分片里图书的外键、JOIN 需要），默认数据库里修改后同步过去
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=User)
+def reference_saved(sender, instance, using, **kwargs):
+    sharding.replicate_saved(instance, using)
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=User)
+def reference_deleted(sender, instance, using, **kwargs):
+    sharding.replicate_deleted(instance, using)
@@ -0,0 +1,354 @@
+from functools import partial
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import jobs, sharding
+from .models import Book, Job, SimilarBookList
+
+# 相似图书：按共同的标签和作者推荐，`GET /api/books/<id>/similar/` 直接读预先算好的前 K 本
+# 每次请求现算（按标签 JOIN 图书-标签表、GROUP BY 计数）要扫描热门标签下的所有图书，图书多了就慢；这里改成离线批量计算：
+# | 步骤 | 说明                                                                                     |
+# | ---- | ---------------------------------------------------------------------------------------- |
+# | 1    | 读出所有图书的作者和标签，组成稀疏的“图书 × 特征”矩阵（特征 = 标签 + 作者），只保存非零元素 |
+# | 2    | 特征权重用 IDF（越少见的标签越能说明相似），再把每一行归一化，两本书的点积就是余弦相似度     |
+# | 3    | 按行分批：每一批通过特征的倒排表展开“共享特征的图书”，`np.bincount` 累加得分，`np.argpartition` 取前 K |
+# | 4    | 结果写进 SimilarBookList（每本书一行），接口按主键读一行、再按 id 查 K 本图书 → O(K)         |
+# 🔄 更新方式：
+# - `python manage.py build_similar_books`：全量重算（建议每天一次，顺便修正 IDF 权重的漂移）
+# - 图书的标签 / 作者变化、新增或删除图书 → 信号把这本书标记为过期（dirty_at），并排一个后台任务
+#   `refresh_similar_books`：只重算过期的图书、以及相似列表里包含它们的图书；
+#   其它图书只在“过期的图书现在比它列表里的最后一名更相似”时把它插进去；
+#   SimilarBookList 只读需要的行：列表里包含过期图书的行在数据库里展开 JSON 数组过滤，其它行按 id 读
+# ⚠️ 增量刷新仍然要把所有图书的作者、标签读进内存重建矩阵（IDF 权重和归一化依赖全部图书），这一步是 O(图书数)；
+#    省掉的是全量重算每本书的相似列表、以及读写整张 SimilarBookList
+# 💡 只依赖 NumPy：稀疏矩阵用“行指针 + 列下标 + 权重”三个数组表示（CSR），另外按列保存一份倒排表
+# 💡 推荐的是全站的图书（和 `recent` 一样），不只是自己的
+REFRESH_TASK = 'refresh_similar_books'
+REBUILD_TASK = 'rebuild_similar_books'
+# 每批计算的得分矩阵最多多少个元素（批大小 × 图书总数），控制内存
+BATCH_CELLS = 4_000_000
+LOOKUP_BATCH_SIZE = 500  # 按 id 读相似列表时一条查询最多带多少个 id（SQLite 的参数个数有上限）
+# 在数据库里判断“相似列表（JSON 数组）包含某些图书 id”的条件，{ids} 是一串占位符
+CONTAINS_TEMPLATES = {
+    'sqlite': 'EXISTS (SELECT 1 FROM json_each({column}) AS item WHERE item.value IN ({ids}))',
+    'postgresql': 'EXISTS (SELECT 1 FROM jsonb_array_elements_text({column}) AS item(value) WHERE item.value::bigint IN ({ids}))',
+}
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_top_k():
+    return get_setting('BOOKS_SIMILAR_TOP_K', 20)
+
+
+def expand(starts, counts):
+    """
+    把多个区间 [start, start + count) 展开成一个下标数组（向量化，不写 Python 循环）
+    """
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+class SimilarityMatrix:
+    """
+    稀疏的“图书 × 特征”矩阵，每一行已经归一化
+    """
+    def __init__(self, book_ids, author_ids, link_book_ids, link_tag_ids, author_weight=None):
+        if author_weight is None:
+            author_weight = get_setting('BOOKS_SIMILAR_AUTHOR_WEIGHT', 1.0)
+        order = np.argsort(book_ids)
+        self.book_ids = book_ids[order]
+        author_ids = author_ids[order]
+        size = len(self.book_ids)
+        link_rows = self.rows_for(link_book_ids)
+        valid = link_rows >= 0
+        tags, tag_columns = np.unique(link_tag_ids[valid], return_inverse=True)
+        authors, author_columns = np.unique(author_ids, return_inverse=True)
+        rows = np.concatenate([link_rows[valid], np.arange(size)])
+        columns = np.concatenate([tag_columns, len(tags) + author_columns])
+        features = len(tags) + len(authors)
+
+        # IDF：log((1 + 图书总数) / (1 + 含有这个特征的图书数)) + 1
+        frequency = np.bincount(columns, minlength=features)
+        weights = (np.log((1 + size) / (1 + frequency)) + 1)[columns]
+        weights[len(tag_columns):] *= author_weight
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=size))
+        norms[norms == 0] = 1
+        weights /= norms[rows]
+
+        # 按行（CSR）：某本书有哪些特征
+        order = np.argsort(rows, kind='stable')
+        self.row_columns, self.row_weights = columns[order], weights[order]
+        self.row_pointers = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=size))])
+        # 按列（倒排表）：某个特征有哪些图书
+        order = np.argsort(columns, kind='stable')
+        self.posting_rows, self.posting_weights = rows[order], weights[order]
+        self.posting_pointers = np.concatenate([[0], np.cumsum(frequency)])
+
+    @classmethod
+    def load(cls):
+        """
+        从数据库读出所有图书的作者和标签（开启分片时读每个分片）
+        """
+        books = [
+            row for queryset in sharding.gather(Book.objects.order_by())
+            for row in queryset.values_list('id', 'author_id')
+        ]
+        links = [
+            row for queryset in sharding.gather(Book.tags.through.objects.order_by())
+            for row in queryset.values_list('book_id', 'tag_id')
+        ]
+        books = np.array(books, dtype=np.int64).reshape(-1, 2)
+        links = np.array(links, dtype=np.int64).reshape(-1, 2)
+        return cls(books[:, 0], books[:, 1], links[:, 0], links[:, 1])
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    def rows_for(self, book_ids):
+        """
+        :return: 每本书在矩阵里的行号，不存在的图书是 -1
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        if not len(self.book_ids):
+            return np.full(len(book_ids), -1)
+        rows = np.minimum(np.searchsorted(self.book_ids, book_ids), len(self.book_ids) - 1)
+        return np.where(self.book_ids[rows] == book_ids, rows, -1)
+
+    def score_rows(self, rows):
+        """
+        :param rows: 行号数组
+        :return: (len(rows), 图书总数) 的余弦相似度矩阵，和自己的相似度记为 0
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        size = len(self.book_ids)
+        # 这一批图书的所有 (行, 特征, 权重)
+        starts = self.row_pointers[rows]
+        counts = self.row_pointers[rows + 1] - starts
+        entries = expand(starts, counts)
+        local = np.repeat(np.arange(len(rows)), counts)
+        columns, weights = self.row_columns[entries], self.row_weights[entries]
+        # 每个特征展开成含有它的所有图书，得分 = 两边权重的乘积，按 (行, 图书) 累加
+        starts = self.posting_pointers[columns]
+        counts = self.posting_pointers[columns + 1] - starts
+        postings = expand(starts, counts)
+        targets = np.repeat(local, counts) * size + self.posting_rows[postings]
+        contributions = np.repeat(weights, counts) * self.posting_weights[postings]
+        scores = np.bincount(targets, weights=contributions, minlength=len(rows) * size).reshape(len(rows), size)
+        scores[np.arange(len(rows)), rows] = 0
+        return scores
+
+    def top_k(self, scores, k):
+        """
+        :return: 每一行的 (相似图书 id 列表, 相似度列表)，按相似度从高到低，相同时按 id，只保留相似度大于 0 的
+        """
+        k = min(k, scores.shape[1] - 1)
+        if k <= 0:
+            return [([], []) for _ in range(len(scores))]
+        selected = np.sort(np.argpartition(-scores, k - 1, axis=1)[:, :k], axis=1)
+        selected_scores = np.take_along_axis(scores, selected, axis=1)
+        order = np.argsort(-selected_scores, axis=1, kind='stable')
+        selected = np.take_along_axis(selected, order, axis=1)
+        selected_scores = np.take_along_axis(selected_scores, order, axis=1)
+        results = []
+        for columns, values in zip(selected, selected_scores):
+            keep = values > 0
+            results.append((
+                self.book_ids[columns[keep]].tolist(), [round(float(value), 4) for value in values[keep]],
+            ))
+        return results
+
+    def batches(self, rows):
+        """
+        把行号分成若干批，每批的得分矩阵不超过 BATCH_CELLS 个元素
+        """
+        batch_size = max(1, BATCH_CELLS // max(len(self.book_ids), 1))
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+
+def save_lists(lists):
+    """
+    :param lists: {图书 id: (相似图书 id 列表, 相似度列表)}
+    """
+    SimilarBookList.objects.using(sharding.HOME_ALIAS).bulk_create(
+        [
+            SimilarBookList(book_id=book_id, similar_ids=similar_ids, scores=scores)
+            for book_id, (similar_ids, scores) in lists.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['book_id'],
+        update_fields=['similar_ids', 'scores', 'updated_at'],
+    )
+
+
+def rebuild(progress=None):
+    """
+    全量重算所有图书的相似列表
+    :return: 计算了多少本
+    """
+    started = timezone.now()
+    matrix = SimilarityMatrix.load()
+    k = get_top_k()
+    done = 0
+    for rows in matrix.batches(np.arange(len(matrix))):
+        with transaction.atomic(using=sharding.HOME_ALIAS):
+            save_lists(dict(zip(matrix.book_ids[rows].tolist(), matrix.top_k(matrix.score_rows(rows), k))))
+        done += len(rows)
+        if progress is not None:
+            progress(done, len(matrix))
+    lists = SimilarBookList.objects.using(sharding.HOME_ALIAS)
+    # 这次没有写到的行是已经删除的图书
+    lists.filter(updated_at__lt=started).delete()
+    lists.filter(dirty_at__lte=started).update(dirty_at=None)
+    return done
+
+
+def read_lists(queryset):
+    return {
+        book_id: (similar_ids, scores)
+        for book_id, similar_ids, scores in queryset.values_list('book_id', 'similar_ids', 'scores')
+    }
+
+
+def get_lists(book_ids):
+    """
+    :return: {图书 id: (相似图书 id 列表, 相似度列表)}，只读这些图书的行
+    """
+    lists = SimilarBookList.objects.using(sharding.HOME_ALIAS)
+    stored = {}
+    for start in range(0, len(book_ids), LOOKUP_BATCH_SIZE):
+        stored.update(read_lists(lists.filter(book_id__in=book_ids[start:start + LOOKUP_BATCH_SIZE])))
+    return stored
+
+
+def get_lists_containing(book_ids):
+    """
+    :return: 相似列表里包含这些图书的行 {图书 id: (相似图书 id 列表, 相似度列表)}
+    💡 SQLite / PostgreSQL 在数据库里展开 JSON 数组过滤；其它数据库逐行读出来在 Python 里判断
+    """
+    lists = SimilarBookList.objects.using(sharding.HOME_ALIAS)
+    connection = connections[sharding.HOME_ALIAS]
+    template = CONTAINS_TEMPLATES.get(connection.vendor)
+    if template is None:
+        wanted = set(book_ids)
+        return {
+            book_id: (similar_ids, scores)
+            for book_id, similar_ids, scores in lists.values_list('book_id', 'similar_ids', 'scores').iterator()
+            if wanted.intersection(similar_ids)
+        }
+    qn = connection.ops.quote_name
+    column = f'{qn(SimilarBookList._meta.db_table)}.{qn("similar_ids")}'
+    stored = {}
+    for start in range(0, len(book_ids), LOOKUP_BATCH_SIZE):
+        batch = book_ids[start:start + LOOKUP_BATCH_SIZE]
+        condition = template.format(column=column, ids=', '.join(['%s'] * len(batch)))
+        stored.update(read_lists(lists.extra(where=[condition], params=batch)))
+    return stored
+
+
+def refresh():
+    """
+    增量刷新过期的图书
+    :return: 更新了多少本图书的相似列表
+    """
+    started = timezone.now()
+    lists = SimilarBookList.objects.using(sharding.HOME_ALIAS)
+    dirty = set(lists.filter(dirty_at__lte=started).values_list('book_id', flat=True))
+    if not dirty:
+        return 0
+    matrix = SimilarityMatrix.load()
+    k = get_top_k()
+    stored = get_lists_containing(sorted(dirty))
+    dirty_rows = matrix.rows_for(sorted(dirty))
+    deleted = [book_id for book_id, row in zip(sorted(dirty), dirty_rows) if row < 0]
+    dirty_rows = dirty_rows[dirty_rows >= 0]
+
+    # 1. 过期的图书、以及列表里有过期图书的图书：整行重算
+    listed = list(stored)
+    recompute_rows = np.union1d(dirty_rows, matrix.rows_for(listed))
+    recompute_rows = recompute_rows[recompute_rows >= 0]
+    recomputed = set(matrix.book_ids[recompute_rows].tolist())
+    updates = {}
+    for rows in matrix.batches(recompute_rows):
+        updates.update(zip(matrix.book_ids[rows].tolist(), matrix.top_k(matrix.score_rows(rows), k)))
+
+    # 2. 其它图书：过期的图书比它列表里的最后一名更相似时插进去
+    for rows in matrix.batches(dirty_rows):
+        scores = matrix.score_rows(rows)
+        # 这一批会影响到的图书：按 id 读出它们现在的列表
+        targets = matrix.book_ids[np.flatnonzero((scores > 0).any(axis=0))].tolist()
+        stored.update(get_lists([book_id for book_id in targets if book_id not in stored and book_id not in recomputed]))
+        for dirty_id, row_scores in zip(matrix.book_ids[rows].tolist(), scores):
+            for target in np.flatnonzero(row_scores > 0):
+                book_id = int(matrix.book_ids[target])
+                if book_id in recomputed:
+                    continue
+                similar_ids, values = updates.get(book_id) or stored.get(book_id, ([], []))
+                score = round(float(row_scores[target]), 4)
+                if len(similar_ids) >= k and score <= values[-1]:
+                    continue
+                merged = sorted(
+                    [(value, similar_id) for similar_id, value in zip(similar_ids, values) if similar_id != dirty_id]
+                    + [(score, dirty_id)],
+                    key=lambda item: (-item[0], item[1]),
+                )[:k]
+                updates[book_id] = ([similar_id for _, similar_id in merged], [value for value, _ in merged])
+
+    with transaction.atomic(using=sharding.HOME_ALIAS):
+        save_lists(updates)
+        lists.filter(book_id__in=deleted).delete()
+        lists.filter(book_id__in=dirty, dirty_at__lte=started).update(dirty_at=None)
+    return len(updates)
+
+
+def get_similar(book_id, limit):
+    """
+    :return: [(图书, 相似度)]，最多 limit 本；已经删除的图书跳过
+    """
+    row = SimilarBookList.objects.using(sharding.HOME_ALIAS).filter(book_id=book_id).first()
+    if row is None:
+        return []
+    pairs = list(zip(row.similar_ids, row.scores))[:limit]
+    ids = [similar_id for similar_id, _ in pairs]
+    books = {
+        book.pk: book
+        for queryset in sharding.gather(Book.objects.select_related('author', 'owner').prefetch_related('tags'))
+        for book in queryset.filter(pk__in=ids)
+    }
+    return [(books[similar_id], score) for similar_id, score in pairs if similar_id in books]
+
+
+# === 由 books/signals.py 调用 ===
+def mark_dirty(book_ids, using):
+    """
+    标记图书的相似列表过期（和数据修改在同一个事务里），事务提交后排一个刷新任务
+    """
+    now = timezone.now()
+    rows = [SimilarBookList(book_id=book_id, dirty_at=now) for book_id in book_ids]
+    if not rows:
+        return
+    write = partial(
+        SimilarBookList.objects.using(sharding.HOME_ALIAS).bulk_create, rows,
+        update_conflicts=True, unique_fields=['book_id'], update_fields=['dirty_at'],
+    )
+    if sharding.home_alias(using) == using:
+        write()
+    else:
+        # 分片上的修改：和变更日志一样，等分片的事务提交后再写默认数据库
+        transaction.on_commit(write, using=using)
+    transaction.on_commit(schedule_refresh, using=using)
+
+
+def schedule_refresh():
+    """
+    已经有一个排队中的刷新任务时不再重复提交（同时提交了两个也没关系，第二个发现没有过期的图书就直接结束）
+    """
+    if not Job.objects.filter(name=REFRESH_TASK, status=Job.STATUS_QUEUED).exists():
+        jobs.enqueue(REFRESH_TASK, delay=get_setting('BOOKS_SIMILAR_REFRESH_DELAY', 30))
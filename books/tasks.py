@@ -0,0 +1,47 @@
+from . import cascade, exports, rollups, similarity
+from .jobs import report_progress, task
+
+# 后台任务（由 `python manage.py run_jobs` 执行，见 books/jobs.py）
+# 每个任务函数接收 Job 对象（参数在 job.payload 里），返回值会保存到 job.result，必须能转成 JSON
+
+
+@task('rebuild_rollups', max_attempts=1)
+def rebuild_rollups(job):
+    """
+    重建统计汇总表（和 `python manage.py rebuild_rollups` 相同，只是放到后台执行）
+    """
+    return {'rows': rollups.rebuild()}
+
+
+@task(exports.EXPORT_TASK)
+def export_books(job):
+    """
+    生成图书导出文件（见 books/exports.py）
+    """
+    return exports.build_export(job)
+
+
+@task(similarity.REFRESH_TASK, max_attempts=1)
+def refresh_similar_books(job):
+    """
+    增量刷新标签 / 作者变化过的图书的相似列表（由信号自动提交，见 books/similarity.py）
+    """
+    return {'books': similarity.refresh()}
+
+
+@task(similarity.REBUILD_TASK, max_attempts=1)
+def rebuild_similar_books(job):
+    """
+    全量重算相似图书（和 `python manage.py build_similar_books` 相同）
+    """
+    progress = lambda done, total: report_progress(job, done * 100 / max(total, 1))
+    return {'books': similarity.rebuild(progress=progress)}
+
+
+@task(cascade.DELETE_TASK)
+def cascade_delete(job):
+    """
+    分批删除作者 / 用户及其图书（见 books/cascade.py）
+    """
+    progress = lambda done, total: report_progress(job, done * 100 / max(total, 1))
+    return cascade.run_delete(job.payload['kind'], job.payload['id'], progress=progress)
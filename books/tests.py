@@ -1,11 +1,40 @@
+from io import StringIO
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
 
 # Create your tests here.
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework.test import APIClient
-from .models import Book, Author
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from asgiref.sync import sync_to_async
+from .models import (
+    Book, Author, Tag, CatalogRollup, ChangeLogEntry, Job, ArchivedBook, ArchivedBorrowing, Borrowing, SimilarBookList,
+    IdempotencyRecord,
+)
+from .hotset import hot_books
+from .idempotency import IdempotencyStore, idempotency_store
+from .pagination import StandardResultsSetPagination
+from bookapi.schema import schema_artifact
+from bookapi.middleware import CompressionMiddleware, choose_encoding
+from . import analytics, archive, bookcounts, cascade, changes, exports, inventory, jobs, sharding, similarity, viewcounts, writer, writes
+from .exceptions import BookOutOfStockError, WriterTimeoutError
 
 # 🔍 逐行解释：
 # - `TestCase`：Django 提供的测试基类，用于编写测试用例
@@ -146,3 +175,1562 @@ class BookAPITest(TestCase):
         self.assertIn('details', response.data)
         self.assertIn('This field is required.', response.data.get('details').get('title'))
 
+
+# 测试分页计数策略（缓存计数 + 写入失效 + 整表计数器）
+# 💡 计数缓存和限流记录都存在缓存里，每个测试前后都清空，避免测试之间互相影响
+class BookPaginationCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='wangwu', password='xwz123456')
+        self.staff = User.objects.create_user(username='admin', password='xwz123456', is_staff=True)
+        self.author = Author.objects.create(name='老舍')
+        Book.objects.create(title='骆驼祥子', author=self.author, price=30, published_date='2020-01-01', owner=self.user)
+
+    def test_cached_count_invalidated_on_write(self):
+        """测试缓存的计数在新增图书后失效"""
+        url = reverse('book-list')
+        self.client.force_login(user=self.user)
+        data = self.client.get(url).data['data']
+        self.assertEqual(data['count'], 1)
+        self.assertTrue(data['count_exact'])
+        # 计数缓存在事务提交后才失效
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='四世同堂', author=self.author, price=50, published_date='2021-01-01', owner=self.user)
+        self.assertEqual(self.client.get(url).data['data']['count'], 2)
+
+    def test_cached_count_exact_only_with_shared_cache(self):
+        """测试从缓存读到的计数：进程内缓存（LocMemCache）时不算精确，共享缓存时算精确"""
+        url = reverse('book-list')
+        self.client.force_login(user=self.user)
+        self.assertTrue(self.client.get(url).data['data']['count_exact'])
+        data = self.client.get(url).data['data']
+        self.assertEqual(data['count'], 1)
+        self.assertFalse(data['count_exact'])
+        with mock.patch('books.counting.is_shared_cache', return_value=True):
+            self.assertTrue(self.client.get(url).data['data']['count_exact'])
+
+    def test_filtered_count_cached_per_filter(self):
+        """测试不同过滤条件分别计数"""
+        url = reverse('book-list')
+        self.client.force_login(user=self.user)
+        self.assertEqual(self.client.get(url, {'min_price': 40}).data['data']['count'], 0)
+        self.assertEqual(self.client.get(url, {'max_price': 40}).data['data']['count'], 1)
+
+    def test_unfiltered_table_count_maintained(self):
+        """测试管理员查看全部图书时使用维护的整表计数器"""
+        url = reverse('book-list')
+        self.client.force_login(user=self.staff)
+        self.assertEqual(self.client.get(url).data['data']['count'], 1)
+        # 整表计数器在事务提交后才加减，这里手动执行 on_commit 回调
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='茶馆', author=self.author, price=20, published_date='2019-01-01', owner=self.user)
+        data = self.client.get(url).data['data']
+        self.assertEqual(data['count'], 2)
+        # 测试环境是 LocMemCache，别的进程不会更新这个计数器，所以不算精确
+        self.assertFalse(data['count_exact'])
+
+    def test_table_count_recounted_after_timeout(self):
+        """测试不发送信号的写入让整表计数器有偏差时，计数器过期后重新统计"""
+        url = reverse('book-list')
+        self.client.force_login(user=self.staff)
+        self.assertEqual(self.client.get(url).data['data']['count'], 1)
+        Book.objects.all()._raw_delete('default')
+        self.assertEqual(self.client.get(url).data['data']['count'], 1)
+        timeout = StandardResultsSetPagination.table_count_timeout
+        with mock.patch('time.time', return_value=time.time() + timeout + 1):
+            data = self.client.get(url).data['data']
+        self.assertEqual(data['count'], 0)
+        self.assertEqual(data['results'], [])
+
+
+# 测试统计汇总表的增量维护和统计接口
+class CatalogStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.staff = User.objects.create_user(username='admin', password='xwz123456', is_staff=True)
+        self.author = Author.objects.create(name='金庸')
+        self.tag = Tag.objects.create(name='武侠')
+        self.book = Book.objects.create(title='射雕英雄传', author=self.author, price=45, published_date='1957-01-01')
+        Book.objects.create(title='天龙八部', author=self.author, price=58, published_date='1963-09-03')
+
+    def rollup(self, dimension, key=''):
+        row = CatalogRollup.objects.filter(dimension=dimension, key=str(key)).first()
+        return (row.book_count, row.price_total) if row else (0, 0)
+
+    def snapshot(self):
+        return sorted(CatalogRollup.objects.filter(book_count__gt=0).values_list('dimension', 'key', 'book_count', 'price_total'))
+
+    def test_rollups_follow_writes(self):
+        """测试新增、修改、打标签、删除后汇总表同步更新"""
+        self.assertEqual(self.rollup('total'), (2, 103))
+        self.assertEqual(self.rollup('author', self.author.id), (2, 103))
+        self.book.tags.add(self.tag)
+        self.assertEqual(self.rollup('tag', self.tag.id), (1, 45))
+        self.book.price = 65
+        self.book.published_date = '1958-01-01'
+        self.book.save()
+        self.assertEqual(self.rollup('tag', self.tag.id), (1, 65))
+        self.assertEqual(self.rollup('year', 1957), (0, 0))
+        self.assertEqual(self.rollup('year', 1958), (1, 65))
+        self.assertEqual(self.rollup('price_band', 40), (0, 0))
+        self.assertEqual(self.rollup('price_band', 60), (1, 65))
+        self.book.delete()
+        self.assertEqual(self.rollup('total'), (1, 58))
+        self.assertEqual(self.rollup('tag', self.tag.id), (0, 0))
+
+    def test_rebuild_matches_incremental(self):
+        """测试重建命令的结果和增量维护一致"""
+        self.tag.book_set.add(self.book)
+        incremental = self.snapshot()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_stats_endpoint(self):
+        """测试统计接口只对管理员开放"""
+        self.book.tags.add(self.tag)
+        self.client.force_login(user=self.staff)
+        data = self.client.get(reverse('stats-list')).data['data']
+        self.assertEqual(data['book_count'], 2)
+        self.assertEqual(data['average_price'], '51.50')
+        authors = self.client.get(reverse('stats-authors')).data['data']
+        self.assertEqual(authors[0]['name'], '金庸')
+        tags = self.client.get(reverse('stats-tags')).data['data']
+        self.assertEqual((tags[0]['name'], tags[0]['book_count']), ('武侠', 1))
+        prices = self.client.get(reverse('stats-prices')).data['data']
+        self.assertEqual([(p['min_price'], p['book_count']) for p in prices], [(40, 1), (50, 1)])
+        self.client.force_login(user=User.objects.create_user(username='zhangsan', password='xwz123456'))
+        self.assertEqual(self.client.get(reverse('stats-list')).status_code, 403)
+
+
+# 测试分面统计（?facets=...）
+class BookFacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='zhaoliu', password='xwz123456')
+        luxun = Author.objects.create(name='鲁迅')
+        laoshe = Author.objects.create(name='老舍')
+        self.novel = Tag.objects.create(name='小说')
+        books = [
+            Book.objects.create(title='呐喊', author=luxun, price=35, published_date='1923-08-01', owner=self.user),
+            Book.objects.create(title='彷徨', author=luxun, price=42, published_date='1926-08-01', owner=self.user),
+            Book.objects.create(title='茶馆', author=laoshe, price=18, published_date='1957-07-01', owner=self.user),
+        ]
+        books[0].tags.add(self.novel)
+        books[1].tags.add(self.novel)
+
+    def test_list_facets_follow_filters(self):
+        """测试分面统计使用和列表相同的过滤条件"""
+        self.client.force_login(user=self.user)
+        data = self.client.get(reverse('book-list'), {'min_price': 30, 'facets': 'all'}).data['data']
+        self.assertEqual(data['count'], 2)
+        facets = data['facets']
+        self.assertEqual(facets['author'], [{'value': facets['author'][0]['value'], 'label': '鲁迅', 'count': 2}])
+        self.assertEqual(facets['tag'][0]['label'], '小说')
+        self.assertEqual(facets['tag'][0]['count'], 2)
+        self.assertEqual([row['value'] for row in facets['year']], [1923, 1926])
+        self.assertEqual([(row['label'], row['count']) for row in facets['price']], [('30-40', 1), ('40-50', 1)])
+
+    def test_list_without_facets(self):
+        """测试不传 facets 时不做分面统计"""
+        self.client.force_login(user=self.user)
+        self.assertNotIn('facets', self.client.get(reverse('book-list')).data['data'])
+
+    def test_search_facets(self):
+        """测试搜索接口的分面统计"""
+        self.client.force_login(user=self.user)
+        data = self.client.get(reverse('book-search'), {'q': '茶', 'facets': 'author'}).data['data']
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['facets']['author'][0]['label'], '老舍')
+
+
+# 测试按标签过滤（ANY / ALL）
+class BookTagFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='sunqi', password='xwz123456')
+        author = Author.objects.create(name='刘慈欣')
+        self.scifi = Tag.objects.create(name='科幻')
+        self.classic = Tag.objects.create(name='经典')
+        self.book1 = Book.objects.create(title='三体', author=author, price=60, published_date='2008-01-01', owner=self.user)
+        self.book2 = Book.objects.create(title='球状闪电', author=author, price=40, published_date='2004-01-01', owner=self.user)
+        Book.objects.create(title='超新星纪元', author=author, price=30, published_date='2003-01-01', owner=self.user)
+        self.book1.tags.add(self.scifi, self.classic)
+        self.book2.tags.add(self.scifi)
+
+    def get_titles(self, params):
+        self.client.force_login(user=self.user)
+        results = self.client.get(reverse('book-list'), params).data['data']['results']
+        return [book['book_title'] for book in results]
+
+    def test_tags_any(self):
+        """测试 ?tags= 含有任意一个标签，且每本书只出现一次"""
+        self.assertEqual(self.get_titles({'tags': f'{self.scifi.id},{self.classic.id}'}), ['三体', '球状闪电'])
+
+    def test_tags_all(self):
+        """测试 ?tags_all= 同时含有所有标签"""
+        self.assertEqual(self.get_titles({'tags_all': f'{self.scifi.id},{self.classic.id}'}), ['三体'])
+        self.assertEqual(self.get_titles({'tags_all': f'{self.scifi.id}'}), ['三体', '球状闪电'])
+
+
+# 测试内存里的热点图书（recent / highlighted 不查数据库）
+# 💡 `APIClient.force_authenticate()` 不走 session，请求本身不会查数据库，方便用 assertNumQueries(0) 验证
+class HotBooksTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='qianba', password='xwz123456')
+        self.other = User.objects.create_user(username='zhoujiu', password='xwz123456')
+        self.author = Author.objects.create(name='余华')
+        self.book = Book.objects.create(title='活着', author=self.author, price=20, published_date='1993-01-01',
+                                        is_highlighted=True, owner=self.user)
+        Book.objects.create(title='兄弟', author=self.author, price=40, published_date='2005-01-01',
+                            is_highlighted=True, owner=self.other)
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        hot_books.warm_up()
+
+    def test_recent_served_from_memory(self):
+        """测试最近图书接口不查数据库，新增图书后同步更新"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='许三观卖血记', author=self.author, price=30, published_date='1995-01-01', owner=self.user)
+        with self.assertNumQueries(0):
+            data = self.api.get(reverse('book-recent')).data['data']
+        self.assertEqual([book['book_title'] for book in data], ['许三观卖血记', '兄弟', '活着'])
+
+    def test_highlighted_served_from_memory(self):
+        """测试高亮图书接口不查数据库，并且只返回自己的图书"""
+        with self.assertNumQueries(0):
+            data = self.api.get(reverse('book-highlighted')).data['data']
+        self.assertEqual([book['book_title'] for book in data], ['活着'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.is_highlighted = False
+            self.book.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api.get(reverse('book-highlighted')).data['data'], [])
+
+    def test_shared_version_change_triggers_reload(self):
+        """测试其他进程修改数据（版本号变化）后重新从数据库加载"""
+        Book.objects.filter(pk=self.book.pk).update(title='活着（新版）')
+        cache.incr('books:hotset:version')
+        data = self.api.get(reverse('book-recent')).data['data']
+        self.assertIn('活着（新版）', [book['book_title'] for book in data])
+
+    def test_change_log_recheck_without_shared_cache(self):
+        """测试其他进程的修改没有通知到版本号时，兜底检查变更日志后重新加载"""
+        Book.objects.filter(pk=self.book.pk).update(title='活着（新版）')
+        changes.record(ChangeLogEntry.KIND_BOOK, self.book.pk, ChangeLogEntry.ACTION_UPDATED, self.user.pk)
+        with self.assertNumQueries(0):
+            data = self.api.get(reverse('book-recent')).data['data']
+        self.assertIn('活着', [book['book_title'] for book in data])
+        later = time.monotonic() + hot_books.recheck_interval
+        with mock.patch('time.monotonic', return_value=later):
+            data = self.api.get(reverse('book-recent')).data['data']
+        self.assertIn('活着（新版）', [book['book_title'] for book in data])
+
+
+# 测试批量请求接口（测试数据库在事务里，线程池里的新连接看不到数据，这里用 1 个线程逐个执行）
+@override_settings(BOOKS_BATCH_MAX_WORKERS=1)
+class BatchRequestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='wushi', password='xwz123456')
+        self.author = Author.objects.create(name='钱钟书')
+        self.book = Book.objects.create(title='围城', author=self.author, price=30, published_date='1947-01-01', owner=self.user)
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def batch(self, *items):
+        return self.api.post(reverse('batch'), {'requests': list(items)}, format='json')
+
+    def test_batch_runs_subrequests_in_order(self):
+        """测试子请求按顺序执行，写请求之后的读请求能看到写入结果，不支持的路径返回404"""
+        response = self.batch(
+            {'id': 'book', 'path': f'/api/books/{self.book.pk}/'},
+            {'method': 'POST', 'path': '/api/tags/', 'body': {'name': '小说'}},
+            {'path': '/api/tags/'},
+            {'path': '/api/stats/'},
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.data['data']
+        self.assertEqual([item['id'] for item in results], ['book', '1', '2', '3'])
+        self.assertEqual([item['status'] for item in results], [200, 201, 200, 404])
+        self.assertEqual(results[0]['body']['data']['book_title'], '围城')
+        self.assertIn('小说', str(results[2]['body']))
+
+    def test_batch_counts_against_throttle(self):
+        """测试批量请求按子请求数量扣减限流次数"""
+        self.assertEqual(self.batch(*[{'path': '/api/authors/'}] * 8).status_code, 200)
+        self.assertEqual(self.batch(*[{'path': '/api/tags/'}] * 3).status_code, 429)
+        self.assertEqual(self.batch({'path': '/api/tags/'}).status_code, 200)
+
+    @override_settings(BOOKS_BATCH_MAX_WORKERS=2)
+    def test_reads_run_concurrently(self):
+        """测试相邻的读请求在线程池里执行（热点图书在内存里，不需要数据库连接）"""
+        hot_books.warm_up()
+        response = self.batch({'path': '/api/books/recent/'}, {'path': '/api/books/recent/'})
+        self.assertEqual([item['status'] for item in response.data['data']], [200, 200])
+        self.assertEqual(response.data['data'][1]['body']['data'][0]['book_title'], '围城')
+
+
+# 测试图书写入路径：关联 id 每个模型只查一次，批量创建的 SQL 数量和图书数量无关
+class BookWritePathTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='lisi', password='xwz123456')
+        self.author = Author.objects.create(name='老舍')
+        self.tags = [Tag.objects.create(name=f'标签{i}') for i in range(5)]
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def payload(self, title, tag_count=5):
+        return {
+            'title': title, 'author_id': self.author.pk, 'price': '35.00', 'published_date': '1936-01-01',
+            'tag_ids': [tag.pk for tag in self.tags[:tag_count]],
+        }
+
+    def test_create_resolves_tags_in_one_query(self):
+        """测试创建图书时，标签数量不影响 SQL 数量"""
+        # 先创建一本，让汇总表里的行都存在（第一次写入汇总表会多几条 INSERT）
+        self.api.post(reverse('book-list'), self.payload('二马'), format='json')
+        with CaptureQueriesContext(connection) as one_tag:
+            self.api.post(reverse('book-list'), self.payload('骆驼祥子', tag_count=1), format='json')
+        with CaptureQueriesContext(connection) as five_tags:
+            response = self.api.post(reverse('book-list'), self.payload('四世同堂'), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['data']['tags']), 5)
+        # 多出来的只有汇总表里每个标签各一条 UPDATE
+        self.assertEqual(len(five_tags) - len(one_tag), 4)
+        self.assertEqual(CatalogRollup.objects.get(dimension='tag', key=str(self.tags[4].pk)).book_count, 2)
+
+    def test_invalid_pk_reports_field_error(self):
+        """测试不存在的 id 返回字段级错误"""
+        payload = self.payload('茶馆')
+        payload['tag_ids'].append(999)
+        response = self.api.post(reverse('book-list'), payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tag_ids', str(response.data))
+        self.assertFalse(Book.objects.filter(title='茶馆').exists())
+
+    def test_bulk_create(self):
+        """测试批量创建：SQL 数量不随图书数量增加，统计和计数同步更新"""
+        self.api.post(reverse('book-list'), [self.payload('二马')], format='json')
+        with CaptureQueriesContext(connection) as two_books:
+            self.api.post(reverse('book-list'), [self.payload(f'图书{i}') for i in range(2)], format='json')
+        with CaptureQueriesContext(connection) as five_books:
+            response = self.api.post(reverse('book-list'), [self.payload(f'新书{i}') for i in range(5)], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['data']), 5)
+        self.assertEqual(len(five_books), len(two_books))
+        self.assertEqual(Book.objects.filter(owner=self.user).count(), 8)
+        self.assertEqual(CatalogRollup.objects.get(dimension='total').book_count, 8)
+        self.assertEqual(CatalogRollup.objects.get(dimension='tag', key=str(self.tags[0].pk)).book_count, 8)
+
+
+# 测试幂等键：重试直接返回第一次的响应，不重复创建
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        idempotency_store.clear()
+        self.addCleanup(idempotency_store.clear)
+        self.user = User.objects.create_user(username='zhaoliu', password='xwz123456')
+        self.author = Author.objects.create(name='沈从文')
+        self.payload = {'title': '边城', 'author_id': self.author.pk, 'price': '28.00', 'published_date': '1934-01-01'}
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def post(self, payload, key='key-1'):
+        return self.api.post(reverse('book-list'), payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        """测试同一个 key 重试时不查数据库，直接返回第一次的响应"""
+        first = self.post(self.payload)
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(0):
+            retry = self.post(self.payload)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['data']['id'], first.data['data']['id'])
+        self.assertEqual(Book.objects.filter(title='边城').count(), 1)
+
+    def test_key_reused_with_different_payload(self):
+        """测试同一个 key 用于不同内容的请求返回422，不同的 key 正常执行"""
+        self.post(self.payload)
+        response = self.post({**self.payload, 'title': '长河'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.post({**self.payload, 'title': '长河'}, key='key-2').status_code, 201)
+
+    def test_store_coalesces_and_evicts(self):
+        """测试并发的重复请求只有一个执行；超出容量时淘汰最久没用的记录"""
+        store = IdempotencyStore(max_entries=2, ttl=60)
+        entry, is_leader = store.begin('a', 'fp')
+        duplicate, duplicate_is_leader = store.begin('a', 'fp')
+        self.assertTrue(is_leader)
+        self.assertFalse(duplicate_is_leader)
+        self.assertFalse(duplicate.event.is_set())
+        store.finish('a', entry, (201, {}, {}))
+        self.assertTrue(duplicate.event.wait(0))
+        for key in ('b', 'c'):
+            store.finish(key, store.begin(key, 'fp')[0], (200, {}, {}))
+        self.assertTrue(store.begin('a', 'fp')[1])  # 'a' 已经被淘汰，重新执行
+
+    def test_retry_on_another_process_replays_shared_record(self):
+        """测试重试落到另一个进程（本地没有记录）时，从共享表返回第一次的响应"""
+        first = self.post(self.payload)
+        idempotency_store.clear()
+        retry = self.post(self.payload)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['data']['id'], first.data['data']['id'])
+        self.assertEqual(Book.objects.filter(title='边城').count(), 1)
+
+    @override_settings(BOOKS_IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_request_in_progress_on_another_process(self):
+        """测试别的进程正在执行同一个请求时返回409；租约到期后可以重新执行"""
+        self.post(self.payload, key='key-0')  # 同样的请求内容，借它拿到请求摘要
+        fingerprint = IdempotencyRecord.objects.get(key='key-0').fingerprint
+        record = IdempotencyRecord.objects.create(
+            user=self.user, key='key-1', fingerprint=fingerprint, expires_at=timezone.now() + timedelta(seconds=60),
+        )
+        self.assertEqual(self.post(self.payload).status_code, 409)
+        IdempotencyRecord.objects.filter(pk=record.pk).update(expires_at=timezone.now())
+        self.assertEqual(self.post(self.payload).status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get(key='key-1').status_code, 201)
+
+
+# 测试增量同步：只返回游标之后的变化，删除的对象返回墓碑记录
+class ChangeFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='sunqi', password='xwz123456')
+        self.other = User.objects.create_user(username='fengba', password='xwz123456')
+        self.author = Author.objects.create(name='张爱玲')
+        self.book = Book.objects.create(title='倾城之恋', author=self.author, price=25, published_date='1943-01-01', owner=self.user)
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def sync(self, cursor=None):
+        params = {'since': cursor} if cursor else {}
+        response = self.api.get(reverse('changes'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_returns_changes_after_cursor(self):
+        """测试游标之后的新增、修改、删除（墓碑）都能收到，同一对象只返回一条"""
+        cursor = self.sync()['cursor']
+        self.assertEqual(self.sync(cursor)['changes'], [])
+        tag = Tag.objects.create(name='爱情')
+        self.book.title = '倾城之恋（修订版）'
+        self.book.save()
+        self.book.tags.add(tag)
+        self.author.name = '张爱玲（Eileen Chang）'
+        self.author.save()
+        new_book = Book.objects.create(title='金锁记', author=self.author, price=20, published_date='1943-01-01', owner=self.user)
+        new_book_id = new_book.pk
+        new_book.delete()
+        data = self.sync(cursor)
+        changes = {(item['type'], item['id']): item for item in data['changes']}
+        self.assertEqual(len(data['changes']), 4)
+        self.assertEqual(changes[('book', self.book.pk)]['action'], 'updated')
+        self.assertEqual(changes[('author', self.author.pk)]['action'], 'updated')
+        self.assertEqual(changes[('book', self.book.pk)]['data']['book_title'], '倾城之恋（修订版）')
+        self.assertEqual(changes[('tag', tag.pk)]['action'], 'created')
+        self.assertEqual(changes[('book', new_book_id)], {'type': 'book', 'id': new_book_id, 'action': 'deleted'})
+        self.assertEqual(self.sync(data['cursor'])['changes'], [])
+
+    def test_other_users_books_and_owner_change(self):
+        """测试收不到别人的图书；图书转给别人时收到墓碑记录"""
+        cursor = self.sync()['cursor']
+        Book.objects.create(title='红玫瑰与白玫瑰', author=self.author, price=22, published_date='1944-01-01', owner=self.other)
+        self.book.owner = self.other
+        self.book.save()
+        changes = self.sync(cursor)['changes']
+        self.assertEqual(changes, [{'type': 'book', 'id': self.book.pk, 'action': 'deleted'}])
+
+    def test_paging_and_expired_cursor(self):
+        """测试分页（has_more）和游标过期"""
+        cursor = self.sync()['cursor']
+        for i in range(3):
+            Tag.objects.create(name=f'同步{i}')
+        first = self.api.get(reverse('changes'), {'since': cursor, 'limit': 2}).data['data']
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['cursor'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 3)
+        call_command('prune_changelog', days=-1, stdout=StringIO())
+        response = self.api.get(reverse('changes'), {'since': cursor})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.api.get(reverse('changes'), {'since': 'bad'}).status_code, 400)
+
+
+class OpenAPISchemaTest(TestCase):
+    def setUp(self):
+        schema_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(schema_dir.cleanup)
+        settings_override = override_settings(OPENAPI_SCHEMA_DIR=schema_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema_artifact.reset()
+        self.addCleanup(schema_artifact.reset)
+
+    def test_schema_served_with_etag(self):
+        """测试文档接口返回 ETag，再次请求时返回304"""
+        response = self.client.get(reverse('schema'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'openapi:', response.content)
+        etag = response['ETag']
+        response = self.client.get(reverse('schema'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_schema_json_and_gzip(self):
+        """测试 JSON 格式和 gzip 预压缩版本"""
+        response = self.client.get(reverse('schema') + '?format=json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(gzip.decompress(response.content).startswith(b'{'))
+
+
+# 测试响应压缩中间件（直接用 RequestFactory 调用，不经过视图）
+class CompressionMiddlewareTest(TestCase):
+    payload = ('{"book_title": "围城", "author": {"id": 1, "name": "钱钟书"}}' * 50).encode('utf-8')
+
+    def process(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/api/books/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiates_encoding(self):
+        """测试按 q 值和服务器优先顺序选择编码"""
+        levels = {'gzip': 6}
+        self.assertEqual(choose_encoding('gzip, deflate', levels), 'gzip')
+        self.assertEqual(choose_encoding('*', levels), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, br', levels))
+        self.assertIsNone(choose_encoding('identity', levels))
+
+    def test_compresses_json_above_min_size(self):
+        """测试超过最小长度的 JSON 被压缩，小响应和图片不压缩"""
+        response = self.process(HttpResponse(self.payload, content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.payload)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        small = self.process(HttpResponse(b'{}', content_type='application/json'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        image = self.process(HttpResponse(self.payload, content_type='image/png'))
+        self.assertFalse(image.has_header('Content-Encoding'))
+
+    def test_compresses_streaming_response_incrementally(self):
+        """测试流式响应逐块压缩输出"""
+        chunks = [self.payload] * 3
+        response = self.process(StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        parts = list(response.streaming_content)
+        # 每个数据块都会立刻输出一段压缩数据，而不是最后一次性输出
+        self.assertGreaterEqual(len(parts), len(chunks))
+        self.assertEqual(gzip.decompress(b''.join(parts)), b''.join(chunks))
+
+
+# 测试图书变化实时推送（SSE）：只收到自己的图书的事件，重连时补发错过的事件
+# 💡 异步测试里 sync_to_async 回到测试主线程执行，和测试用同一个数据库连接，能看到测试数据
+@override_settings(BOOKS_EVENTS_POLL_INTERVAL=0.01)
+class BookEventsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='chenjiu', password='xwz123456')
+        self.other = User.objects.create_user(username='weishi', password='xwz123456')
+        self.author = Author.objects.create(name='沈从文')
+
+    def create_book(self, owner, title='边城'):
+        return Book.objects.create(title=title, author=self.author, price=18, published_date='1934-01-01', owner=owner)
+
+    def highlight(self, book):
+        book.is_highlighted = True
+        book.save()
+
+    async def open_stream(self, **headers):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('book-events'), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        return stream
+
+    async def test_pushes_own_book_events(self):
+        """测试实时收到自己的图书的新增、高亮事件，收不到别人的图书"""
+        stream = await self.open_stream()
+        try:
+            await sync_to_async(self.create_book)(self.other, '长河')
+            book = await sync_to_async(self.create_book)(self.user)
+            await sync_to_async(self.highlight)(book)
+            frames = [await asyncio.wait_for(anext(stream), 5) for _ in range(2)]
+        finally:
+            await stream.aclose()
+        self.assertIn(b'event: book.created', frames[0])
+        self.assertIn(f'"id":{book.pk}'.encode(), frames[0])
+        self.assertIn('"book_title":"边城"'.encode('utf-8'), frames[0])
+        self.assertIn(b'event: book.highlighted', frames[1])
+
+    async def test_replays_missed_events(self):
+        """测试带 Last-Event-ID 重连时补发错过的事件"""
+        cursor = changes.encode_cursor(await sync_to_async(changes.get_latest_seq)())
+        book = await sync_to_async(self.create_book)(self.user)
+        await sync_to_async(self.highlight)(book)
+        stream = await self.open_stream(last_event_id=cursor)
+        try:
+            frames = [await asyncio.wait_for(anext(stream), 5) for _ in range(2)]
+        finally:
+            await stream.aclose()
+        self.assertIn(b'event: book.created', frames[0])
+        self.assertIn(b'event: book.highlighted', frames[1])
+
+    def test_requires_login_and_valid_event_id(self):
+        """测试未登录返回401，Last-Event-ID 不正确返回400"""
+        self.assertEqual(self.client.get(reverse('book-events')).status_code, 401)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book-events'), headers={'last-event-id': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+
+# 测试用的后台任务：记录执行顺序；flaky 第一次执行时失败
+executed_jobs = []
+
+
+@jobs.task('test_record')
+def record_job(job):
+    executed_jobs.append(job.payload['label'])
+    return {'label': job.payload['label']}
+
+
+@jobs.task('test_flaky', max_attempts=2)
+def flaky_job(job):
+    if job.attempts == 1:
+        raise RuntimeError('第一次失败')
+    return 'ok'
+
+
+# 测试后台任务队列（worker 用 1 个线程，在测试线程里执行，能看到测试事务里的数据）
+class JobQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        executed_jobs.clear()
+        self.user = User.objects.create_user(username='zhoushi', password='xwz123456')
+        self.admin = User.objects.create_user(username='jobadmin', password='xwz123456', is_staff=True)
+        self.api = APIClient()
+
+    def run_worker(self):
+        call_command('run_jobs', '--burst', '--concurrency', '1', stdout=StringIO())
+
+    def test_runs_by_priority(self):
+        """测试优先级高的先执行，相同优先级先进先出"""
+        jobs.enqueue('test_record', {'label': 'low'})
+        jobs.enqueue('test_record', {'label': 'high'}, priority=10)
+        jobs.enqueue('test_record', {'label': 'low2'})
+        jobs.enqueue('test_record', {'label': 'later'}, delay=3600)
+        self.run_worker()
+        self.assertEqual(executed_jobs, ['high', 'low', 'low2'])
+        job = Job.objects.get(payload__label='high')
+        self.assertEqual((job.status, job.progress, job.result), (Job.STATUS_SUCCEEDED, 100, {'label': 'high'}))
+        self.assertEqual(Job.objects.get(payload__label='later').status, Job.STATUS_QUEUED)
+
+    @override_settings(BOOKS_JOBS_RETRY_BACKOFF=60)
+    def test_retries_with_backoff(self):
+        """测试失败后延迟重新排队，重试成功；超过次数后标记为失败"""
+        job = jobs.enqueue('test_flaky')
+        with self.assertLogs('books.jobs', 'ERROR'):
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_QUEUED, 1))
+        self.assertIn('第一次失败', job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.STATUS_SUCCEEDED, 2, 'ok'))
+
+        unknown = Job.objects.create(name='missing', run_after=timezone.now())
+        with self.assertLogs('books.jobs', 'ERROR'):
+            self.run_worker()
+        unknown.refresh_from_db()
+        self.assertEqual(unknown.status, Job.STATUS_FAILED)
+
+    def test_job_status_api(self):
+        """测试普通用户只能看到自己的任务，只有管理员可以提交任务"""
+        mine = jobs.enqueue('test_record', {'label': 'mine'}, owner=self.user)
+        jobs.enqueue('test_record', {'label': 'other'}, owner=self.admin)
+        self.api.force_authenticate(user=self.user)
+        response = self.api.get('/api/jobs/')
+        self.assertEqual([item['id'] for item in response.data['data']['results']], [mine.pk])
+        self.assertEqual(self.api.get(f'/api/jobs/{mine.pk}/').data['data']['status'], Job.STATUS_QUEUED)
+        self.assertEqual(self.api.post('/api/jobs/', {'name': 'test_record'}, format='json').status_code, 403)
+        self.api.force_authenticate(user=self.admin)
+        response = self.api.post('/api/jobs/', {'name': 'test_record', 'payload': {'label': 'x'}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['owner'], 'jobadmin')
+        self.assertEqual(self.api.post('/api/jobs/', {'name': 'missing'}, format='json').status_code, 400)
+
+
+# 测试图书导出：后台生成文件、相同导出复用、Range 断点续传（导出目录换成临时目录）
+class ExportJobTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        settings_override = override_settings(BOOKS_EXPORT_DIR=export_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='wushi', password='xwz123456')
+        self.admin = User.objects.create_user(username='exportadmin', password='xwz123456', is_staff=True)
+        author = Author.objects.create(name='老舍')
+        tag = Tag.objects.create(name='京味')
+        self.cheap = Book.objects.create(title='骆驼祥子', author=author, price=20, published_date='1937-01-01', owner=self.user)
+        self.cheap.tags.add(tag)
+        Book.objects.create(title='四世同堂', author=author, price=80, published_date='1944-01-01', owner=self.user)
+        Book.objects.create(title='茶馆', author=author, price=30, published_date='1957-01-01', owner=self.admin)
+        self.api = APIClient()
+
+    def export(self, user, **data):
+        self.api.force_authenticate(user=user)
+        return self.api.post('/api/exports/', data, format='json')
+
+    def run_worker(self):
+        call_command('run_jobs', '--burst', '--concurrency', '1', stdout=StringIO())
+
+    def download(self, job_id, **headers):
+        response = self.api.get(f'/api/exports/{job_id}/download/', headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_export_csv_with_filters_and_scope(self):
+        """测试后台生成 CSV：只包含过滤后的、自己的图书"""
+        response = self.export(self.user, filters={'max_price': 50})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['data']['id']
+        self.assertEqual(self.download(job_id)[0].status_code, 409)
+        self.run_worker()
+        data = self.api.get(f'/api/exports/{job_id}/').data['data']
+        self.assertEqual(data['status'], Job.STATUS_SUCCEEDED)
+        self.assertEqual(data['result']['rows'], 1)
+        self.assertTrue(data['download_url'].endswith(f'/api/exports/{job_id}/download/'))
+        response, content = self.download(job_id)
+        lines = content.decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], ','.join(exports.CSV_COLUMNS))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('骆驼祥子', lines[1])
+        self.assertIn('京味', lines[1])
+        self.assertEqual(self.export(self.user, filters={'max_price': 'abc'}).status_code, 400)
+        self.assertEqual(self.export(self.user, filters={'unknown': 1}).status_code, 400)
+
+    def test_reuses_export_until_data_changes(self):
+        """测试相同的导出复用已生成的文件，数据变化后重新生成"""
+        first = self.export(self.admin, format='ndjson', compression='gzip').data['data']['id']
+        self.assertEqual(self.export(self.admin, format='ndjson', compression='gzip').data['data']['id'], first)
+        self.run_worker()
+        response = self.export(self.admin, format='ndjson', compression='gzip')
+        self.assertEqual((response.status_code, response.data['data']['id']), (200, first))
+        rows = [json.loads(line) for line in gzip.decompress(self.download(first)[1]).splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['骆驼祥子', '四世同堂', '茶馆'])
+        self.cheap.title = '骆驼祥子（修订版）'
+        self.cheap.save()
+        self.assertNotEqual(self.export(self.admin, format='ndjson', compression='gzip').data['data']['id'], first)
+
+    def test_download_supports_range(self):
+        """测试 Range 请求返回 206 和对应的字节，超出范围返回 416"""
+        job_id = self.export(self.admin).data['data']['id']
+        self.run_worker()
+        response, full = self.download(job_id)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response, part = self.download(job_id, range='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(full)}')
+        self.assertEqual(part, full[:10])
+        response, part = self.download(job_id, range='bytes=-5', if_range=response['ETag'])
+        self.assertEqual(part, full[-5:])
+        self.assertEqual(self.download(job_id, range=f'bytes={len(full)}-')[0].status_code, 416)
+        # If-Range 和当前文件不一致：返回完整文件
+        response, part = self.download(job_id, range='bytes=0-9', if_range='"old"')
+        self.assertEqual((response.status_code, part), (200, full))
+
+    def test_prune_removes_expired_artifacts(self):
+        """测试超过保留时间的导出文件被清理，下载返回410，重新导出会再生成"""
+        job_id = self.export(self.admin).data['data']['id']
+        self.run_worker()
+        path = exports.get_artifact_path(Job.objects.get(pk=job_id).payload)
+        call_command('prune_exports', stdout=StringIO())
+        self.assertTrue(path.exists())
+        expired = time.time() - exports.get_retention() - 1
+        os.utime(path, (expired, expired))
+        call_command('prune_exports', stdout=StringIO())
+        self.assertFalse(path.exists())
+        self.assertEqual(self.download(job_id)[0].status_code, 410)
+        response = self.export(self.admin)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.data['data']['id'], job_id)
+
+
+# 测试归档分区：默认只查图书表，?include_archived=1 时两张表合并排序、分页
+class ArchiveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='zhengshi', password='xwz123456')
+        author = Author.objects.create(name='巴金')
+        self.tag = Tag.objects.create(name='激流')
+        self.books = [
+            Book.objects.create(title=title, author=author, price=price, published_date='1933-01-01', owner=self.user)
+            for title, price in (('家', 30), ('春', 10), ('秋', 20), ('寒夜', 40))
+        ]
+        self.books[1].tags.add(self.tag)
+        # 把“春”“秋”改成很久以前修改的（QuerySet.update 不会触发 auto_now）
+        Book.objects.filter(pk__in=[self.books[1].pk, self.books[2].pk]).update(
+            updated_at=timezone.now() - timedelta(days=400)
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def archive(self):
+        call_command('archive_books', '--batch-size', '1', stdout=StringIO())
+
+    def titles(self, params):
+        response = self.api.get('/api/books/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['book_title'] for item in response.data['data']['results']], response.data['data']
+
+    def test_archive_moves_old_books_in_batches(self):
+        """测试只归档长时间没有修改的图书，标签关系一起移动，恢复后 id 不变"""
+        self.archive()
+        self.assertEqual(set(ArchivedBook.objects.values_list('title', flat=True)), {'春', '秋'})
+        self.assertEqual(list(ArchivedBook.objects.get(pk=self.books[1].pk).tags.all()), [self.tag])
+        self.assertEqual(Book.objects.count(), 2)
+        call_command('archive_books', '--restore', str(self.books[1].pk), stdout=StringIO())
+        restored = Book.objects.get(pk=self.books[1].pk)
+        self.assertEqual(list(restored.tags.all()), [self.tag])
+        self.assertFalse(ArchivedBook.objects.filter(pk=self.books[1].pk).exists())
+
+    def test_archive_and_restore_keep_borrowing_history(self):
+        """测试归档时已归还的借阅记录移到归档表，恢复后借阅记录回到借阅记录表，借出 / 归还时间不变"""
+        borrowed_at = timezone.now() - timedelta(days=500)
+        returned_at = borrowed_at + timedelta(days=10)
+        Borrowing.objects.create(book=self.books[2], user=self.user, borrowed_at=borrowed_at, returned_at=returned_at)
+        self.archive()
+        self.assertFalse(Borrowing.objects.exists())
+        archived = ArchivedBorrowing.objects.get(book_id=self.books[2].pk)
+        self.assertEqual((archived.user, archived.borrowed_at, archived.returned_at), (self.user, borrowed_at, returned_at))
+        call_command('archive_books', '--restore', str(self.books[2].pk), stdout=StringIO())
+        self.assertFalse(ArchivedBorrowing.objects.exists())
+        restored = Borrowing.objects.get(book_id=self.books[2].pk)
+        self.assertEqual((restored.user, restored.borrowed_at, restored.returned_at), (self.user, borrowed_at, returned_at))
+
+    def test_include_archived_merges_ordering_and_pages(self):
+        """测试默认只返回未归档的图书；include_archived 时按排序合并分页，过滤条件对两张表都生效"""
+        self.archive()
+        self.assertEqual(self.titles({})[0], ['家', '寒夜'])
+        titles, data = self.titles({'include_archived': 1, 'ordering': 'price', 'page_size': 3})
+        self.assertEqual((titles, data['count']), (['春', '秋', '家'], 4))
+        self.assertEqual(self.titles({'include_archived': 1, 'ordering': 'price', 'page_size': 3, 'p': 2})[0], ['寒夜'])
+        titles, data = self.titles({'include_archived': 1, 'tags': self.tag.pk, 'facets': 'tag'})
+        self.assertEqual(titles, ['春'])
+        self.assertEqual(data['facets']['tag'][0]['count'], 1)
+        self.assertEqual(self.titles({'include_archived': 1, 'max_price': 25})[0], ['春', '秋'])
+
+    def test_retrieve_archived_book(self):
+        """测试归档的图书默认 404，include_archived 时能查到，修改仍然 404"""
+        self.archive()
+        url = f'/api/books/{self.books[2].pk}/'
+        self.assertEqual(self.api.get(url).status_code, 404)
+        response = self.api.get(url, {'include_archived': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['book_title'], '秋')
+        self.assertEqual(self.api.patch(url, {'title': '秋（修订）'}, format='json').status_code, 404)
+
+
+# 分片测试：测试数据库里的 shard1 是另一个内存 SQLite 数据库
+@override_settings(BOOKS_SHARDS=['default', 'shard1'])
+class ShardingTest(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # 详情请求攒下的 shard1 浏览次数不要留给其它（不能访问 shard1 的）测试写回
+        self.addCleanup(viewcounts.view_counter.clear)
+        # 找到两个分别落在两个分片上的用户
+        self.users = {}
+        index = 0
+        while len(self.users) < 2:
+            user = User.objects.create_user(username=f'shard{index}', password='xwz123456')
+            self.users.setdefault(sharding.shard_for_owner(user.pk), user)
+            index += 1
+        self.alice, self.bob = self.users['default'], self.users['shard1']
+        self.staff = User.objects.create_user(username='shardadmin', password='xwz123456', is_staff=True)
+        self.author = Author.objects.create(name='老舍')
+        self.tag = Tag.objects.create(name='京味')
+        for title, price, owner in (('骆驼祥子', 30, self.alice), ('四世同堂', 50, self.bob),
+                                    ('茶馆', 20, self.bob), ('正红旗下', 40, self.alice)):
+            Book.objects.create(title=title, author=self.author, price=price, published_date='1936-01-01', owner=owner)
+
+    def client_for(self, user):
+        api = APIClient()
+        api.force_authenticate(user=user)
+        return api
+
+    def test_books_placed_on_owner_shard_with_global_ids(self):
+        """测试图书按拥有者落到对应分片，id 全局唯一；作者、用户同步到了分片"""
+        response = self.client_for(self.bob).post('/api/books/', {
+            'title': '月牙儿', 'author_id': self.author.pk, 'price': '18.00',
+            'published_date': '1935-01-01', 'tag_ids': [self.tag.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        book_id = response.data['data']['id']
+        self.assertEqual(set(Book.objects.using('default').values_list('title', flat=True)), {'骆驼祥子', '正红旗下'})
+        self.assertEqual(Book.objects.using('shard1').filter(owner=self.bob).count(), 3)
+        self.assertEqual(list(Book.objects.using('shard1').get(pk=book_id).tags.all()), [self.tag])
+        ids = [pk for alias in ('default', 'shard1') for pk in Book.objects.using(alias).values_list('id', flat=True)]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(Author.objects.using('shard1').filter(pk=self.author.pk, name='老舍').exists())
+
+    def test_owner_and_staff_lists(self):
+        """测试普通用户只查自己的分片；管理员的列表跨分片合并排序、分页"""
+        response = self.client_for(self.bob).get('/api/books/')
+        self.assertEqual([item['book_title'] for item in response.data['data']['results']], ['四世同堂', '茶馆'])
+        staff = self.client_for(self.staff)
+        data = staff.get('/api/books/', {'ordering': '-price', 'page_size': 3}).data['data']
+        self.assertEqual(data['count'], 4)
+        self.assertEqual([item['book_title'] for item in data['results']], ['四世同堂', '正红旗下', '骆驼祥子'])
+        data = staff.get('/api/books/', {'ordering': '-price', 'page_size': 3, 'p': 2}).data['data']
+        self.assertEqual([item['book_title'] for item in data['results']], ['茶馆'])
+        data = staff.get('/api/books/', {'max_price': 35, 'facets': 'author'}).data['data']
+        self.assertEqual([item['book_title'] for item in data['results']], ['骆驼祥子', '茶馆'])
+        self.assertEqual(data['facets']['author'][0]['count'], 2)
+
+    def test_search_only_touches_owner_shard(self):
+        """测试普通用户搜索只查自己分片上自己的图书，管理员跨分片搜索"""
+        with CaptureQueriesContext(connections['default']) as default_queries:
+            data = self.client_for(self.bob).get(reverse('book-search'), {'q': '茶'}).data['data']
+        self.assertEqual([item['book_title'] for item in data], ['茶馆'])
+        self.assertFalse([query for query in default_queries if 'books_book' in query['sql']])
+        self.assertEqual(self.client_for(self.alice).get(reverse('book-search'), {'q': '茶'}).data['data'], [])
+        data = self.client_for(self.staff).get(reverse('book-search'), {'q': '下'}).data['data']
+        self.assertEqual([item['book_title'] for item in data], ['正红旗下'])
+
+    def test_staff_retrieve_and_owner_change_moves_book(self):
+        """测试管理员按 id 查到其它分片的图书；修改拥有者后图书和标签关系搬到新分片"""
+        book = Book.objects.using('default').get(title='骆驼祥子')
+        book.tags.add(self.tag)
+        response = self.client_for(self.staff).get(f'/api/books/{book.pk}/')
+        self.assertEqual(response.data['data']['book_title'], '骆驼祥子')
+        # 图书在源分片的事务提交后才搬走
+        with self.captureOnCommitCallbacks(using='default', execute=True):
+            response = self.client_for(self.alice).patch(
+                f'/api/books/{book.pk}/', {'owner_id': self.bob.pk}, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(Book.objects.using('default').filter(pk=book.pk).exists())
+        self.assertFalse(Book.objects.using('default').filter(pk=book.pk).exists())
+        self.assertFalse(Book.tags.through.objects.using('default').filter(book_id=book.pk).exists())
+        moved = Book.objects.using('shard1').get(pk=book.pk)
+        self.assertEqual((moved.owner, list(moved.tags.all())), (self.bob, [self.tag]))
+        response = self.client_for(self.staff).get(f'/api/books/{book.pk}/')
+        self.assertEqual(response.data['data']['owner'], self.bob.username)
+
+    def test_cascade_delete_across_shards(self):
+        """测试分批删除作者时每个分片的图书都被删除，最后作者和各分片里的副本一起删除"""
+        self.assertEqual(cascade.run_delete('author', self.author.pk), {'deleted': 4, 'found': True})
+        for alias in ('default', 'shard1'):
+            self.assertFalse(Book.objects.using(alias).exists())
+            self.assertFalse(Author.objects.using(alias).filter(pk=self.author.pk).exists())
+
+
+# 写线程测试：写线程有自己的数据库连接，看不到 TestCase 事务里的数据，所以用 TransactionTestCase
+class WriterTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='laoshe', password='xwz123456')
+        self.author = Author.objects.create(name='沈从文')
+
+    def create_book(self, title):
+        return Book.objects.create(title=title, author=self.author, price=10, published_date='1934-01-01', owner=self.user)
+
+    def test_concurrent_writes_are_group_committed(self):
+        """测试多个线程同时写入：全部成功，合并成的事务数少于写操作数"""
+        book_writer = writer.Writer(max_delay=0.05)
+        self.addCleanup(book_writer.stop)
+        barrier = threading.Barrier(20)
+        book_ids, errors = [], []
+
+        def client(index):
+            try:
+                barrier.wait()
+                book_ids.append(book_writer.submit(self.create_book, f'边城{index}').pk)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(book_ids)), 20)
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(book_writer.writes, 20)
+        self.assertLess(book_writer.batches, 20)
+
+    def test_failed_write_only_rolls_back_itself(self):
+        """测试同一批里一个写操作失败只回滚它自己，异常交还给调用方"""
+        def fail():
+            self.create_book('失败的书')
+            raise ValueError('写入失败')
+
+        book_writer = writer.Writer()
+        self.addCleanup(book_writer.stop)
+        requests = [writer.WriteRequest(self.create_book, ('长河',), {}), writer.WriteRequest(fail, (), {})]
+        book_writer.commit_batch(requests)
+        self.assertEqual(book_writer.batches, 1)
+        self.assertTrue(Book.objects.filter(pk=requests[0].result.pk).exists())
+        self.assertIsInstance(requests[1].error, ValueError)
+        self.assertFalse(Book.objects.filter(title='失败的书').exists())
+        with self.assertRaises(ValueError):
+            book_writer.submit(fail)
+
+    def test_connection_cleanup_failure_does_not_kill_writer(self):
+        """测试清理数据库连接出错时整批失败、请求线程收到异常，写线程继续处理后面的写操作"""
+        book_writer = writer.Writer()
+        self.addCleanup(book_writer.stop)
+        with mock.patch('books.writer.close_old_connections', side_effect=DatabaseError('连接已断开')):
+            with self.assertRaises(DatabaseError):
+                book_writer.submit(self.create_book, '长河')
+        self.assertEqual(book_writer.submit(self.create_book, '边城').title, '边城')
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['边城'])
+
+    def test_submit_times_out_and_cancels_queued_write(self):
+        """测试写线程被占住时请求线程等待超时，排队中的写操作被取消、不会再执行"""
+        book_writer = writer.Writer(timeout=5)
+        self.addCleanup(book_writer.stop)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        blocker = threading.Thread(target=lambda: book_writer.submit(block))
+        blocker.start()
+        self.assertTrue(started.wait(5))
+        book_writer.timeout = 0.1
+        with self.assertRaises(WriterTimeoutError):
+            book_writer.submit(self.create_book, '长河')
+        release.set()
+        blocker.join()
+        self.assertEqual(book_writer.submit(self.create_book, '边城').title, '边城')
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['边城'])
+
+    def test_api_writes_go_through_writer(self):
+        """测试接口的新增、高亮经过写线程；已经在事务里时直接在当前线程执行"""
+        self.addCleanup(writer.get_writer('default').stop)
+        api = APIClient()
+        api.force_authenticate(user=self.user)
+        response = api.post('/api/books/', {
+            'title': '湘行散记', 'author_id': self.author.pk, 'price': '20.00', 'published_date': '1936-01-01',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        book_id = response.data['data']['id']
+        self.assertEqual(api.post(f'/api/books/{book_id}/highlight/').status_code, 200)
+        self.assertTrue(Book.objects.get(pk=book_id).is_highlighted)
+        self.assertGreaterEqual(writer.get_writer('default').writes, 2)
+        with transaction.atomic():
+            self.assertEqual(writer.submit('default', threading.get_ident), threading.get_ident())
+
+
+class InventoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.owner = User.objects.create_user(username='bingxin', password='xwz123456')
+        self.reader = User.objects.create_user(username='xiaohong', password='xwz123456')
+        author = Author.objects.create(name='冰心')
+        self.book = Book.objects.create(
+            title='繁星', author=author, price=15, published_date='1923-01-01', owner=self.owner, stock=1,
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.reader)
+
+    def test_borrow_and_return_other_users_book(self):
+        """测试可以借阅别人的图书：借出库存减 1，重复借阅报错，归还后库存加 1，重复归还报错"""
+        url = f'/api/books/{self.book.pk}/'
+        response = self.api.post(url + 'borrow/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['stock'], 0)
+        self.assertEqual(self.api.get('/api/books/borrowed/').data['data'][0]['book_title'], '繁星')
+        self.assertEqual(self.api.post(url + 'borrow/').data['error_code'], 'BOOK_ALREADY_BORROWED')
+        response = self.api.post(url + 'return/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['stock'], 1)
+        self.assertIsNotNone(response.data['data']['returned_at'])
+        self.assertEqual(self.api.post(url + 'return/').data['error_code'], 'BOOK_NOT_BORROWED')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 1)
+
+    def test_out_of_stock_uses_database_value(self):
+        """测试库存判断以数据库为准：内存里的旧库存还是 1 也借不出，失败时不留下借阅记录"""
+        stale = Book.objects.get(pk=self.book.pk)
+        inventory.borrow(self.book, self.owner)
+        self.assertEqual(stale.stock, 1)
+        with self.assertRaises(BookOutOfStockError):
+            inventory.borrow(stale, self.reader)
+        self.assertFalse(Borrowing.objects.filter(user=self.reader).exists())
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 0)
+
+    def test_saving_book_keeps_concurrent_stock_changes(self):
+        """测试修改书名时不会把读出来的旧库存写回去；拥有者明确修改库存时照常保存"""
+        stale = Book.objects.get(pk=self.book.pk)
+        inventory.borrow(self.book, self.reader)
+        stale.title = '春水'
+        stale.save()
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 0)
+        stale.stock = 5
+        stale.save()
+        self.assertEqual(Book.objects.get(pk=self.book.pk).stock, 5)
+
+
+class ViewCountTest(TestCase):
+    def setUp(self):
+        # 丢弃其它测试的详情请求攒下的浏览次数（测试回滚后图书 id 会重复使用）
+        viewcounts.view_counter.clear()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='yudafu', password='xwz123456')
+        author = Author.objects.create(name='郁达夫')
+        self.books = [
+            Book.objects.create(title=title, author=author, price=10, published_date='1921-01-01', owner=self.user)
+            for title in ('沉沦', '春风沉醉的晚上', '迟桂花')
+        ]
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def test_views_are_buffered_and_flushed_in_batches(self):
+        """测试浏览次数先攒在内存里，写回时增量相同的图书合并成一条 UPDATE，不覆盖其它修改"""
+        counter = viewcounts.ViewCounter(flush_interval=3600)
+        stale = Book.objects.get(pk=self.books[0].pk)
+        for book, count in zip(self.books, (3, 3, 1)):
+            for _ in range(count):
+                counter.increment(book)
+        self.assertEqual(Book.objects.filter(views__gt=0).count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counter.flush(), 3)
+        self.assertEqual(sum('UPDATE' in query['sql'] for query in queries.captured_queries), 2)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('views', flat=True)), [3, 3, 1])
+        self.assertEqual(counter.pending(), {})
+        stale.title = '沉沦（修订）'
+        stale.save()
+        self.assertEqual(Book.objects.get(pk=stale.pk).views, 3)
+
+    def test_popular_ranks_by_views_with_cached_ranking(self):
+        """测试详情接口计数，popular 按浏览次数排序；排名缓存期间不变，过期后反映新的浏览次数"""
+        for book, count in zip(self.books, (1, 2, 0)):
+            for _ in range(count):
+                self.assertEqual(self.api.get(f'/api/books/{book.pk}/').status_code, 200)
+        viewcounts.view_counter.flush()
+        titles = lambda: [item['book_title'] for item in self.api.get('/api/books/popular/').data['data']]
+        self.assertEqual(titles(), ['春风沉醉的晚上', '沉沦', '迟桂花'])
+        for _ in range(3):
+            self.api.get(f'/api/books/{self.books[2].pk}/')
+        viewcounts.view_counter.flush()
+        self.assertEqual(titles()[0], '春风沉醉的晚上')
+        cache.clear()
+        self.assertEqual(titles()[0], '迟桂花')
+        self.assertEqual(len(self.api.get('/api/books/popular/', {'limit': 1}).data['data']), 1)
+
+
+class SimilarBooksTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='zhangailing', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        zhang = Author.objects.create(name='张爱玲')
+        eileen = Author.objects.create(name='胡兰成')
+        self.tags = {name: Tag.objects.create(name=name) for name in ('上海', '爱情', '散文')}
+        self.books = {}
+        for title, author, tags in (('倾城之恋', zhang, ['上海', '爱情']), ('今生今世', eileen, ['上海', '爱情']),
+                                    ('金锁记', zhang, ['上海']), ('山河岁月', eileen, ['散文'])):
+            book = Book.objects.create(title=title, author=author, price=20, published_date='1944-01-01', owner=self.user)
+            book.tags.set([self.tags[name] for name in tags])
+            self.books[title] = book
+        similarity.rebuild()
+
+    def similar_titles(self, title):
+        return [similar.title for similar, _ in similarity.get_similar(self.books[title].pk, 20)]
+
+    def test_rebuild_ranks_by_shared_tags_and_author(self):
+        """测试全量计算：共同标签、同一个作者的图书排在前面，没有共同点的不推荐，接口返回相似度"""
+        self.assertEqual(set(self.similar_titles('倾城之恋')), {'今生今世', '金锁记'})
+        self.assertEqual(self.similar_titles('山河岁月'), ['今生今世'])
+        response = self.api.get(f'/api/books/{self.books["倾城之恋"].pk}/similar/', {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 1)
+        self.assertTrue(0 < response.data['data'][0]['similarity'] <= 1)
+        self.assertFalse(SimilarBookList.objects.filter(dirty_at__isnull=False).exists())
+
+    def test_tag_changes_refresh_incrementally(self):
+        """测试修改标签后标记过期并排一个刷新任务；增量刷新只更新受影响的图书，删除的图书从列表里去掉"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books['金锁记'].tags.add(self.tags['散文'])
+        self.assertTrue(Job.objects.filter(name=similarity.REFRESH_TASK).exists())
+        self.assertEqual(
+            list(SimilarBookList.objects.filter(dirty_at__isnull=False).values_list('book_id', flat=True)),
+            [self.books['金锁记'].pk],
+        )
+        self.assertGreater(similarity.refresh(), 0)
+        self.assertIn('金锁记', self.similar_titles('山河岁月'))
+        self.assertIn('山河岁月', self.similar_titles('金锁记'))
+        self.books['今生今世'].delete()
+        similarity.refresh()
+        self.assertNotIn('今生今世', self.similar_titles('倾城之恋'))
+        self.assertFalse(SimilarBookList.objects.filter(book_id=self.books['今生今世'].pk).exists())
+        self.assertFalse(SimilarBookList.objects.filter(dirty_at__isnull=False).exists())
+
+    def test_refresh_reads_only_affected_lists(self):
+        """测试增量刷新在数据库里过滤出包含过期图书的相似列表，不读整张表"""
+        book_id = self.books['金锁记'].pk
+        expected = {row.book_id for row in SimilarBookList.objects.all() if book_id in row.similar_ids}
+        self.assertTrue(expected)
+        self.assertEqual(set(similarity.get_lists_containing([book_id])), expected)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books['金锁记'].tags.add(self.tags['散文'])
+        with CaptureQueriesContext(connection) as queries:
+            similarity.refresh()
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'books_similarbooklist' in query['sql']]
+        self.assertTrue(reads)
+        self.assertTrue(all('WHERE' in sql for sql in reads))
+        self.assertIn('金锁记', self.similar_titles('山河岁月'))
+
+
+class PriceAnalyticsTest(TestCase):
+    def setUp(self):
+        # 快照是进程内的全局状态，测试之间的 id 会重复，每个测试重新加载
+        analytics.price_analytics.invalidate()
+        self.admin = User.objects.create_user(username='admin', password='xwz123456', is_staff=True)
+        self.user = User.objects.create_user(username='reader', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+        self.lu = Author.objects.create(name='鲁迅')
+        self.lao = Author.objects.create(name='老舍')
+        self.novel = Tag.objects.create(name='小说')
+        self.books = {}
+        for title, author, price, date in (('呐喊', self.lu, 10, '1923-08-01'), ('彷徨', self.lu, 20, '1926-08-01'),
+                                           ('骆驼祥子', self.lao, 30, '1939-03-01'), ('四世同堂', self.lao, 40, '1939-06-01')):
+            self.books[title] = Book.objects.create(
+                title=title, author=author, price=price, published_date=date, owner=self.admin
+            )
+        self.books['呐喊'].tags.add(self.novel)
+        self.books['骆驼祥子'].tags.add(self.novel)
+
+    def test_queries_match_expected_values(self):
+        """测试分位数、直方图、分组和趋势的结果，以及过滤条件"""
+        response = self.api.get('/api/analytics/', {'p': '50,90'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['count'], 4)
+        self.assertEqual(response.data['data']['average'], 25)
+        self.assertEqual(response.data['data']['percentiles'], {'50': 25, '90': 37})
+        response = self.api.get('/api/analytics/', {'tag': self.novel.pk, 'p': '50'})
+        self.assertEqual(response.data['data']['percentiles'], {'50': 20})
+        response = self.api.get('/api/analytics/histogram/', {'width': 15})
+        self.assertEqual([band['count'] for band in response.data['data']], [1, 1, 2])
+        response = self.api.get('/api/analytics/groups/', {'by': 'author'})
+        self.assertEqual(
+            [(row['name'], row['count'], row['median']) for row in response.data['data']], [('鲁迅', 2, 15), ('老舍', 2, 35)]
+        )
+        response = self.api.get('/api/analytics/groups/', {'by': 'tag'})
+        self.assertEqual([(row['name'], row['average']) for row in response.data['data']], [('小说', 20)])
+        response = self.api.get('/api/analytics/trend/', {'year_from': 1926})
+        self.assertEqual([(row['year'], row['average'], row['average_change']) for row in response.data['data']],
+                         [(1926, 20, None), (1939, 35, 75)])
+        response = self.api.get('/api/analytics/groups/', {'by': 'publisher'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error_code'], 'VALIDATION_ERROR')
+
+    def test_changes_are_applied_incrementally(self):
+        """测试改价格、加标签、新增和删除图书后，快照通过变更日志增量刷新，不整体重新加载"""
+        price_analytics = analytics.PriceAnalytics()
+        self.assertEqual(len(price_analytics.get_snapshot()), 4)
+        book = self.books['彷徨']
+        book.price = 100
+        book.save()
+        book.tags.add(self.novel)
+        self.books['四世同堂'].delete()
+        Book.objects.create(title='茶馆', author=self.lao, price=50, published_date='1957-07-01', owner=self.admin)
+        snapshot = price_analytics.get_snapshot()
+        summary = snapshot.summary(snapshot.mask(), [])
+        self.assertEqual((summary['count'], summary['max']), (4, 100))
+        self.assertEqual(snapshot.summary(snapshot.mask(tag_id=self.novel.pk), [])['count'], 3)
+        tag_id = self.novel.pk
+        self.novel.delete()
+        snapshot = price_analytics.get_snapshot()
+        self.assertEqual(snapshot.summary(snapshot.mask(tag_id=tag_id), [])['count'], 0)
+        self.assertEqual(price_analytics.full_loads, 1)
+
+    def test_admin_only(self):
+        """测试普通用户不能访问价格分析"""
+        self.api.force_authenticate(user=self.user)
+        self.assertEqual(self.api.get('/api/analytics/').status_code, 403)
+
+
+class BookCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='zhangsan', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        self.lu = Author.objects.create(name='鲁迅')
+        self.lao = Author.objects.create(name='老舍')
+        self.novel = Tag.objects.create(name='小说')
+        self.essay = Tag.objects.create(name='散文')
+
+    def counts(self):
+        return (
+            dict(Author.objects.values_list('name', 'book_count')),
+            dict(Tag.objects.values_list('name', 'book_count')),
+        )
+
+    def create_book(self, title, author):
+        return Book.objects.create(title=title, author=author, price=20, published_date='1923-08-01', owner=self.user)
+
+    def test_counts_follow_book_writes(self):
+        """测试新增、换作者、修改标签、批量创建、删除图书后计数都正确；修改作者名不会覆盖计数"""
+        book = self.create_book('呐喊', self.lu)
+        book.tags.add(self.novel, self.essay)
+        other = self.create_book('彷徨', self.lu)
+        other.tags.add(self.novel)
+        self.assertEqual(self.counts(), ({'鲁迅': 2, '老舍': 0}, {'小说': 2, '散文': 1}))
+        stale = Author.objects.get(pk=self.lu.pk)
+        other.author = self.lao
+        other.save()
+        book.tags.remove(self.essay)
+        stale.name = '周树人'
+        stale.save()
+        self.assertEqual(self.counts(), ({'周树人': 1, '老舍': 1}, {'小说': 2, '散文': 0}))
+        writes.bulk_create_books([
+            {'title': '茶馆', 'author': self.lao, 'price': 30, 'published_date': '1957-07-01',
+             'owner': self.user, 'tags': [self.essay]},
+        ])
+        other.tags.clear()
+        book.delete()
+        self.assertEqual(self.counts(), ({'周树人': 0, '老舍': 2}, {'小说': 0, '散文': 1}))
+
+    def test_reconcile_repairs_drift(self):
+        """测试 reconcile_book_counts 把计数修正成图书表里的实际数量"""
+        self.create_book('呐喊', self.lu).tags.add(self.novel)
+        Author.objects.update(book_count=99)
+        Tag.objects.filter(pk=self.essay.pk).update(book_count=-1)
+        out = StringIO()
+        call_command('reconcile_book_counts', stdout=out)
+        self.assertIn('作者 2 个，标签 1 个', out.getvalue())
+        self.assertEqual(self.counts(), ({'鲁迅': 1, '老舍': 0}, {'小说': 1, '散文': 0}))
+        self.assertEqual(bookcounts.reconcile(), {'authors': 0, 'tags': 0})
+
+    def test_sort_and_filter_by_book_count(self):
+        """测试作者、标签列表按图书数量排序和过滤"""
+        for title in ('呐喊', '彷徨'):
+            self.create_book(title, self.lu).tags.add(self.novel)
+        self.create_book('茶馆', self.lao)
+        response = self.api.get('/api/authors/', {'ordering': '-book_count'})
+        self.assertEqual([(item['name'], item['book_count']) for item in response.data['data']['results']],
+                         [('鲁迅', 2), ('老舍', 1)])
+        response = self.api.get('/api/tags/', {'min_books': 1})
+        self.assertEqual([item['name'] for item in response.data['data']['results']], ['小说'])
+
+
+class AuthorIncludeBooksTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='xwz123456', is_staff=True)
+        self.user = User.objects.create_user(username='zhangsan', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.admin)
+        self.lu = Author.objects.create(name='鲁迅')
+        self.lao = Author.objects.create(name='老舍')
+        self.novel = Tag.objects.create(name='小说')
+        for title, author, date, owner in (
+            ('呐喊', self.lu, '1923-08-01', self.user), ('彷徨', self.lu, '1926-08-01', self.admin),
+            ('朝花夕拾', self.lu, '1928-09-01', self.user), ('骆驼祥子', self.lao, '1939-03-01', self.admin),
+        ):
+            book = Book.objects.create(title=title, author=author, price=20, published_date=date, owner=owner)
+            book.tags.add(self.novel)
+
+    def titles(self, response):
+        return {
+            author['name']: [book['book_title'] for book in author['books']] for author in response.data['data']['results']
+        }
+
+    def test_latest_books_in_one_window_query(self):
+        """测试每个作者带上最新的 N 本书，图书用一条 ROW_NUMBER() 窗口函数查询取出"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/authors/', {'include_books': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles(response), {'鲁迅': ['朝花夕拾', '彷徨'], '老舍': ['骆驼祥子']})
+        self.assertEqual(response.data['data']['results'][0]['books'][0]['tags'][0]['name'], '小说')
+        book_queries = [query['sql'] for query in queries.captured_queries if 'books_book"' in query['sql']]
+        self.assertEqual(len(book_queries), 1)
+        self.assertIn('ROW_NUMBER', book_queries[0])
+        response = self.api.get('/api/authors/')
+        self.assertNotIn('books', response.data['data']['results'][0])
+
+    def test_visibility_and_validation(self):
+        """测试普通用户只看到自己的图书；详情接口也支持；参数不是整数时返回 400"""
+        self.api.force_authenticate(user=self.user)
+        response = self.api.get('/api/authors/', {'include_books': 5})
+        self.assertEqual(self.titles(response), {'鲁迅': ['朝花夕拾', '呐喊'], '老舍': []})
+        response = self.api.get(f'/api/authors/{self.lu.pk}/', {'include_books': 1})
+        self.assertEqual([book['book_title'] for book in response.data['data']['books']], ['朝花夕拾'])
+        self.assertEqual(self.api.get('/api/authors/', {'include_books': 'all'}).status_code, 400)
+
+
+class BulkTagUpdateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='zhangsan', password='xwz123456')
+        self.other = User.objects.create_user(username='lisi', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        author = Author.objects.create(name='鲁迅')
+        self.sale = Tag.objects.create(name='促销')
+        self.novel = Tag.objects.create(name='小说')
+        self.books = {}
+        for title, price, owner in (('呐喊', 20, self.user), ('彷徨', 30, self.user), ('野草', 40, self.user),
+                                    ('朝花夕拾', 50, self.other)):
+            self.books[title] = Book.objects.create(
+                title=title, author=author, price=price, published_date='1926-08-01', owner=owner
+            )
+        self.books['呐喊'].tags.add(self.novel, self.sale)
+        self.books['彷徨'].tags.add(self.novel)
+        self.books['朝花夕拾'].tags.add(self.novel)
+
+    def tag_titles(self, tag):
+        return set(Book.objects.filter(tags=tag).values_list('title', flat=True))
+
+    def test_filter_add_and_remove(self):
+        """测试按过滤条件加标签、去标签：只改自己的图书，已有的标签不重复计算，汇总表、图书数量、变更日志跟着更新"""
+        seq = changes.get_latest_seq()
+        response = self.api.post('/api/books/bulk-tags/', {
+            'filters': {'tags': str(self.novel.pk)}, 'add': [self.sale.pk], 'remove': [self.novel.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], {'matched': 2, 'added': 1, 'removed': 2})
+        self.assertEqual(self.tag_titles(self.sale), {'呐喊', '彷徨'})
+        self.assertEqual(self.tag_titles(self.novel), {'朝花夕拾'})
+        self.assertEqual(Tag.objects.get(pk=self.sale.pk).book_count, 2)
+        self.assertEqual(Tag.objects.get(pk=self.novel.pk).book_count, 1)
+        self.assertEqual(
+            CatalogRollup.objects.filter(dimension='tag', key=str(self.sale.pk)).values_list('book_count', 'price_total')
+            .get(), (2, 50)
+        )
+        self.assertEqual(
+            set(ChangeLogEntry.objects.filter(seq__gt=seq, kind='book').values_list('object_id', flat=True)),
+            {self.books['呐喊'].pk, self.books['彷徨'].pk},
+        )
+
+    def test_ownership_and_validation(self):
+        """测试 ids 里有别人的图书时返回 403 且不做修改；参数不合法时返回 400"""
+        response = self.api.post('/api/books/bulk-tags/', {
+            'ids': [self.books['野草'].pk, self.books['朝花夕拾'].pk], 'add': [self.sale.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['details'], {'ids': [self.books['朝花夕拾'].pk]})
+        self.assertEqual(self.tag_titles(self.sale), {'呐喊'})
+        response = self.api.post('/api/books/bulk-tags/', {'ids': [self.books['野草'].pk], 'add': [self.sale.pk]},
+                                 format='json')
+        self.assertEqual(response.data['data'], {'matched': 1, 'added': 1, 'removed': 0})
+        for body in ({'ids': [1], 'filters': {}, 'add': [self.sale.pk]}, {'ids': [1]}, {'ids': [1], 'add': [999]},
+                     {'filters': {'color': 'red'}, 'add': [self.sale.pk]}):
+            response = self.api.post('/api/books/bulk-tags/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['error_code'], 'VALIDATION_ERROR')
+
+    def test_tag_changes_invalidate_cached_counts(self):
+        """测试批量加标签、从标签这一侧加图书后，按标签过滤的列表计数缓存失效"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        poetry = Tag.objects.create(name='散文诗')
+        url = reverse('book-list')
+        self.assertEqual(self.api.get(url, {'tags': poetry.pk}).data['data']['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/books/bulk-tags/', {'filters': {}, 'add': [poetry.pk]}, format='json')
+        self.assertEqual(response.data['data']['added'], 3)
+        data = self.api.get(url, {'tags': poetry.pk}).data['data']
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 3)
+        essay = Tag.objects.create(name='杂文')
+        self.assertEqual(self.api.get(url, {'tags': essay.pk}).data['data']['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            essay.book_set.add(self.books['野草'])
+        self.assertEqual(self.api.get(url, {'tags': essay.pk}).data['data']['count'], 1)
+
+
+@override_settings(BOOKS_DELETE_BATCH_SIZE=2)
+class CascadeDeleteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='zhangsan', password='xwz123456')
+        self.reader = User.objects.create_user(username='lisi', password='xwz123456')
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+        self.lu = Author.objects.create(name='鲁迅')
+        self.lao = Author.objects.create(name='老舍')
+        self.novel = Tag.objects.create(name='小说')
+        for index in range(5):
+            book = Book.objects.create(
+                title=f'鲁迅{index}', author=self.lu, price=10, published_date='1926-08-01', owner=self.user
+            )
+            book.tags.add(self.novel)
+        self.kept = Book.objects.create(
+            title='骆驼祥子', author=self.lao, price=30, published_date='1939-03-01', owner=self.reader
+        )
+        archive.archive_batch([Book.objects.filter(author=self.lu).first().pk])
+
+    def test_author_delete_returns_job_and_deletes_in_batches(self):
+        """测试删除作者马上返回任务、重复删除返回同一个任务；任务分批删除图书、归档图书，最后删除作者"""
+        response = self.api.delete(f'/api/authors/{self.lu.pk}/')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['data']['id']
+        self.assertTrue(Author.objects.filter(pk=self.lu.pk).exists())
+        self.assertEqual(self.api.delete(f'/api/authors/{self.lu.pk}/').data['data']['id'], job_id)
+        call_command('run_jobs', '--burst', '--concurrency', '1', stdout=StringIO())
+        job = Job.objects.get(pk=job_id)
+        self.assertEqual(
+            (job.status, job.progress, job.result), (Job.STATUS_SUCCEEDED, 100, {'deleted': 5, 'found': True})
+        )
+        self.assertFalse(Author.objects.filter(pk=self.lu.pk).exists())
+        self.assertFalse(ArchivedBook.objects.exists())
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['骆驼祥子'])
+        self.assertEqual(Tag.objects.get(pk=self.novel.pk).book_count, 0)
+        self.assertEqual(CatalogRollup.objects.get(dimension='total').book_count, 1)
+
+    def test_delete_user_command(self):
+        """测试 delete_user 分批删除用户的图书和借阅记录（没归还的库存加回），每批报告一次进度，最后删除用户"""
+        inventory.borrow(self.kept, self.user)
+        progress = []
+        result = cascade.run_delete('user', self.user.pk, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(2, 6), (4, 6), (5, 6), (6, 6)])
+        self.assertEqual(result, {'deleted': 6, 'found': True})
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['骆驼祥子'])
+        # 没有归还的那本库存加了回来
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.stock, 1)
+        self.assertEqual(Author.objects.get(pk=self.lu.pk).book_count, 0)
+        out = StringIO()
+        call_command('delete_user', 'lisi', stdout=out)
+        self.assertIn('删除任务已提交', out.getvalue())
+        self.assertTrue(User.objects.filter(username='lisi').exists())
+        with self.assertRaises(CommandError):
+            call_command('delete_user', 'zhangsan', '--now', stdout=StringIO())
+
+
+def tearDownModule():
+    # 丢弃剩下的浏览次数，避免测试数据库销毁后、进程退出时写到真正的数据库里
+    viewcounts.view_counter.clear()
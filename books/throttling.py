@@ -18,6 +18,9 @@ class AdminUserThrottle(UserRateThrottle):
         print("=== AnonRateThrottle ===")
         print("用户:", request.user)
         print("是否认证:", request.user.is_authenticated)
+        # 批量请求的子请求：外层批量请求已经按子请求数量扣过次数，这里不再重复计数
+        if getattr(request, 'is_batch_subrequest', False):
+            return None
         # 匿名用户：交给 AnonRateThrottle 处理，这里不干预
         if not request.user.is_authenticated:
             return None
@@ -27,4 +30,24 @@ class AdminUserThrottle(UserRateThrottle):
         # 普通用户：走默认的 UserRateThrottle 逻辑（按 user.id 限流）
         # “调用父类的 get_cache_key() 方法，让 DRF 按照默认规则生成限流缓存键。”
         # “如果不是管理员，就按 DRF 默认的方式去限流（生成缓存键、计数、判断是否超限）。”
-        return super().get_cache_key(request, view)
\ No newline at end of file
+        return super().get_cache_key(request, view)
+
+    # `allow_request()`：DRF 默认每个请求只记 1 次；这里改成按视图的 `get_throttle_cost()` 记多次
+    # 比如一个包含 5 个子请求的批量请求（`/api/batch/`）记 5 次，和分别发 5 个请求扣减的次数一样
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        cost = view.get_throttle_cost(request) if hasattr(view, 'get_throttle_cost') else 1
+        self.history = self.cache.get(self.key, [])
+        self.now = self.timer()
+        # 去掉已经超出时间窗口的记录
+        while self.history and self.history[-1] <= self.now - self.duration:
+            self.history.pop()
+        if len(self.history) + cost > self.num_requests:
+            return self.throttle_failure()
+        self.history[:0] = [self.now] * cost
+        self.cache.set(self.key, self.history, self.duration)
+        return True
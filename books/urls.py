@@ -32,6 +32,14 @@ router = DefaultRouter()
 router.register(r'books', viewset=views.BookViewSet) #将 `BookViewSet` 注册到 `/api/books/`
 router.register(r'authors', viewset=views.AuthorViewSet)
 router.register(r'tags', viewset=views.TagViewSet)
+# ViewSet 没有 queryset，必须手动指定 basename（路由名为 stats-list、stats-authors 等）
+router.register(r'stats', viewset=views.CatalogStatsViewSet, basename='stats')
+# 价格分析（管理员）：/api/analytics/、/api/analytics/histogram/、/api/analytics/groups/、/api/analytics/trend/
+router.register(r'analytics', viewset=views.AnalyticsViewSet, basename='analytics')
+# 后台任务状态：/api/jobs/、/api/jobs/<id>/
+router.register(r'jobs', viewset=views.JobViewSet, basename='job')
+# 图书导出：/api/exports/、/api/exports/<id>/、/api/exports/<id>/download/
+router.register(r'exports', viewset=views.ExportViewSet, basename='export')
 
 
 
@@ -44,6 +52,12 @@ urlpatterns = [
     path('books-cbv/', views.BookList.as_view(), name='book-list-cbv'),
     path('books-generic/', views.BookListCreate.as_view(), name='book-list-generic'),
     path('books-detail/<int:pk>/', views.BookDetail.as_view(), name='book-detail-generic'), #💡 `<int:pk>`：Django 的路径转换器，表示“这里是一个整数，变量名叫 pk”
+    # 批量请求：一次执行多个子请求
+    path('batch/', views.BatchView.as_view(), name='batch'),
+    # 增量同步：返回游标之后的变化
+    path('changes/', views.ChangeFeedView.as_view(), name='changes'),
+    # 实时推送：图书变化的事件流（Server-Sent Events）
+    path('events/books/', views.book_events, name='book-events'),
     # `include(router.urls)` 会自动包含所有子路由，URL: http://127.0.0.1:8000/api/books/1/
     path('', include(router.urls)), # 包含所有自动生成的路由，包含：get获取全部图书，post添加图书，get/put/delete/patch单个图书获取或修改
 
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from . import sharding, writer
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# 浏览次数：每看一次详情就 `UPDATE books_book SET views = views + 1`，热门图书会被反复写同一行，数据库扛不住
+# | 步骤 | 说明                                                                                 |
+# | ---- | ------------------------------------------------------------------------------------ |
+# | 1    | 详情接口只在本进程内存里 +1（`Counter`，加锁，不碰数据库）                             |
+# | 2    | 距离上次写回超过 BOOKS_VIEWS_FLUSH_INTERVAL 秒、或者积压超过 BOOKS_VIEWS_MAX_PENDING 本时，由当时的请求顺便写回 |
+# | 3    | 写回时按“增量相同”分组：`UPDATE ... SET views = views + n WHERE id IN (...)`，一组一条语句，交给写线程合并提交 |
+# | 4    | 进程退出时也写回一次（`popular` 接口不主动写回：每个请求都写回的话又回到了频繁写库） |
+# 💡 `popular` 接口读的是预先算好、缓存 BOOKS_POPULAR_TTL 秒的前 N 名；
+#    有请求的进程里，浏览次数最多晚 BOOKS_VIEWS_FLUSH_INTERVAL + BOOKS_POPULAR_TTL 秒反映到排行里
+# 💡 不单独开后台线程：写回跟着请求走，调用方已经在事务里（比如测试用例）时就在当前事务里执行
+# ⚠️ 没有请求的空闲进程要等到下一个请求或者退出时才写回；进程被强制杀掉（kill -9）时还没写回的浏览次数会丢失，
+#    浏览次数只是统计用，可以接受
+POPULAR_CACHE_KEY = 'books:popular:{scope}:{limit}'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def add_views(using, increments):
+    """
+    把增量写回数据库
+    :param increments: {图书 id: 增量}
+    """
+    groups = defaultdict(list)
+    for book_id, count in increments.items():
+        groups[count].append(book_id)
+    for count, book_ids in groups.items():
+        Book.objects.using(using).filter(pk__in=book_ids).update(views=F('views') + count)
+
+
+class ViewCounter:
+    """
+    每个进程一个，攒浏览次数、定期写回
+    """
+    def __init__(self, flush_interval=None, max_pending=None):
+        self.flush_interval = get_setting('BOOKS_VIEWS_FLUSH_INTERVAL', 5) if flush_interval is None else flush_interval
+        self.max_pending = max_pending or get_setting('BOOKS_VIEWS_MAX_PENDING', 1000)
+        self.flushes = 0  # 写回过几次（统计用）
+        self._pending = defaultdict(Counter)  # {数据库别名: {图书 id: 增量}}
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def increment(self, book, count=1):
+        using = book._state.db or sharding.HOME_ALIAS
+        with self._lock:
+            pending = self._pending[using]
+            if book.pk not in pending:
+                self._size += 1
+            pending[book.pk] += count
+            due = self._size >= self.max_pending or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def pending(self):
+        """
+        :return: {图书 id: 还没写回的增量}
+        """
+        with self._lock:
+            result = Counter()
+            for increments in self._pending.values():
+                result.update(increments)
+            return result
+
+    def clear(self):
+        """
+        丢弃还没写回的增量（测试用）
+        """
+        with self._lock:
+            self._pending, self._size = defaultdict(Counter), 0
+
+    def flush(self):
+        """
+        把攒下的增量写回数据库
+        :return: 写回了多少本图书
+        """
+        with self._lock:
+            pending, self._pending, self._size = self._pending, defaultdict(Counter), 0
+            self._last_flush = time.monotonic()
+        total = 0
+        for using, increments in pending.items():
+            if not increments:
+                continue
+            try:
+                writer.submit(using, add_views, using, increments)
+            except Exception:
+                # 写回失败：放回去，下次再写（不影响顺便写回的那个请求）
+                logger.warning('浏览次数写回失败，稍后重试', exc_info=True)
+                with self._lock:
+                    for book_id, count in increments.items():
+                        if book_id not in self._pending[using]:
+                            self._size += 1
+                        self._pending[using][book_id] += count
+                continue
+            total += len(increments)
+        if total:
+            self.flushes += 1
+        return total
+
+
+view_counter = ViewCounter()
+
+
+def get_popular(querysets, scope, limit):
+    """
+    浏览次数最多的前 limit 本（按浏览次数倒序，相同时按 id）
+    排名（图书 id 列表）缓存 BOOKS_POPULAR_TTL 秒；图书数据每次重新查询，已删除的图书自然不会出现
+    :param querysets: 每个分片一个查询集（见 sharding.gather）
+    :param scope: 缓存范围（见 counting.scope_for_user）
+    """
+    key = POPULAR_CACHE_KEY.format(scope=scope, limit=limit)
+    ranking = cache.get(key)
+    if ranking is None:
+        # 每个分片各取前 limit 本（走 views 索引），合并后再取前 limit 本
+        candidates = [
+            row for queryset in querysets
+            for row in queryset.order_by('-views', 'id').values_list('id', 'views')[:limit]
+        ]
+        ranking = [book_id for book_id, views in sorted(candidates, key=lambda row: (-row[1], row[0]))[:limit]]
+        cache.set(key, ranking, get_setting('BOOKS_POPULAR_TTL', 60))
+    books = {
+        book.pk: book for queryset in querysets
+        for book in queryset.select_related('author', 'owner').prefetch_related('tags').filter(pk__in=ranking)
+    }
+    return [books[book_id] for book_id in ranking if book_id in books]
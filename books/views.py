@@ -1,15 +1,31 @@
 from pickle import FALSE
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Book, Author, Tag
-from .serializers import BookSerializer, AuthorSerializer, TagSerializer
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .models import Book, Author, Tag, CatalogRollup, Job, ArchivedBook, Borrowing
+from .serializers import (
+    BookSerializer, AuthorSerializer, TagSerializer, CatalogRollupSerializer, BatchRequestSerializer, JobSerializer,
+    ExportRequestSerializer, BorrowingSerializer, AuthorWithBooksSerializer, BulkTagUpdateSerializer,
+)
 from rest_framework.views import APIView
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
+from rest_framework.mixins import CreateModelMixin
 from .pagination import StandardResultsSetPagination
-from .filters import BookFilter
+from .filters import BookFilter, AuthorFilter, TagFilter
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated # 导入“仅认证用户可访问”的权限类
 from rest_framework.permissions import IsAuthenticatedOrReadOnly # 登录用户可读写，匿名用户只读
 from rest_framework.permissions import IsAdminUser # 只允许管理员访问
@@ -17,8 +33,16 @@ from .permissions import IsOwnerOrReadonly
 from .throttling import AdminUserThrottle
 from .exceptions import HighlightedBookCannotBeDeletedError, CoverImageTooLargeError
 from bookapi.utils import success_response,error_response
-from books.error_codes import VALIDATION_ERROR
+from books.error_codes import (
+    VALIDATION_ERROR, PERMISSION_DENIED, CHANGES_CURSOR_EXPIRED, UNAUTHORIZED, METHOD_NOT_ALLOWED, SERVICE_UNAVAILABLE, EXPORT_NOT_READY,
+    EXPORT_EXPIRED,
+)
 from bookapi.mixins import UnifiedResponseMixin
+from . import analytics, archive, batch, bulktags, cascade, changes, counting, events, exports, facets, inventory, rollups, sharding, writer
+from .hotset import hot_books
+from .idempotency import idempotent
+from .viewcounts import view_counter, get_popular
+from .similarity import get_similar
 from drf_spectacular.utils import extend_schema
 
 
@@ -157,11 +181,26 @@ class BookViewSet(ModelViewSet):
 
     throttle_classes = [AdminUserThrottle]  # 使用自定义限流类
 
+    # 批量创建：POST 的请求体是数组（`[{...}, {...}]`）时使用 many=True，
+    # 由 BookListSerializer 一次性校验、一条 INSERT 写入（见 books/writes.py）
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'create' and isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+            kwargs.setdefault('max_length', getattr(settings, 'BOOKS_BULK_CREATE_MAX_ITEMS', 500))
+        return super().get_serializer(*args, **kwargs)
+
     # 如何在创建图书时自动设置owner
     # `perform_create` 是 DRF 提供的钩子方法，在保存对象前调用。
     def perform_create(self, serializer):
         # 自动将当前登录用户设置为owner
-        serializer.save(owner=self.request.user)
+        # 写操作交给写线程，和其它请求的写入合并成一个事务提交（见 books/writer.py）
+        writer.submit(sharding.shard_for_owner(self.request.user.pk), serializer.save, owner=self.request.user)
+
+    def perform_update(self, serializer):
+        writer.submit(serializer.instance._state.db, serializer.save)
+
+    def perform_destroy(self, instance):
+        writer.submit(instance._state.db, instance.delete)
 
     # - get_queryset这是 DRF `ModelViewSet` 的核心方法之一。
     # - 它决定了 **列表（list）和详情（retrieve）接口返回哪些数据**。
@@ -171,9 +210,36 @@ class BookViewSet(ModelViewSet):
             return Book.objects.none()
         # 如果你的 `Book` 模型经常需要显示 `owner.username`，可以优化数据库查询：
         # `select_related('owner')` 会在一次 SQL 中 JOIN 用户表，避免 N+1 查询问题。
-        if self.request.user.is_staff:
-            return Book.objects.select_related('owner') # 减少数据库查询次数
-        return Book.objects.filter(owner = self.request.user)
+        # 借阅、归还可以操作任何人的图书
+        if self.request.user.is_staff or self.action in ('borrow', 'return_book'):
+            queryset = Book.objects.select_related('owner') # 减少数据库查询次数
+            # 开启分片时（见 books/sharding.py），详情、修改、删除先找到图书所在的分片；列表见 get_querysets()
+            pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+            if pk is not None and sharding.is_enabled():
+                queryset = queryset.using(sharding.locate_book(pk))
+            return queryset
+        # 普通用户的图书都在自己的分片上（没有开启分片时就是默认数据库）
+        return Book.objects.using(sharding.shard_for_owner(self.request.user.pk)).filter(owner = self.request.user)
+
+    def get_querysets(self):
+        """
+        列表类的查询：开启分片时管理员每个分片一个查询集（合并见 merge_querysets），其余情况只有一个
+        """
+        if self.request.user.is_authenticated and self.request.user.is_staff:
+            return sharding.gather(self.get_queryset())
+        return [self.get_queryset()]
+
+    def merge_querysets(self, querysets):
+        """
+        多个查询集合并成一个可以分页的列表：
+        - 同一个数据库里的图书表 + 归档表：UNION ALL 一条查询取出一页（archive.MergedBookList）
+        - 多个分片：每个分片分别查询再合并（sharding.ScatterGatherList）
+        """
+        if len(querysets) == 1:
+            return querysets[0]
+        if not sharding.is_enabled():
+            return archive.MergedBookList(*querysets)
+        return sharding.ScatterGatherList(querysets)
 
     # === 1. 过滤字段（支持 ?author=张三&price=39.90）===
     # **作用**：允许客户端通过 URL 参数 **精确匹配** 这两个字段
@@ -217,7 +283,9 @@ class BookViewSet(ModelViewSet):
         """
         # 按 `id` 字段 **降序排列**（`-` 表示倒序
         # 因为 `id` 越大表示创建越晚，所以最大的 5 个就是“最近添加的”
-        recent_books = Book.objects.order_by('-id')[:5]
+        # recent_books = Book.objects.order_by('-id')[:5]
+        # 直接读内存里的热点图书（见 books/hotset.py），不查数据库
+        recent_books = hot_books.get_recent()
         # #### `self.get_serializer(...)`
         # - 这是 `ModelViewSet` 提供的便捷方法
         # - 自动使用你在类中定义的 `serializer_class = BookSerializer`
@@ -237,7 +305,7 @@ class BookViewSet(ModelViewSet):
     # `detail=True`表示这个操作 **针对单个对象** → URL 会包含 `/pk/`
     # `pk=None` → DRF 会自动从 URL 中提取 `pk`（比如 `1`），并传进来
     @action(detail=True, methods=['post'])
-
+    @idempotent  # 支持 Idempotency-Key 请求头（见 books/idempotency.py）
     def highlight(self, request, pk=None):
         """
         给某本书加上高亮
@@ -248,13 +316,114 @@ class BookViewSet(ModelViewSet):
         # 2. 修改字段
         book.is_highlighted = True
         # book.is_highlighted = not book.is_highlighted  # 切换高亮状态，适用场景：用户可能重复点击“高亮”，这样每次点一次，就在 `true` 和 `false` 之间切换！
-        book.save() # 别忘了保存到数据库
+        writer.submit(book._state.db, book.save) # 别忘了保存到数据库（由写线程合并提交，见 books/writer.py）
         # 3. 返回更新后的数据
         serializer = self.get_serializer(book)
         # return Response(serializer.data, status= status.HTTP_200_OK)
         return success_response(serializer.data, message="给某本书添加高亮成功")
 
 
+    # 热门图书：GET /api/books/popular/?limit=10，按浏览次数倒序（管理员看全部，普通用户只看自己的）
+    # 💡 排名每 BOOKS_POPULAR_TTL 秒重新计算一次，浏览次数也是定期写回的，所以不是实时的（见 books/viewcounts.py）
+    @action(detail=False, methods=['get'])
+    def popular(self, request):
+        size = getattr(settings, 'BOOKS_POPULAR_SIZE', 20)
+        try:
+            limit = int(request.query_params.get('limit', size))
+        except ValueError:
+            limit = size
+        limit = max(1, min(limit, size))
+        books = get_popular(self.get_querysets(), counting.scope_for_user(request.user), limit)
+        serializer = self.get_serializer(books, many=True)
+        return success_response(data=serializer.data, message="获取热门图书成功")
+
+    # 相似图书：GET /api/books/<id>/similar/?limit=10，按共同的标签和作者推荐（预先算好的，见 books/similarity.py）
+    # 返回的每本书多一个 `similarity` 字段（0~1）
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        book = self.get_object()
+        size = getattr(settings, 'BOOKS_SIMILAR_TOP_K', 20)
+        try:
+            limit = int(request.query_params.get('limit', size))
+        except ValueError:
+            limit = size
+        pairs = get_similar(book.pk, max(1, min(limit, size)))
+        data = self.get_serializer([similar for similar, _ in pairs], many=True).data
+        for item, (_, score) in zip(data, pairs):
+            item['similarity'] = score
+        return success_response(data=data, message="获取相似图书成功")
+
+    # === 借阅（见 books/inventory.py）===
+    # | URL                              | 说明                                   |
+    # | -------------------------------- | -------------------------------------- |
+    # | `POST /api/books/<id>/borrow/`   | 借出一本，库存减 1；没有库存时返回 400  |
+    # | `POST /api/books/<id>/return/`   | 归还，库存加 1                          |
+    # | `GET /api/books/borrowed/`       | 我借着还没还的书                        |
+    # 💡 登录用户都可以借阅别人的图书，所以这几个接口不检查“是不是拥有者”
+    @extend_schema(summary="借阅图书", responses={200: BorrowingSerializer})
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    @idempotent
+    def borrow(self, request, pk=None):
+        book = self.get_object()
+        borrowing = writer.submit(book._state.db, inventory.borrow, book, request.user)
+        return success_response(BorrowingSerializer(borrowing).data, message="借阅成功")
+
+    @extend_schema(summary="归还图书", responses={200: BorrowingSerializer})
+    @action(detail=True, methods=['post'], url_path='return', permission_classes=[IsAuthenticated])
+    @idempotent
+    def return_book(self, request, pk=None):
+        book = self.get_object()
+        borrowing = writer.submit(book._state.db, inventory.return_book, book, request.user)
+        return success_response(BorrowingSerializer(borrowing).data, message="归还成功")
+
+    @action(detail=False, methods=['get'])
+    def borrowed(self, request):
+        # 借阅记录和图书在同一个分片上，每个分片查一次
+        querysets = sharding.gather(
+            Borrowing.objects.filter(user=request.user, returned_at__isnull=True).select_related('book')
+        )
+        borrowings = sorted(
+            (borrowing for queryset in querysets for borrowing in queryset), key=lambda borrowing: borrowing.borrowed_at,
+        )
+        return success_response(BorrowingSerializer(borrowings, many=True).data, message="获取借阅列表成功")
+
+    # 批量修改标签：POST /api/books/bulk-tags/（按批执行集合操作，见 books/bulktags.py）
+    # | 请求体                                                     | 说明                             |
+    # | ---------------------------------------------------------- | -------------------------------- |
+    # | `{"ids": [1, 2, 3], "add": [5], "remove": [7]}`            | 指定图书                         |
+    # | `{"filters": {"tags": "3", "min_price": 30}, "add": [5]}`  | 符合过滤条件的图书（参数同列表）  |
+    # 💡 和修改单本图书一样只能修改自己的图书（管理员也一样，见 IsOwnerOrReadonly）：
+    #    过滤条件只匹配自己的图书；ids 里有别人的、或者不存在的图书时整个请求返回 403，不做任何修改
+    @extend_schema(summary="批量修改标签", request=BulkTagUpdateSerializer)
+    @action(detail=False, methods=['post'], url_path='bulk-tags')
+    @idempotent
+    def bulk_tags(self, request):
+        serializer = BulkTagUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return error_response(
+                error_code=VALIDATION_ERROR,
+                message="请求参数有误",
+                details=serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        # 自己的图书都在自己的分片上
+        queryset = Book.objects.using(sharding.shard_for_owner(request.user.pk)).filter(owner=request.user)
+        if 'ids' in data:
+            queryset = queryset.filter(pk__in=set(data['ids']))
+            forbidden = set(data['ids']) - set(queryset.values_list('id', flat=True))
+            if forbidden:
+                return error_response(
+                    error_code=PERMISSION_DENIED,
+                    message="只能修改自己的图书",
+                    details={'ids': sorted(forbidden)},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        else:
+            queryset = BookFilter(data=data['filters'], queryset=queryset).qs
+        result = writer.submit(queryset.db, bulktags.update_tags, queryset, data['add'], data['remove'])
+        return success_response(result, message="批量修改标签成功")
+
     # 路由自动注册，只要注册了 `ViewSet`，DRF 会自动把 `@action` 映射到 URL
     # 自动映射的URL：http://127.0.0.1:8000/api/books/highlighted/
     # `@action(detail=False, methods=['get'])`：
@@ -266,7 +435,14 @@ class BookViewSet(ModelViewSet):
         # 过滤出is_highlighted=True的书籍
         # `self.get_queryset()`：安全获取当前查询集，支持分页、过滤等（即 `Book.objects.all()`）
         # - 可以安全地进行过滤、排序等操作
-        highlighted_books = self.get_queryset().filter(is_highlighted=True)
+        # highlighted_books = self.get_queryset().filter(is_highlighted=True)
+        # 优先读内存里的热点图书；高亮图书太多、内存里放不下时才查数据库
+        owner_id = None if request.user.is_staff else request.user.pk
+        highlighted_books = hot_books.get_highlighted(owner_id=owner_id)
+        if highlighted_books is None:
+            highlighted_books = self.merge_querysets(
+                [queryset.filter(is_highlighted=True).order_by('id') for queryset in self.get_querysets()]
+            )
         # 使用当前视图的序列化器，避免重复代码：
         # `self.get_serializer(..., many=True)`：
         # - 使用当前视图的序列化器（`BookSerializer`）
@@ -289,12 +465,25 @@ class BookViewSet(ModelViewSet):
                 details="没有搜索关键词",
                 status=status.HTTP_400_BAD_REQUEST
             )
-        results = self.queryset.filter(title__icontains=q)
+        # 和列表一样：管理员每个分片各查一次，普通用户只查自己分片上自己的图书
+        querysets = [queryset.filter(title__icontains=q).order_by('id') for queryset in self.get_querysets()]
+        if self.include_archived():
+            querysets += [queryset.filter(title__icontains=q) for queryset in self.get_archived_querysets()]
+        results = self.merge_querysets(querysets)
         serializer = self.get_serializer(results, many=True)
+        # 请求了分面统计（?facets=...）时，返回 {"results": [...], "facets": {...}}
+        facet_names = facets.parse_facets(request)
+        if facet_names:
+            data = {
+                'results': serializer.data,
+                'facets': self.compute_facets(querysets, facet_names),
+            }
+            return success_response(data=data, message="根据关键词搜索成功")
         # return Response(serializer.data)
         return success_response(data=serializer.data, message="根据关键词搜索成功")
 
     # 测试删除高亮图书时报自定义异常
+    @idempotent
     def destroy(self, request, *args, **kwargs):
         book = self.get_object()
         if book.is_highlighted:
@@ -302,6 +491,8 @@ class BookViewSet(ModelViewSet):
         response = super().destroy(request, *args, **kwargs)
         return success_response(data=response.data, message="图书删除成功", status=status.HTTP_204_NO_CONTENT)
     # 测试创建图书时传入过大的图片报自定义异常
+    # 客户端重试时带上同一个 Idempotency-Key，不会重复创建图书
+    @idempotent
     def create(self, request, *args, **kwargs):
         cover = request.FILES.get('cover_image')
         if cover and cover.size > 5 * 1024 * 1024:   # 5MB
@@ -309,26 +500,530 @@ class BookViewSet(ModelViewSet):
         response = super().create(request, *args, **kwargs)
         return success_response(data=response.data, message="图书创建成功", status=status.HTTP_201_CREATED)
 
+    # === 归档的图书（见 books/archive.py）===
+    # 默认只查图书表；`?include_archived=1` 时列表、搜索、详情同时查归档表
+    def include_archived(self):
+        return self.request.query_params.get('include_archived') in ('1', 'true')
+
+    def get_archived_querysets(self):
+        # 归档表和图书表在同一个分片上
+        queryset = ArchivedBook.objects.select_related('author', 'owner').prefetch_related('tags')
+        if self.request.user.is_staff:
+            return sharding.gather(queryset)
+        return [queryset.using(sharding.shard_for_owner(self.request.user.pk)).filter(owner=self.request.user)]
+
+    def filter_archived_queryset(self, queryset):
+        # DjangoFilterBackend 要求查询集的模型是 BookFilter 的模型（Book），这里直接用 BookFilter 过滤归档表
+        for backend in self.filter_backends:
+            if issubclass(backend, DjangoFilterBackend):
+                queryset = self.filterset_class(self.request.query_params, queryset=queryset, request=self.request).qs
+            else:
+                queryset = backend().filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def compute_facets(self, querysets, facet_names):
+        # 多个查询集（分片、归档表）各自统计，再按取值相加
+        limit = facets.parse_facet_limit(self.request)
+        if len(querysets) == 1:
+            return facets.compute_facets(querysets[0], facet_names, limit)
+        return archive.merge_facets(
+            [facets.compute_facets(queryset, facet_names, limit) for queryset in querysets], limit
+        )
+
     # 重写list方法
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
+        querysets = [self.filter_queryset(queryset) for queryset in self.get_querysets()]
+        if self.include_archived():
+            querysets += [self.filter_archived_queryset(queryset) for queryset in self.get_archived_querysets()]
+        if len(querysets) > 1:
+            page = self.paginate_queryset(self.merge_querysets(querysets))
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = super().list(request, *args, **kwargs)
+        # 分面统计：和分页结果使用同一组过滤条件（?facets=author,tag,year,price）
+        facet_names = facets.parse_facets(request)
+        if facet_names:
+            response.data['facets'] = self.compute_facets(querysets, facet_names)
         return success_response(data=response.data, message="图书列表获取成功")
 
     def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        return success_response(data=response.data, message="图书详情获取成功")
+        try:
+            book = self.get_object()
+        except Http404:
+            if not self.include_archived():
+                raise
+            for queryset in self.get_archived_querysets():
+                try:
+                    book = get_object_or_404(queryset, pk=kwargs['pk'])
+                except Http404:
+                    continue
+                return success_response(data=self.get_serializer(book).data, message="图书详情获取成功")
+            raise
+        # 浏览次数先记在内存里，定期批量写回（见 books/viewcounts.py）；归档的图书不计数
+        view_counter.increment(book)
+        return success_response(data=self.get_serializer(book).data, message="图书详情获取成功")
+    @idempotent  # PATCH（partial_update）也会调用这里
     def update(self, request, *args, **kwargs):
         response = super().update(request, *args, **kwargs)
         return success_response(data=response.data)
 # author对应的viewset
+# 作者、标签列表可以按图书数量排序、过滤（`book_count` 由信号维护，见 books/bookcounts.py）
+# | URL                                            | 说明                                   |
+# | ---------------------------------------------- | -------------------------------------- |
+# | `GET /api/authors/?ordering=-book_count`       | 图书最多的作者排在前面                 |
+# | `GET /api/tags/?min_books=10&max_books=100`    | 图书数量在范围内的标签                 |
+# | `GET /api/authors/?include_books=3`            | 每个作者带上最新出版的 3 本书（详情接口也支持） |
+# | `DELETE /api/authors/<id>/`                    | 提交后台删除任务，马上返回任务（202，见 books/cascade.py） |
 class AuthorViewSet(UnifiedResponseMixin, ModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    filterset_class = AuthorFilter
+    ordering_fields = ['book_count', 'name', 'id']
+    ordering = ['id']
+    max_include_books = 20
+
+    def get_include_books(self):
+        """
+        :raise ParseError: include_books 不是整数
+        """
+        value = self.request.query_params.get('include_books')
+        if value in (None, ''):
+            return 0
+        try:
+            return max(0, min(int(value), self.max_include_books))
+        except ValueError:
+            raise ParseError('include_books 必须是整数')
+
+    def get_book_querysets(self):
+        """
+        可以看到的图书：和图书列表一样，管理员看全部（开启分片时每个分片一个查询集），普通用户只看自己的
+        """
+        if self.request.user.is_staff:
+            return sharding.gather(Book.objects.all())
+        return [Book.objects.using(sharding.shard_for_owner(self.request.user.pk)).filter(owner=self.request.user)]
+
+    def get_latest_books(self, author_ids, limit):
+        """
+        每个作者最新出版的 limit 本书，一条查询取出（每个分片一条）：
+        `SELECT * FROM (SELECT ..., ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY published_date DESC, id DESC) AS rank
+        FROM books_book WHERE author_id IN (...)) WHERE rank <= limit`
+        💡 `prefetch_related('author__book_set')` 会把每个作者的全部图书读进内存；逐个作者查询是 N+1
+        :return: {作者 id: [图书]}
+        """
+        rank = Window(
+            RowNumber(), partition_by=F('author_id'), order_by=[F('published_date').desc(), F('id').desc()]
+        )
+        books = defaultdict(list)
+        for queryset in self.get_book_querysets():
+            queryset = (
+                queryset.filter(author_id__in=author_ids).annotate(rank=rank).filter(rank__lte=limit)
+                .select_related('author', 'owner').prefetch_related('tags')
+            )
+            for book in queryset:
+                books[book.author_id].append(book)
+        # 多个分片：每个分片各取了前 limit 本，合并后再取前 limit 本
+        return {
+            author_id: sorted(items, key=lambda book: (book.published_date, book.pk), reverse=True)[:limit]
+            for author_id, items in books.items()
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        limit = self.get_include_books() if self.action in ('list', 'retrieve') else 0
+        if not limit or not args:
+            return super().get_serializer(*args, **kwargs)
+        authors = args[0] if kwargs.get('many') else [args[0]]
+        context = self.get_serializer_context()
+        context['latest_books'] = self.get_latest_books([author.pk for author in authors], limit)
+        return AuthorWithBooksSerializer(*args, context=context, **kwargs)
+
+    # 作者的图书可能很多：不在请求里直接级联删除，改成后台任务分批删除
+    @extend_schema(summary="删除作者（后台分批删除作者的图书）", responses={202: JobSerializer})
+    def destroy(self, request, *args, **kwargs):
+        author = self.get_object()
+        job = cascade.request_delete(author, owner=request.user)
+        return success_response(
+            data=JobSerializer(job).data, message="删除任务已提交", status=status.HTTP_202_ACCEPTED
+        )
 
 
 class TagViewSet(UnifiedResponseMixin, ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    filterset_class = TagFilter
+    ordering_fields = ['book_count', 'name', 'id']
+    ordering = ['id']
 
 
+# 统计接口：直接读统计汇总表 `CatalogRollup`，不扫描图书表
+# | URL                        | 说明                       |
+# | -------------------------- | -------------------------- |
+# | `GET /api/stats/`          | 图书总数、价格合计、平均价 |
+# | `GET /api/stats/authors/`  | 每个作者的图书数量         |
+# | `GET /api/stats/tags/`     | 每个标签的图书数量         |
+# | `GET /api/stats/years/`    | 每个出版年份的图书数量     |
+# | `GET /api/stats/prices/`   | 价格区间直方图             |
+# 💡 `authors` / `tags` 支持 `?limit=20`（按图书数量取前 N 个）
+class CatalogStatsViewSet(ViewSet):
+    # 全站统计数据，只对管理员开放
+    permission_classes = [IsAdminUser]
+    max_limit = 100
 
+    def get_limit(self, request, default=20):
+        try:
+            limit = int(request.query_params.get('limit', default))
+        except ValueError:
+            limit = default
+        return max(1, min(limit, self.max_limit))
+
+    def get_rows(self, dimension):
+        return CatalogRollup.objects.filter(dimension=dimension, book_count__gt=0)
+
+    def list(self, request):
+        total = self.get_rows(CatalogRollup.DIMENSION_TOTAL).first() or CatalogRollup()
+        data = CatalogRollupSerializer(total).data
+        data.pop('key')
+        return success_response(data=data, message="获取统计数据成功")
+
+    @action(detail=False, methods=['get'])
+    def authors(self, request):
+        rows = self.get_rows(CatalogRollup.DIMENSION_AUTHOR).order_by('-book_count', 'key')[:self.get_limit(request)]
+        data = CatalogRollupSerializer(rows, many=True).data
+        names = dict(Author.objects.filter(pk__in=[row.key for row in rows]).values_list('id', 'name'))
+        for item in data:
+            item['author_id'] = int(item.pop('key'))
+            item['name'] = names.get(item['author_id'])
+        return success_response(data=data, message="获取作者统计成功")
+
+    @action(detail=False, methods=['get'])
+    def tags(self, request):
+        rows = self.get_rows(CatalogRollup.DIMENSION_TAG).order_by('-book_count', 'key')[:self.get_limit(request)]
+        data = CatalogRollupSerializer(rows, many=True).data
+        names = dict(Tag.objects.filter(pk__in=[row.key for row in rows]).values_list('id', 'name'))
+        for item in data:
+            item['tag_id'] = int(item.pop('key'))
+            item['name'] = names.get(item['tag_id'])
+        return success_response(data=data, message="获取标签统计成功")
+
+    @action(detail=False, methods=['get'])
+    def years(self, request):
+        rows = sorted(self.get_rows(CatalogRollup.DIMENSION_YEAR), key=lambda row: int(row.key))
+        data = CatalogRollupSerializer(rows, many=True).data
+        for item in data:
+            item['year'] = int(item.pop('key'))
+        return success_response(data=data, message="获取年份统计成功")
+
+    @action(detail=False, methods=['get'])
+    def prices(self, request):
+        width = rollups.get_price_band_width()
+        rows = sorted(self.get_rows(CatalogRollup.DIMENSION_PRICE_BAND), key=lambda row: int(row.key))
+        data = CatalogRollupSerializer(rows, many=True).data
+        for item in data:
+            item['min_price'] = int(item.pop('key'))
+            item['max_price'] = item['min_price'] + width  # 区间是 [min_price, max_price)
+        return success_response(data=data, message="获取价格分布成功")
+
+
+# 价格分析：读每个进程内存里的列式快照，NumPy 计算（见 books/analytics.py），只对管理员开放
+# | URL                                        | 说明                                             |
+# | ------------------------------------------ | ------------------------------------------------ |
+# | `GET /api/analytics/?p=50,90,99`           | 数量、平均价、最低价、最高价、分位数               |
+# | `GET /api/analytics/histogram/?width=10`   | 价格直方图（默认宽度是 BOOKS_PRICE_BAND_WIDTH）   |
+# | `GET /api/analytics/groups/?by=author`     | 按作者 / 标签 / 年份分组的价格分布（by=author/tag/year） |
+# | `GET /api/analytics/trend/`                | 逐年的数量、平均价、中位数和平均价的同比变化        |
+# 💡 都支持过滤条件 `?author=<id>&tag=<id>&year_from=2000&year_to=2010`
+class AnalyticsViewSet(ViewSet):
+    permission_classes = [IsAdminUser]
+    default_percentiles = [25, 50, 75, 90, 99]
+    max_limit = 100
+
+    def get_int_params(self, request, names):
+        """
+        :raise ParseError: 参数不是整数
+        """
+        values = {}
+        for name in names:
+            value = request.query_params.get(name)
+            if value in (None, ''):
+                continue
+            try:
+                values[name] = int(value)
+            except ValueError:
+                raise ParseError(f'{name} 必须是整数')
+        return values
+
+    def get_mask(self, request, snapshot):
+        params = self.get_int_params(request, ['author', 'tag', 'year_from', 'year_to'])
+        return snapshot.mask(
+            author_id=params.get('author'), tag_id=params.get('tag'),
+            year_from=params.get('year_from'), year_to=params.get('year_to'),
+        )
+
+    def validation_error(self, message):
+        return error_response(
+            error_code=VALIDATION_ERROR, message=message, details=message, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def list(self, request):
+        percentiles = self.default_percentiles
+        if request.query_params.get('p'):
+            try:
+                percentiles = [float(value) for value in request.query_params['p'].split(',')]
+            except ValueError:
+                return self.validation_error("p 必须是逗号分隔的数字")
+            if not all(0 <= value <= 100 for value in percentiles):
+                return self.validation_error("分位数必须在 0~100 之间")
+        snapshot = analytics.price_analytics.get_snapshot()
+        data = snapshot.summary(self.get_mask(request, snapshot), percentiles)
+        return success_response(data=data, message="获取价格分析成功")
+
+    @action(detail=False, methods=['get'])
+    def histogram(self, request):
+        try:
+            width = float(request.query_params.get('width', rollups.get_price_band_width()))
+        except ValueError:
+            return self.validation_error("width 必须是数字")
+        if width <= 0:
+            return self.validation_error("width 必须大于 0")
+        snapshot = analytics.price_analytics.get_snapshot()
+        data = snapshot.histogram(self.get_mask(request, snapshot), width)
+        return success_response(data=data, message="获取价格直方图成功")
+
+    @action(detail=False, methods=['get'])
+    def groups(self, request):
+        by = request.query_params.get('by', 'author')
+        if by not in analytics.GROUP_DIMENSIONS:
+            return self.validation_error(f"by 只能是 {'/'.join(analytics.GROUP_DIMENSIONS)}")
+        limit = max(1, min(self.get_int_params(request, ['limit']).get('limit', 20), self.max_limit))
+        snapshot = analytics.price_analytics.get_snapshot()
+        rows = snapshot.group_by(self.get_mask(request, snapshot), by)
+        if by == 'year':
+            for row in rows:
+                row['year'] = row.pop('key')
+            return success_response(data=rows, message="获取分组价格分布成功")
+        # 作者、标签：图书最多的前 limit 个，带上名字
+        rows = sorted(rows, key=lambda row: (-row['count'], row['key']))[:limit]
+        model = Author if by == 'author' else Tag
+        names = dict(model.objects.filter(pk__in=[row['key'] for row in rows]).values_list('id', 'name'))
+        for row in rows:
+            row[f'{by}_id'] = row.pop('key')
+            row['name'] = names.get(row[f'{by}_id'])
+        return success_response(data=rows, message="获取分组价格分布成功")
+
+    @action(detail=False, methods=['get'])
+    def trend(self, request):
+        snapshot = analytics.price_analytics.get_snapshot()
+        data = snapshot.trend(self.get_mask(request, snapshot))
+        return success_response(data=data, message="获取价格趋势成功")
+
+
+# 后台任务（任务队列见 books/jobs.py）
+# | URL                    | 说明                                         |
+# | ---------------------- | -------------------------------------------- |
+# | `GET /api/jobs/`       | 任务列表（普通用户只能看到自己提交的任务）   |
+# | `GET /api/jobs/<id>/`  | 任务状态、进度、执行结果、最近一次错误       |
+# | `POST /api/jobs/`      | 提交任务（只有管理员可以直接提交）           |
+class JobViewSet(UnifiedResponseMixin, CreateModelMixin, ReadOnlyModelViewSet):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    filterset_fields = ['status', 'name']
+
+    def get_permissions(self):
+        if self.action == 'create':
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    def get_queryset(self):
+        queryset = Job.objects.select_related('owner').order_by('-id')
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+# 下载接口直接返回文件：客户端的 Accept 不是 JSON（比如 `text/csv`）时也不返回 406
+class DownloadRenderer(BaseRenderer):
+    media_type = '*/*'
+    format = 'download'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)  # 只有出错时才会用到（返回错误信息）
+
+
+# 图书导出（后台生成文件，详细说明见 books/exports.py）
+# | URL                                | 说明                                     |
+# | ---------------------------------- | ---------------------------------------- |
+# | `POST /api/exports/`               | 提交导出；相同的导出在数据没变时直接复用 |
+# | `GET /api/exports/<id>/`           | 导出状态、进度，完成后返回 download_url  |
+# | `GET /api/exports/<id>/download/`  | 下载文件，支持 Range 断点续传            |
+class ExportViewSet(ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    def get_job(self, request, pk):
+        queryset = Job.objects.select_related('owner').filter(name=exports.EXPORT_TASK)
+        if not request.user.is_staff:
+            queryset = queryset.filter(owner=request.user)
+        return get_object_or_404(queryset, pk=pk)
+
+    def get_export_data(self, request, job):
+        data = JobSerializer(job).data
+        data['download_url'] = None
+        if job.status == Job.STATUS_SUCCEEDED:
+            data['download_url'] = request.build_absolute_uri(reverse('export-download', args=[job.pk]))
+        return data
+
+    @extend_schema(summary="提交图书导出", request=ExportRequestSerializer)
+    def create(self, request):
+        serializer = ExportRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return error_response(
+                error_code=VALIDATION_ERROR,
+                message="请求参数有误",
+                details=serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        job, reused = exports.request_export(request.user, data['format'], data['compression'], data['filters'])
+        # 已经生成好的文件直接可以下载（200），否则要等后台任务执行（202）
+        ready = reused and job.status == Job.STATUS_SUCCEEDED
+        return success_response(
+            data=self.get_export_data(request, job),
+            message="导出文件已生成" if ready else "导出任务已提交",
+            status=status.HTTP_200_OK if ready else status.HTTP_202_ACCEPTED,
+        )
+
+    @extend_schema(summary="查看图书导出状态")
+    def retrieve(self, request, pk=None):
+        job = self.get_job(request, pk)
+        return success_response(data=self.get_export_data(request, job), message="获取导出状态成功")
+
+    @extend_schema(summary="下载导出文件")
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, DownloadRenderer])
+    def download(self, request, pk=None):
+        job = self.get_job(request, pk)
+        if job.status != Job.STATUS_SUCCEEDED:
+            return error_response(
+                error_code=EXPORT_NOT_READY,
+                message="导出文件还没有生成完成",
+                status=status.HTTP_409_CONFLICT
+            )
+        if not exports.get_artifact_path(job.payload).exists():
+            return error_response(
+                error_code=EXPORT_EXPIRED,
+                message="导出文件已经被清理，请重新导出",
+                status=status.HTTP_410_GONE
+            )
+        return exports.file_response(request, job)
+
+
+# 批量请求接口：POST /api/batch/，一次执行多个图书 / 作者 / 标签接口（详细规则见 books/batch.py）
+class BatchView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [AdminUserThrottle]
+
+    def get_throttle_cost(self, request):
+        """
+        限流时这个请求按几次计算：子请求有几个就算几次
+        """
+        try:
+            data = request.data
+        except ParseError:
+            return 1  # 请求体不是合法的 JSON，后面校验时会返回 400
+        items = data.get('requests') if isinstance(data, dict) else None
+        return max(1, min(len(items), batch.get_max_requests())) if isinstance(items, list) else 1
+
+    @extend_schema(
+        summary="批量请求",
+        description="一次执行多个图书、作者、标签接口的请求，读请求并发执行，返回每个子请求的状态码和响应内容",
+        request=BatchRequestSerializer,
+    )
+    def post(self, request):
+        serializer = BatchRequestSerializer(data=request.data, context={'max_requests': batch.get_max_requests()})
+        if not serializer.is_valid():
+            return error_response(
+                error_code=VALIDATION_ERROR,
+                message="请求参数有误",
+                details=serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        items = serializer.validated_data['requests']
+        for index, item in enumerate(items):
+            item.setdefault('id', str(index))
+        return success_response(data=batch.execute_batch(request, items), message="批量请求执行完成")
+
+
+# 增量同步接口：GET /api/changes/?since=<游标>&limit=500（详细说明见 books/changes.py）
+# - 不传 since：只返回当前游标（第一次同步时先拿游标，再全量下载）
+# - 游标太旧（变更日志已被清理）：返回 410，客户端需要重新全量同步
+class ChangeFeedView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary="增量同步",
+        description="返回游标之后新增、修改、删除（墓碑记录）的图书、作者、标签",
+    )
+    def get(self, request):
+        since = request.query_params.get('since')
+        if not since:
+            data = {'changes': [], 'cursor': changes.encode_cursor(changes.get_latest_seq()), 'has_more': False}
+            return success_response(data=data, message="获取同步游标成功")
+        try:
+            since = changes.decode_cursor(since)
+            limit = int(request.query_params.get('limit', changes.DEFAULT_LIMIT))
+        except ValueError:
+            return error_response(
+                error_code=VALIDATION_ERROR,
+                message="since 或 limit 参数不正确",
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, changes.MAX_LIMIT))
+        try:
+            changes.check_cursor(since)
+        except changes.CursorExpired:
+            return error_response(
+                error_code=CHANGES_CURSOR_EXPIRED,
+                message="同步游标已过期，请重新全量同步",
+                status=status.HTTP_410_GONE
+            )
+        items, cursor, has_more = changes.get_changes(request.user, since, limit, context={'request': request})
+        data = {'changes': items, 'cursor': cursor, 'has_more': has_more}
+        return success_response(data=data, message="获取变更成功")
+
+
+# 图书变化实时推送（Server-Sent Events，见 books/events.py）
+# URL: GET /api/events/books/
+# 💡 这是 Django 原生的异步视图（不是 DRF 视图）：长连接不占用线程，需要用 ASGI 部署
+async def book_events(request):
+    if request.method != 'GET':
+        return JsonResponse(
+            {'success': False, 'error_code': METHOD_NOT_ALLOWED, 'message': "只支持 GET 请求", 'details': {}},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+    user = await sync_to_async(events.get_event_user)(request)
+    if user is None:
+        return JsonResponse(
+            {'success': False, 'error_code': UNAUTHORIZED, 'message': "请先登录", 'details': {}},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+    if events.get_broker().subscriber_count >= getattr(settings, 'BOOKS_EVENTS_MAX_CONNECTIONS', 10000):
+        return JsonResponse(
+            {'success': False, 'error_code': SERVICE_UNAVAILABLE, 'message': "实时推送连接数已满，请稍后重试", 'details': {}},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '5'},
+        )
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if last_event_id:
+        try:
+            last_event_id = changes.decode_cursor(last_event_id)
+        except ValueError:
+            return JsonResponse(
+                {'success': False, 'error_code': VALIDATION_ERROR, 'message': "Last-Event-ID 不正确", 'details': {}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+    else:
+        last_event_id = None
+    response = StreamingHttpResponse(events.stream_events(user, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 告诉 nginx 不要缓冲，事件立刻发给客户端
+    return response
@@ -0,0 +1,187 @@
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+from .exceptions import WriterTimeoutError
+
+# 单写线程 + 组提交：SQLite 同一时间只允许一个写事务，多个请求同时写入时互相等锁，等久了就报 “database is locked”
+# 写入接口（新增、修改、高亮、删除图书）不再各自开事务，而是把“要执行的写操作”交给本进程的写线程：
+# | 步骤 | 说明                                                                            |
+# | ---- | ------------------------------------------------------------------------------- |
+# | 1    | 请求线程提交写操作，等待结果                                                    |
+# | 2    | 写线程取出队列里积压的所有写操作（最多 BOOKS_WRITER_MAX_BATCH 个），放进同一个事务 |
+# | 3    | 每个写操作在自己的保存点（savepoint）里执行：一个失败只回滚它自己，不影响同批的其它操作 |
+# | 4    | 整批提交一次（一次磁盘同步），再把结果 / 异常交还给各个请求线程                  |
+# 💡 上一批提交期间新到的写操作自然攒成下一批，不需要故意等待；BOOKS_WRITER_MAX_DELAY 可以再多等一会儿攒更大的批
+# 💡 调用方已经在事务里（比如测试用例、`transaction.atomic()` 块里）时直接在当前线程执行，保持原来的事务语义
+# ⚠️ 请求线程最多等 BOOKS_WRITER_TIMEOUT 秒：还没轮到执行的写操作被取消，抛出 WriterTimeoutError（503）；
+#    已经开始执行的写操作结果未知（可能稍后提交），同样抛出 WriterTimeoutError
+# ⚠️ 写线程只合并同一个进程里的写入；多个 gunicorn worker 之间仍然靠 SQLite 的锁排队
+#    （settings.py 里配置了 `timeout` 和 `transaction_mode: IMMEDIATE`，等锁而不是直接报错）
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class WriteRequest:
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.started = False  # 写线程开始执行后为 True
+        self.cancelled = False  # 请求线程等待超时、取消后为 True
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        写线程执行前调用：已经被取消时返回 False
+        """
+        with self._lock:
+            self.started = not self.cancelled
+            return self.started
+
+    def cancel(self):
+        """
+        请求线程等待超时后调用：写线程还没开始执行时取消成功，返回 True
+        """
+        with self._lock:
+            self.cancelled = not self.started
+            return self.cancelled
+
+
+class Writer:
+    """
+    一个数据库（分片）一个写线程
+    """
+    def __init__(self, using='default', max_batch=None, max_delay=None, timeout=None):
+        self.using = using
+        self.max_batch = max_batch or get_setting('BOOKS_WRITER_MAX_BATCH', 100)
+        self.max_delay = get_setting('BOOKS_WRITER_MAX_DELAY', 0) if max_delay is None else max_delay
+        self.timeout = get_setting('BOOKS_WRITER_TIMEOUT', 30) if timeout is None else timeout
+        self.batches = 0  # 提交过的事务数（统计用）
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, func, *args, **kwargs):
+        """
+        在写线程里执行 func(*args, **kwargs)，等它所在的事务提交后返回结果（或者抛出它的异常）
+        :raises WriterTimeoutError: 超过 self.timeout 秒还没有处理完
+        """
+        if not get_setting('BOOKS_WRITER_ENABLED', True) or connections[self.using].in_atomic_block:
+            return func(*args, **kwargs)
+        request = WriteRequest(func, args, kwargs)
+        self.ensure_started()
+        self._queue.put(request)
+        if not request.done.wait(self.timeout):
+            if request.cancel():
+                raise WriterTimeoutError()
+            raise WriterTimeoutError('写入超时，结果未知，请确认后再重试')
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def ensure_started(self):
+        # gunicorn 预加载后 fork 出的子进程里没有父进程的线程，按进程号判断是否需要重新启动
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self.run, name=f'book-writer-{self.using}', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """
+        处理完已经提交的写操作后退出写线程
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def next_batch(self):
+        """
+        :return: 写操作列表；收到停止信号时返回 None
+        """
+        request = self._queue.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # 先把这一批做完再退出
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        try:
+            while True:
+                batch = self.next_batch()
+                if batch is None:
+                    return
+                self.commit_batch(batch)
+        finally:
+            connections.close_all()
+
+    def commit_batch(self, batch):
+        """
+        在一个事务里执行一批写操作，提交之后（`on_commit` 回调也执行完之后）通知各个请求线程
+        """
+        try:
+            # 清理失效的连接也放在 try 里：出错时整批失败，但每个请求线程都会收到通知，写线程也不会退出
+            close_old_connections()
+            with transaction.atomic(using=self.using):
+                for request in batch:
+                    if not request.start():
+                        continue
+                    try:
+                        with transaction.atomic(using=self.using):
+                            request.result = request.func(*request.args, **request.kwargs)
+                    except Exception as exc:
+                        request.error = exc
+        except Exception as exc:
+            # 提交失败：整批都没有写入
+            for request in batch:
+                request.result, request.error = None, request.error or exc
+        finally:
+            self.batches += 1
+            self.writes += len(batch)
+            for request in batch:
+                request.done.set()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(using='default'):
+    with _writers_lock:
+        writer = _writers.get(using)
+        if writer is None:
+            writer = _writers[using] = Writer(using)
+        return writer
+
+
+def submit(using, func, *args, **kwargs):
+    """
+    把写操作交给数据库 using 的写线程执行
+    """
+    return get_writer(using).submit(func, *args, **kwargs)
@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+from . import sharding
+from .models import Book, Tag
+from .signals import books_bulk_created
+
+# 图书写入路径：尽量少执行 SQL
+# | 步骤             | 以前                                       | 现在                                   |
+# | ---------------- | ------------------------------------------ | -------------------------------------- |
+# | 校验 id          | 每个 author_id / owner_id / tag_id 各查一次 | 每个模型一条 `WHERE id IN (...)`（见 BookSerializer） |
+# | 保存图书和封面   | INSERT 之后再 UPDATE 一次封面              | 封面随 INSERT 一起写入                 |
+# | 新书的标签       | `tags.set()`：先查已有关系，再 INSERT      | 新书肯定没有关系，直接批量 INSERT      |
+# | 批量创建         | 每本书走一遍上面的流程                     | 一条批量 INSERT 图书 + 一条批量 INSERT 标签关系 |
+# | 返回数据         | 再查一次标签                               | 直接用校验时查到的标签对象             |
+# 💡 所有步骤都在同一个事务里，中途失败会整体回滚（开启分片时批量创建按分片分组，每个分片一个事务）
+
+
+def unique_tags(tags):
+    # 去重并按 id 排序（和 `book.tags.all()` 查询出来的顺序一致）
+    return sorted({tag.pk: tag for tag in tags}.values(), key=lambda tag: tag.pk)
+
+
+def set_prefetched_tags(book, tags):
+    """
+    把已经查到的标签放进 Django 的预取缓存，序列化时 `book.tags.all()` 不会再查数据库
+    """
+    queryset = book.tags.all()
+    queryset._result_cache = unique_tags(tags)
+    queryset._prefetch_done = True
+    book._prefetched_objects_cache = {'tags': queryset}
+
+
+def add_tags_to_new_book(book, tags, using):
+    """
+    给刚创建的图书添加标签：新书不可能已有标签关系，跳过 `tags.add()` 里“查询已有关系”的那条 SQL
+    手动发送 m2m_changed 信号，统计汇总表、热点图书照常更新
+    """
+    tag_ids = {tag.pk for tag in tags}
+    if not tag_ids:
+        return
+    through = Book.tags.through
+    signal_kwargs = dict(sender=through, instance=book, reverse=False, model=Tag, pk_set=tag_ids, using=using)
+    m2m_changed.send(action='pre_add', **signal_kwargs)
+    through.objects.using(using).bulk_create([through(book_id=book.pk, tag_id=tag_id) for tag_id in tag_ids])
+    m2m_changed.send(action='post_add', **signal_kwargs)
+
+
+def create_book(validated_data):
+    tags = validated_data.pop('tags', [])
+    book = Book(**validated_data)  # 封面图片（cover_image）也在里面，随 INSERT 一起保存
+    using = router.db_for_write(Book, instance=book)
+    with transaction.atomic(using=using):
+        book.save(using=using)
+        add_tags_to_new_book(book, tags, using)
+    set_prefetched_tags(book, tags)
+    return book
+
+
+def update_book(book, validated_data):
+    # 和原来的行为保持一致：不传 tag_ids（或传空列表）时不修改标签
+    tags = validated_data.pop('tags', None)
+    using = router.db_for_write(Book, instance=book)
+    with transaction.atomic(using=using):
+        for attr, value in validated_data.items():
+            setattr(book, attr, value)
+        book.save(using=using)  # 封面图片和其它字段在同一条 UPDATE 里
+        if tags:
+            book.tags.set(tags)
+    if tags:
+        set_prefetched_tags(book, tags)
+    return book
+
+
+def bulk_create_books(rows):
+    """
+    批量创建图书：一条 INSERT 写入所有图书，一条 INSERT 写入所有标签关系
+    `bulk_create` 不发送 post_save / m2m_changed 信号，改为发送一次 `books_bulk_created` 信号
+    :param rows: 校验后的数据列表（每项和 BookSerializer 的 validated_data 相同）
+    """
+    tags_per_book = [unique_tags(row.pop('tags', [])) for row in rows]
+    books = [Book(**row) for row in rows]
+    sharding.assign_ids(books)
+    # 按图书所在的分片分组（没有开启分片时只有一组）
+    groups = defaultdict(list)
+    for book, tags in zip(books, tags_per_book):
+        groups[router.db_for_write(Book, instance=book)].append((book, tags))
+    through = Book.tags.through
+    for using, group in groups.items():
+        group_books = [book for book, _ in group]
+        with transaction.atomic(using=using):
+            Book.objects.using(using).bulk_create(group_books)
+            tag_links = [(book.pk, tag.pk) for book, tags in group for tag in tags]
+            through.objects.using(using).bulk_create(
+                [through(book_id=book_id, tag_id=tag_id) for book_id, tag_id in tag_links]
+            )
+            books_bulk_created.send(sender=Book, books=group_books, tag_links=tag_links, using=using)
+    for book, tags in zip(books, tags_per_book):
+        set_prefetched_tags(book, tags)
+    return books
+